@@ -1,16 +1,88 @@
 #!/usr/bin/python
 
+import copy
+import json
+import logging
 import os
+import re
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
 
-from converter.avcodecs import video_codec_list, audio_codec_list, subtitle_codec_list, decoder_codec_list
-from converter.formats import format_list
-from converter.ffmpeg import FFMpeg, parse_time, timecode_to_seconds, FFMpegError
+from converter import registry
+from converter.ffmpeg import FFMpeg, parse_time, parse_vstats, summarize, timecode_to_seconds, FFMpegError
+from converter.cache import LoudnessCache, PassLogCache, ResultCache
+from converter.filters import split_chain
+from converter.tuning import PresetTuner, CrfTuner
+
+__all__ = ['Converter', 'ConversionPlan', 'ConverterError', 'FFMpegError', 'LoudnessCache', 'PassLogCache',
+           'ResultCache', 'PresetTuner', 'CrfTuner', 'is_faststart']
+
+logger = logging.getLogger(__name__)
 
 
 class ConverterError(Exception):
     pass
 
 
+passlog_cache = PassLogCache()
+loudness_cache = LoudnessCache()
+
+
+class ConversionPlan(object):
+    """
+    Compiled conversion options, see Converter.compile().
+
+    The options are validated and copied when the plan is compiled, and
+    are not changed afterwards: the plan can be shared by several
+    conversions, also from different threads.
+    """
+
+    MAX_SOURCES = 32
+
+    def __init__(self, converter, options):
+        self._converter = converter
+        self._options = copy.deepcopy(options)
+        self._static = {None: converter._static_options(self._options)}
+        self._video = OrderedDict()
+        self._lock = threading.Lock()
+
+    def options(self):
+        """
+        Return a copy of the compiled options.
+        """
+        return copy.deepcopy(self._options)
+
+    def optlist(self, info=None, twopass=None, passlogfile=None):
+        """
+        Return the ffmpeg option list for a source, described by its probe
+        info (None if unknown), and the two-pass parameters as for
+        Converter.parse_options(). The returned list is a new one, which
+        the caller may change.
+        """
+        # only the first pass has its own audio and format options
+        first = 1 if twopass == 1 else None
+        with self._lock:
+            if first not in self._static:
+                self._static[first] = self._converter._static_options(self._options, first)
+            before, after = self._static[first]
+
+            options = self._options
+            if info is not None:
+                options = Converter._source_options(options, info)
+            v = options.get('video', {})
+            key = (v.get('src_width'), v.get('src_height'), v.get('src_rotate'))
+            video = self._video.pop(key, None)
+            if video is None:
+                video = self._converter._video_options(options)
+            self._video[key] = video
+            while len(self._video) > self.MAX_SOURCES:
+                self._video.popitem(last=False)
+
+        return before + video + after + Converter._pass_options(twopass, passlogfile)
+
+
 class Converter(object):
     """
     Converter class, encapsulates formats and codecs.
@@ -18,42 +90,141 @@ class Converter(object):
     >>> c = Converter()
     """
 
-    def __init__(self, ffmpeg_path=None, ffprobe_path=None):
+    MAX_PLANS = 128
+    _shared = {}
+    _shared_lock = threading.Lock()
+
+    def __init__(self, ffmpeg_path=None, ffprobe_path=None, result_cache=None):
         """
         Initialize a new Converter object.
+
+        The optional result_cache (a ResultCache) makes convert() give back
+        the existing output of an identical conversion instead of encoding
+        it again.
+        """
+        self.result_cache = result_cache
+        self._plans = OrderedDict()
+        self._plans_lock = threading.Lock()
+
+        self.ffmpeg = FFMpeg.shared(ffmpeg_path=ffmpeg_path,
+                                    ffprobe_path=ffprobe_path)
+
+        # Codec and format classes are looked up in the shared registries,
+        # loaded on first use.
+        self.video_codecs = registry.video_codecs
+        self.audio_codecs = registry.audio_codecs
+        self.subtitle_codecs = registry.subtitle_codecs
+        self.decoder_codecs = registry.decoder_codecs
+        self.formats = registry.formats
+
+    @classmethod
+    def shared(cls, ffmpeg_path=None, ffprobe_path=None):
+        """
+        Return a Converter shared by all the callers asking for the same
+        ffmpeg binaries, for services which would otherwise create a new
+        Converter for each request. The shared Converter can be used from
+        several threads at once, each conversion keeping its state in its
+        own generator.
+
+        >>> c = Converter.shared()
+        >>> c is Converter.shared()
+        True
+        """
+        key = (cls, ffmpeg_path, ffprobe_path)
+        ffmpeg = FFMpeg.shared(ffmpeg_path=ffmpeg_path, ffprobe_path=ffprobe_path)
+        with cls._shared_lock:
+            converter = cls._shared.get(key)
+            # A replaced binary gives a new Converter, the ones in use are
+            # not modified.
+            if converter is None or converter.ffmpeg is not ffmpeg:
+                converter = cls._shared[key] = cls(ffmpeg_path=ffmpeg_path, ffprobe_path=ffprobe_path)
+        return converter
+
+    def parse_options(self, opt, twopass=None, passlogfile=None):
+        """
+        Parse format/codec options and prepare raw ffmpeg option list.
+
+        For two-pass encoding, twopass is the pass (1 or 2) and passlogfile
+        the prefix of the statistics files shared by both passes. The first
+        pass only produces these statistics and is sent to the null muxer.
+        """
+        before, after = self._static_options(opt, twopass)
+        return before + self._video_options(opt) + after + self._pass_options(twopass, passlogfile)
+
+    def compile(self, options):
+        """
+        Compile the conversion options in a ConversionPlan, which produces
+        the ffmpeg option list of each source without parsing the options
+        again: the source independent part of the list (audio, subtitle,
+        decoder, format...) is built once and the video part is only built
+        once per source size, rotation and crop.
+
+        The last compiled plans are cached, so compiling equal options
+        again gives back the same plan. convert() compiles its options, and
+        also accepts a plan instead of the options.
+
+        >>> plan = Converter().compile({
+        ...    'format': 'mp4',
+        ...    'audio': {'codec': 'aac'},
+        ...    'video': {'codec': 'h264', 'max_width': 1280, 'max_height': 720,
+        ...              'sizing_policy': 'ShrinkToFit'}})
+        >>> for name in files:
+        ...    for timecode in c.convert(name, name + '.mp4', plan):
+        ...        pass
         """
+        if isinstance(options, ConversionPlan):
+            return options
 
-        self.ffmpeg = FFMpeg(ffmpeg_path=ffmpeg_path,
-                             ffprobe_path=ffprobe_path)
-        self.video_codecs = {}
-        self.audio_codecs = {}
-        self.subtitle_codecs = {}
-        self.decoder_codecs = {}
-        self.formats = {}
+        if not isinstance(options, dict):
+            raise ConverterError('Invalid output specification')
 
-        for cls in decoder_codec_list:
-            name = cls.codec_name
-            self.decoder_codecs[name] = cls
-        
-        for cls in audio_codec_list:
-            name = cls.codec_name
-            self.audio_codecs[name] = cls
+        key = json.dumps(options, sort_keys=True, default=repr)
+        with self._plans_lock:
+            plan = self._plans.pop(key, None)
+            if plan is None:
+                plan = ConversionPlan(self, options)
+            self._plans[key] = plan
+            while len(self._plans) > self.MAX_PLANS:
+                self._plans.popitem(last=False)
+        return plan
+
+    @staticmethod
+    def _pass_options(twopass, passlogfile=None):
+        optlist = []
+        if twopass == 1:
+            optlist.extend(['-pass', '1'])
+        elif twopass == 2:
+            optlist.extend(['-pass', '2'])
+
+        if twopass and passlogfile:
+            optlist.extend(['-passlogfile', passlogfile])
+        return optlist
 
-        for cls in video_codec_list:
-            name = cls.codec_name
-            self.video_codecs[name] = cls
+    def _video_options(self, opt):
+        """
+        Return the video part of the ffmpeg option list, the only one which
+        depends on the source.
+        """
+        if 'video' not in opt:
+            opt_video = {'codec': None}
+        else:
+            opt_video = opt['video']
+            if not isinstance(opt_video, dict) or 'codec' not in opt_video:
+                raise ConverterError('Invalid video codec specification')
 
-        for cls in subtitle_codec_list:
-            name = cls.codec_name
-            self.subtitle_codecs[name] = cls
+        c = opt_video['codec']
+        if c not in self.video_codecs:
+            raise ConverterError('Requested unknown video codec ' + str(c))
 
-        for cls in format_list:
-            name = cls.format_name
-            self.formats[name] = cls
+        video_options = self.video_codecs[c]().parse_options(opt_video)
+        if video_options is None:
+            raise ConverterError('Unknown video codec error')
+        return video_options
 
-    def parse_options(self, opt, twopass=None):
+    def _static_options(self, opt, twopass=None):
         """
-        Parse format/codec options and prepare raw ffmpeg option list.
+        Return the parts of the ffmpeg option list placed before and after
+        the video options, which don't depend on the source.
         """
         if not isinstance(opt, dict):
             raise ConverterError('Invalid output specification')
@@ -68,6 +239,8 @@ class Converter(object):
         format_options = self.formats[f]().parse_options(opt)
         if format_options is None:
             raise ConverterError('Unknown container format error')
+        if twopass == 1:
+            format_options = ['-f', 'null']
 
             
         if 'audio' not in opt and 'video' not in opt:
@@ -101,25 +274,23 @@ class Converter(object):
         if c not in self.audio_codecs:
             raise ConverterError('Requested unknown audio codec ' + str(c))
 
+        fmt = self.formats[f]
+        if fmt.audio_codecs is not None and c not in fmt.audio_codecs:
+            raise ConverterError('Audio codec {0} not supported by format {1}'.format(c, f))
+
         audio_options = self.audio_codecs[c]().parse_options(opt_audio)
         if audio_options is None:
             raise ConverterError('Unknown audio codec error')
 
-        # video options
-        if 'video' not in opt:
-            opt_video = {'codec': None}
-        else:
+        # video options are parsed by _video_options()
+        if 'video' in opt:
             opt_video = opt['video']
             if not isinstance(opt_video, dict) or 'codec' not in opt_video:
                 raise ConverterError('Invalid video codec specification')
-
-        c = opt_video['codec']
-        if c not in self.video_codecs:
-            raise ConverterError('Requested unknown video codec ' + str(c))
-
-        video_options = self.video_codecs[c]().parse_options(opt_video)
-        if video_options is None:
-            raise ConverterError('Unknown video codec error')
+            if opt_video['codec'] not in self.video_codecs:
+                raise ConverterError('Requested unknown video codec ' + str(opt_video['codec']))
+            if fmt.video_codecs is not None and opt_video['codec'] not in fmt.video_codecs:
+                raise ConverterError('Video codec {0} not supported by format {1}'.format(opt_video['codec'], f))
 
         if 'subtitle' not in opt:
             opt_subtitle = {'codec': None}
@@ -168,23 +339,56 @@ class Converter(object):
             mqs = opt['max_muxing_queue_size']
             format_options.extend(['-max_muxing_queue_size', str(mqs)])
 
-        # aggregate all options
-        optlist = audio_options + video_options + subtitle_options + decoder_options + format_options
-
-        if twopass == 1:
-            optlist.extend(['-pass', '1'])
-        elif twopass == 2:
-            optlist.extend(['-pass', '2'])
-
-        return optlist                
+        # aggregate all options, video options go in between
+        return audio_options, subtitle_options + decoder_options + format_options                
 
-    def convert(self, infile, outfile, options, twopass=False, timeout=10, nice=None, title=None):
+    def convert(self, infile, outfile, options, twopass=False, timeout=10, nice=None, title=None,
+                reuse_passlog=True, smart_copy=False, metrics=None):
         """
         Convert media file (infile) according to specified options, and
-        save it to outfile. For two-pass encoding, specify the pass (1 or 2)
-        in the twopass parameter.
-
-        Options should be passed as a dictionary. The keys are:
+        save it to outfile. For two-pass encoding, set twopass to True.
+
+        Each two-pass job uses its own statistics files, so concurrent jobs
+        don't overwrite each other's, and the first pass only writes these
+        statistics (null muxer). With reuse_passlog, the statistics are kept
+        in passlog_cache, keyed by the source file and the options which
+        affect them (not the bitrate): re-encoding the same source at
+        another bitrate then skips the first pass.
+
+        With a result_cache set on the Converter, an identical earlier
+        conversion of the same source content is given back from the cache
+        and nothing is encoded.
+
+        With smart_copy, the audio and video streams of the source which
+        already match the requested options are copied instead of
+        re-encoded, see smart_copy().
+
+        With the loudnorm audio option (True, or a dictionary of targets,
+        see avcodecs.AudioCodec), the loudness of the first audio stream of
+        the source is measured first, then normalized with these measures
+        in a single linear pass when possible. The measures are kept in
+        loudness_cache, so the other outputs of the same source don't
+        measure it again.
+
+        metrics is a list of quality metrics ('psnr' and/or 'ssim') of the
+        encoded video against the frames given to the encoder, computed by
+        the encoder itself while encoding, so the output doesn't have to
+        be decoded again. The PSNR is known for each frame (for the
+        encoders supporting it), the SSIM only on average (x264 and x265).
+        After the timecodes, the generator then yields a dictionary with
+        the number of frames (frames), the per frame sizes in bytes
+        (frame_sizes) and PSNR (psnr) as arrays, and the mean, min, max and
+        p5 (5th percentile) of each metric (psnr_summary, ssim_summary). It
+        is empty if the output came from the result cache.
+
+        infile may also be a file-like object or an iterator of bytes, and
+        outfile a writable file-like object, see FFMpeg.convert(). A
+        streamed source is not probed, so the source dependent options
+        (sizing policies, rotation) are not available and two-pass encoding
+        is not possible.
+
+        Options should be passed as a dictionary, or as a ConversionPlan
+        compiled by compile(). The keys are:
             * format (mandatory, string) - container format; see
               formats.BaseFormat for list of supported formats
             * audio (optional, dict) - audio codec and options; see
@@ -221,9 +425,298 @@ class Converter(object):
         ...   pass # can be used to inform the user about the progress
         """
 
-        if not isinstance(options, dict):
+        if not isinstance(options, (dict, ConversionPlan)):
             raise ConverterError('Invalid options')
-                
+
+        plan = self.compile(options)
+        options = plan.options()
+        info = None
+
+        if FFMpeg.is_stream(infile):
+            # A streamed source can only be read once: no probing and no
+            # two-pass encoding.
+            if twopass:
+                raise ConverterError('Two-pass encoding needs a file source')
+            if self._wants_loudnorm(options):
+                raise ConverterError('Loudness normalization needs a file source')
+        else:
+            if not os.path.exists(infile) and not self.ffmpeg.is_url(infile):
+                raise ConverterError("Source file doesn't exist: " + infile)
+
+            info = self.ffmpeg.probe(infile, title=title)
+            if info is None:
+                raise ConverterError("Can't get information about source file")
+
+            if 'video' not in info and 'audio' not in info:
+                raise ConverterError('Source file has no audio or video streams')
+
+            if smart_copy:
+                options, copied = self.smart_copy(options, info)
+                if copied:
+                    logger.info('Copying %s stream(s) of %s', ', '.join(copied), infile)
+                    plan = self.compile(options)
+                if 'video' in copied:
+                    twopass = False
+
+            if info['format']['duration'] < 0.01:
+                raise ConverterError('Zero-length media')
+
+            if 'duration' in options:
+                duration = timecode_to_seconds(options['duration'])
+            elif 'start' in options:
+                if 'end' in options:
+                    duration = timecode_to_seconds(options['end']) - timecode_to_seconds(options['start'])
+                else:
+                    duration = info['format']['duration'] - timecode_to_seconds(options['start'])
+            elif 'end' in options:
+                duration = timecode_to_seconds(options['end'])
+            else:
+                duration = info['format']['duration']
+
+        if metrics:
+            plan = self._metrics_plan(plan, metrics)
+
+        # The cache key is computed before the loudness measurement, which
+        # only depends on the source, so a hit doesn't decode the audio.
+        cache_key = None
+        if self.result_cache is not None and not FFMpeg.is_stream(infile) \
+                and os.path.isfile(infile) and not hasattr(outfile, 'write'):
+            optlist = plan.optlist(info) + (['-pass', '2'] if twopass else [])
+            cache_key = self.result_cache.key(infile, optlist, os.path.splitext(outfile)[1])
+            if self.result_cache.get(cache_key, outfile):
+                logger.info('Conversion of %s found in the result cache', infile)
+                if metrics:
+                    yield {}
+                return
+
+        if info is not None and self._wants_loudnorm(options) and 'audio' in info:
+            for data in self._loudness(infile, info, timeout, nice):
+                if isinstance(data, dict):
+                    options = self._loudnorm_options(options, data, info)
+                else:
+                    yield data
+            plan = self.compile(options)
+            if metrics:
+                plan = self._metrics_plan(plan, metrics)
+
+        if twopass:
+            optlist1 = plan.optlist(info, 1)
+            key = passlog_cache.key(infile, optlist1) if reuse_passlog else None
+            passlogfile = passlog_cache.get(key) if key else None
+            if passlogfile is None:
+                passlogfile = passlog_cache.new_prefix()
+                try:
+                    optlist1.extend(['-passlogfile', passlogfile])
+                    for timecode in self.ffmpeg.convert(infile, '-', optlist1,
+                                                        timeout=timeout, nice=nice):
+                        # yield int((50.0 * timecode) / duration)
+                        yield timecode
+                except:
+                    passlog_cache.remove_files(passlogfile)
+                    raise
+                if key:
+                    passlog_cache.add(key, passlogfile)
+            optlist2 = plan.optlist(info, 2, passlogfile)
+            try:
+                for timecode in self._encode(infile, outfile, optlist2, timeout, nice, metrics):
+                    # yield int(50.0 + (50.0 * timecode) / duration)
+                    yield timecode
+            finally:
+                if key:
+                    passlog_cache.release(passlogfile)
+                else:
+                    passlog_cache.remove_files(passlogfile)
+        else:
+            optlist = plan.optlist(info)
+            for timecode in self._encode(infile, outfile, optlist, timeout, nice, metrics):
+                # yield int((100.0 * timecode) / duration)
+                yield timecode
+
+        if cache_key:
+            self.result_cache.add(cache_key, outfile)
+
+    @staticmethod
+    def _wants_loudnorm(options):
+        audio = options.get('audio')
+        return isinstance(audio, dict) and bool(audio.get('loudnorm')) and audio.get('codec') not in (None, 'copy')
+
+    @staticmethod
+    def _input_side_options(options):
+        """
+        Return the options of a conversion which apply to its input: start,
+        duration, end and decoder.
+        """
+        input_options = {}
+        for name in ('start', 'duration', 'end'):
+            if name in options:
+                input_options[name] = parse_time(options[name])
+        if 'decoder' in options:
+            input_options['decoder'] = options['decoder']
+        return input_options
+
+    def _loudness(self, infile, info, timeout, nice):
+        """
+        Measure the loudness of the first audio stream of infile, unless it
+        is a local file in loudness_cache, yielding the timecodes of the
+        measure, then the measured values (see FFMpeg.loudness()).
+        """
+        stream = info['audio'].get('index')
+        key = loudness_cache.key(infile, stream)
+        measured = loudness_cache.get(key) if key else None
+        if measured is None:
+            for data in self.ffmpeg.loudness(infile, stream, timeout=timeout, nice=nice):
+                if isinstance(data, dict):
+                    measured = data
+                else:
+                    yield data
+            if key:
+                loudness_cache.add(key, measured)
+        yield measured
+
+    @staticmethod
+    def _loudnorm_options(options, measured, info):
+        """
+        Return a copy of options with the measured loudness values (see
+        FFMpeg.loudness()) in the loudnorm audio option.
+        """
+        audio = options['audio']
+        loudnorm = dict(audio['loudnorm']) if isinstance(audio['loudnorm'], dict) else {}
+        for name in ('I', 'LRA', 'TP', 'thresh'):
+            loudnorm['measured_' + name] = measured[name]
+        options = options.copy()
+        audio = options['audio'] = dict(audio, loudnorm=loudnorm)
+        # keep the source sample rate, loudnorm resamples to 192 kHz when
+        # it can't be linear
+        if 'samplerate' not in audio and info['audio'].get('samplerate'):
+            audio['samplerate'] = info['audio']['samplerate']
+        return options
+
+    def _metrics_plan(self, plan, metrics):
+        """
+        Return the plan with the encoder options needed for the quality
+        metrics.
+        """
+        unknown = set(metrics) - set(['psnr', 'ssim'])
+        if unknown:
+            raise ConverterError('Unknown quality metrics: ' + ', '.join(sorted(unknown)))
+
+        options = plan.options()
+        video = options.get('video')
+        if not isinstance(video, dict) or video.get('codec') in (None, 'copy'):
+            raise ConverterError('Quality metrics need an encoded video stream')
+        if 'ssim' in metrics:
+            ssim_option = self.video_codecs[video['codec']].ssim_option
+            if ssim_option is None:
+                raise ConverterError('The {0} encoder does not compute the SSIM'.format(video['codec']))
+            name, value = ssim_option
+            if video.get(name) != value:
+                video[name] = value
+                return self.compile(options)
+        return plan
+
+    @staticmethod
+    def _with_flags(optlist, flags):
+        """
+        Return the optlist with the flags added to its -flags option, as
+        ffmpeg only applies the last one.
+
+        >>> Converter._with_flags(['-f', 'segment', '-flags', '-global_header'], '+psnr')
+        ['-f', 'segment', '-flags', '-global_header+psnr']
+        """
+        optlist = list(optlist)
+        if '-flags' not in optlist:
+            return optlist + ['-flags', flags]
+        i = len(optlist) - 1 - optlist[::-1].index('-flags')
+        optlist[i + 1] += flags
+        return optlist
+
+    def _encode(self, infile, outfile, optlist, timeout, nice, metrics):
+        """
+        Run the (last pass of the) encoding, yielding the timecodes and,
+        with metrics, the quality metrics at the end (see convert()).
+        """
+        if not metrics:
+            for timecode in self.ffmpeg.convert(infile, outfile, optlist, timeout=timeout, nice=nice):
+                yield timecode
+            return
+
+        fd, vstats = tempfile.mkstemp(suffix='.log', prefix='vstats-')
+        os.close(fd)
+        output = ''
+        try:
+            # the encoder compares its input and reconstructed frames
+            optlist = self._with_flags(optlist, '+psnr') + ['-vstats_file', vstats]
+            for timecode in self.ffmpeg.convert(infile, outfile, optlist, timeout=timeout, nice=nice,
+                                                get_output=True):
+                if isinstance(timecode, (tuple, float)):
+                    yield timecode
+                else:
+                    output = timecode
+            with open(vstats) as vstats_file:
+                psnr, sizes = parse_vstats(vstats_file.read())
+        finally:
+            os.unlink(vstats)
+
+        result = {'frames': len(sizes), 'frame_sizes': sizes}
+        if 'psnr' in metrics and psnr is not None:
+            result['psnr'] = psnr
+            result['psnr_summary'] = summarize(psnr)
+        if 'ssim' in metrics:
+            match = re.search(r'SSIM Mean Y:\s*([0-9.]+)', output)
+            if match:
+                result['ssim_summary'] = {'mean': float(match.group(1))}
+        yield result
+
+    def convert_multi(self, infile, outputs, timeout=10, nice=None, title=None):
+        """
+        Convert media file (infile) to several renditions in a single
+        ffmpeg run, so the source is decoded only once.
+
+        outputs is a list of (outfile, options) tuples, where options is a
+        dictionary like the one accepted by convert(). The video is split
+        with a filter graph into one branch per rendition; filters shared by
+        all the renditions (crop, deinterlacing, rotation...) are applied
+        once before the split and each branch only does its own filters and
+        scaling. The input side options (start, duration, end, decoder)
+        apply to all the renditions, which must agree on them. The loudness
+        of the source is measured once for all the renditions normalizing
+        it (see convert()).
+
+        The 'map' option and two-pass encoding are not supported, use
+        convert() for them.
+
+        Like convert(), it returns a generator that needs to be iterated to
+        drive the conversion process. As there is only one ffmpeg process,
+        the yielded progress covers all the renditions.
+
+        >>> conv = Converter().convert_multi('test1.ogg', [
+        ...    ('/tmp/output_720.mp4', {
+        ...        'format': 'mp4',
+        ...        'audio': {'codec': 'aac'},
+        ...        'video': {'codec': 'h264', 'max_width': 1280, 'max_height': 720,
+        ...                  'sizing_policy': 'Fit'}}),
+        ...    ('/tmp/output_360.mp4', {
+        ...        'format': 'mp4',
+        ...        'audio': {'codec': 'aac', 'bitrate': 64},
+        ...        'video': {'codec': 'h264', 'max_width': 640, 'max_height': 360,
+        ...                  'sizing_policy': 'Fit'}})])
+
+        >>> for timecode in conv:
+        ...   pass
+        """
+        if not outputs:
+            raise ConverterError('No output requested')
+
+        for _, options in outputs:
+            if not isinstance(options, dict):
+                raise ConverterError('Invalid options')
+            if 'map' in options:
+                raise ConverterError('map is not supported by convert_multi')
+
+        input_options = [self._input_side_options(options) for _, options in outputs]
+        if any(opts != input_options[0] for opts in input_options[1:]):
+            raise ConverterError('The renditions of convert_multi need the same start, duration, end and decoder')
+
         if not os.path.exists(infile) and not self.ffmpeg.is_url(infile):
             raise ConverterError("Source file doesn't exist: " + infile)
 
@@ -234,6 +727,181 @@ class Converter(object):
         if 'video' not in info and 'audio' not in info:
             raise ConverterError('Source file has no audio or video streams')
 
+        if info['format']['duration'] < 0.01:
+            raise ConverterError('Zero-length media')
+
+        optlists = []
+        measured = None
+        for outfile, options in outputs:
+            if self._wants_loudnorm(options) and 'audio' in info:
+                if measured is None:
+                    for data in self._loudness(infile, info, timeout, nice):
+                        if isinstance(data, dict):
+                            measured = data
+                        else:
+                            yield data
+                options = self._loudnorm_options(options, measured, info)
+            options = self._source_options(options, info)
+            optlists.append((outfile, self.parse_options(options)))
+
+        filter_complex = self._split_video_filters([opts for _, opts in optlists])
+
+        for timecode in self.ffmpeg.convert_multi(infile, optlists, filter_complex,
+                                                  timeout=timeout, nice=nice):
+            yield timecode
+
+    def package(self, infile, outdir, ladder, audio=None, format='hls_abr', segment_time=6,
+                timeout=10, nice=None, title=None):
+        """
+        Encode an adaptive bitrate ladder of infile and package it as HLS
+        (format 'hls_abr') or MPEG-DASH (format 'dash') with fMP4/CMAF
+        segments in outdir, in a single ffmpeg run.
+
+        ladder is a list of video options dictionaries (see
+        avcodecs.VideoCodec), one for each rendition. Rungs larger than the
+        source (max_width/max_height above the source size) are skipped, but
+        the smallest rung is always kept. audio is an optional dictionary of
+        audio options, encoded once and shared by all the renditions.
+
+        Keyframes are forced at every segment boundary so the renditions
+        stay aligned. The master playlist (master.m3u8) or the manifest
+        (manifest.mpd) is written to outdir.
+
+        Like convert(), it returns a generator that needs to be iterated to
+        drive the conversion process.
+
+        >>> conv = Converter().package('test1.ogg', '/tmp/abr', [
+        ...    {'codec': 'h264', 'max_width': 1920, 'max_height': 1080,
+        ...     'sizing_policy': 'Fit', 'bitrate': 5},
+        ...    {'codec': 'h264', 'max_width': 1280, 'max_height': 720,
+        ...     'sizing_policy': 'Fit', 'bitrate': 2.5},
+        ...    {'codec': 'h264', 'max_width': 640, 'max_height': 360,
+        ...     'sizing_policy': 'Fit', 'bitrate': 0.8},
+        ... ], audio={'codec': 'aac', 'bitrate': 128})
+
+        >>> for timecode in conv:
+        ...   pass
+        """
+        if format not in ('hls_abr', 'dash'):
+            raise ConverterError('Requested unknown package format: ' + str(format))
+
+        if not ladder:
+            raise ConverterError('Empty bitrate ladder')
+
+        if not os.path.exists(infile) and not self.ffmpeg.is_url(infile):
+            raise ConverterError("Source file doesn't exist: " + infile)
+
+        info = self.ffmpeg.probe(infile, title=title)
+        if info is None:
+            raise ConverterError("Can't get information about source file")
+
+        if 'video' not in info:
+            raise ConverterError('Source file has no video stream')
+
+        if info['format']['duration'] < 0.01:
+            raise ConverterError('Zero-length media')
+
+        if audio is not None and 'audio' not in info:
+            audio = None
+
+        rungs = self._ladder_rungs(ladder, info)
+
+        optlists = []
+        for rung in rungs:
+            if not isinstance(rung, dict) or 'codec' not in rung:
+                raise ConverterError('Invalid video codec specification')
+            options = self._source_options({'video': rung}, info)['video']
+            c = options['codec']
+            if c not in self.video_codecs or c is None:
+                raise ConverterError('Requested unknown video codec ' + str(c))
+            optlists.append(self.video_codecs[c]().parse_options(options) + ['-an', '-sn'])
+
+        filter_complex = self._split_video_filters(optlists)
+
+        optlist = []
+        if audio is not None:
+            if not isinstance(audio, dict) or audio.get('codec') not in self.audio_codecs:
+                raise ConverterError('Invalid audio codec specification')
+            audio_options = self.audio_codecs[audio['codec']]().parse_options(audio)
+            optlist.extend(['-map', '0:a:0'])
+            optlist.extend(self._stream_options(audio_options, 'a', 0))
+        for idx, opts in enumerate(optlists):
+            opts.remove('-an')
+            opts.remove('-sn')
+            optlist.extend(self._stream_options(opts, 'v', idx))
+
+        # Aligned keyframes at each segment boundary for all the renditions.
+        optlist.extend(['-force_key_frames', 'expr:gte(t,n_forced*{0})'.format(segment_time)])
+        optlist.extend(self.formats[format]().parse_options({
+            'format': format,
+            'outdir': outdir,
+            'segment_time': segment_time,
+            'video_streams': len(optlists),
+            'audio_streams': 0 if audio is None else 1,
+        }))
+
+        if not os.path.isdir(outdir):
+            os.makedirs(outdir)
+
+        outfile = os.path.join(outdir, self.formats[format].playlist_name)
+        for timecode in self.ffmpeg.convert_multi(infile, [(outfile, optlist)], filter_complex,
+                                                  timeout=timeout, nice=nice):
+            yield timecode
+
+    @staticmethod
+    def _ladder_rungs(ladder, info):
+        """
+        Return the rungs of ladder not larger than the source video, always
+        keeping at least the smallest one.
+        """
+        width = info['video']['width']
+        height = info['video']['height']
+        rotate = info['video'].get('tags', {}).get('rotate')
+        if rotate is not None and int(rotate) in (90, 270):
+            width, height = height, width
+
+        def fits(rung):
+            return (rung.get('max_width', 0) <= width
+                    and rung.get('max_height', 0) <= height)
+
+        rungs = [rung for rung in ladder if fits(rung)]
+        if not rungs:
+            rungs = [min(ladder, key=lambda rung: (rung.get('max_height', 0), rung.get('max_width', 0)))]
+        return rungs
+
+    @staticmethod
+    def _stream_options(optlist, kind, index):
+        """
+        Return optlist with each option restricted to a single output
+        stream, ie. '-c:v libx264' becomes '-c:v:1 libx264' for index 1.
+        """
+        specifier = ':{0}:{1}'.format(kind, index)
+        aliases = {'-vb': '-b:v', '-ab': '-b:a', '-af': '-filter:a', '-vf': '-filter:v'}
+        result = []
+        idx = 0
+        while idx < len(optlist):
+            flag = optlist[idx]
+            if flag in ('-an', '-vn', '-sn', '-dn'):
+                result.append(flag)
+                idx += 1
+                continue
+            if flag == '-map':
+                result.extend(optlist[idx:idx + 2])
+                idx += 2
+                continue
+            flag = aliases.get(flag, flag)
+            if flag.endswith(':' + kind):
+                flag = flag[:-len(kind) - 1]
+            result.extend([flag + specifier, optlist[idx + 1]])
+            idx += 2
+        return result
+
+    @staticmethod
+    def _source_options(options, info):
+        """
+        Return a copy of options completed with the source video properties
+        found in info.
+        """
         if 'video' in info and 'video' in options:
             options = options.copy()
             v = options['video'] = options['video'].copy()
@@ -241,41 +909,409 @@ class Converter(object):
             v['src_height'] = info['video']['height']
             if 'tags' in info['video'] and 'rotate' in info['video']['tags']:
                 v['src_rotate'] = info['video']['tags']['rotate']
+        return options
+
+    @staticmethod
+    def _split_video_filters(optlists):
+        """
+        Move the video filters and scaling of each option list into a single
+        filter graph splitting the decoded video in one branch per output,
+        add the needed -map options and return the filter graph.
+        """
+        chains = {}
+        for idx, optlist in enumerate(optlists):
+            if '-vn' in optlist:
+                continue
+            if '-c:v' in optlist and optlist[optlist.index('-c:v') + 1] == 'copy':
+                continue
+            filters = []
+            if '-vf' in optlist:
+                pos = optlist.index('-vf')
+                optlist.pop(pos)
+                filters.extend(split_chain(optlist.pop(pos)))
+            if '-s' in optlist:
+                # Scaling with -s is done by ffmpeg after the other filters.
+                pos = optlist.index('-s')
+                optlist.pop(pos)
+                filters.append('scale=' + optlist.pop(pos).replace('x', ':'))
+            chains[idx] = filters
+
+        # Filters common to all the branches are only done once.
+        common = []
+        if chains:
+            for step in zip(*chains.values()):
+                if len(set(step)) != 1:
+                    break
+                common.append(step[0])
+
+        graph = None
+        if chains:
+            graph = ['[0:v]{0}{1}'.format(
+                ','.join(common + ['split={0}'.format(len(chains))]),
+                ''.join('[s{0}]'.format(idx) for idx in sorted(chains)))]
+            for idx in sorted(chains):
+                branch = chains[idx][len(common):] or ['null']
+                graph.append('[s{0}]{1}[v{0}]'.format(idx, ','.join(branch)))
+            graph = ';'.join(graph)
+
+        for idx, optlist in enumerate(optlists):
+            maps = []
+            if idx in chains:
+                maps.extend(['-map', '[v{0}]'.format(idx)])
+            elif '-vn' not in optlist:
+                maps.extend(['-map', '0:v:0?'])
+            if '-an' not in optlist:
+                maps.extend(['-map', '0:a:0?'])
+            if '-sn' not in optlist:
+                maps.extend(['-map', '0:s?'])
+            optlist[:0] = maps
+
+        return graph
+
+    def convert_resumable(self, infile, outfile, options, workdir, segment_time=300,
+                          timeout=10, nice=None, title=None):
+        """
+        Convert media file (infile) like convert(), but in keyframe aligned
+        segments of about segment_time seconds, encoded one after the other
+        into the job scratch directory workdir. Each finished segment is
+        recorded in a manifest; if the job is interrupted, calling
+        convert_resumable() again with the same arguments only encodes the
+        remaining segments. At the end, the video segments are joined
+        without re-encoding, the audio is encoded over the whole source and
+        workdir is removed.
+
+        The manifest is discarded if the source file or the options changed
+        since it was written. Two-pass encoding and stream mapping are not
+        supported.
+
+        >>> conv = Converter().convert_resumable('master.mov', '/tmp/output.mp4', {
+        ...    'format': 'mp4',
+        ...    'audio': {'codec': 'aac'},
+        ...    'video': {'codec': 'h264', 'preset': 'slow', 'quality': 20}
+        ... }, '/var/tmp/job-1234')
+
+        >>> for timecode in conv:
+        ...   pass
+        """
+        if not isinstance(options, dict):
+            raise ConverterError('Invalid options')
+
+        if 'map' in options:
+            raise ConverterError('map is not supported by convert_resumable')
+
+        if not isinstance(options.get('video'), dict):
+            raise ConverterError('Invalid video codec specification')
+
+        if not os.path.exists(infile):
+            raise ConverterError("Source file doesn't exist: " + infile)
+
+        info = self.ffmpeg.probe(infile, title=title)
+        if info is None or 'video' not in info:
+            raise ConverterError("Can't get video information about source file")
 
         if info['format']['duration'] < 0.01:
             raise ConverterError('Zero-length media')
 
+        start = timecode_to_seconds(options.get('start', 0))
         if 'duration' in options:
-            duration = timecode_to_seconds(options['duration'])
-        elif 'start' in options:
-            if 'end' in options:
-                duration = timecode_to_seconds(options['end']) - timecode_to_seconds(options['start'])
-            else:
-                duration = info['format']['duration'] - timecode_to_seconds(options['start'])
+            end = start + timecode_to_seconds(options['duration'])
         elif 'end' in options:
-            duration = timecode_to_seconds(options['end'])
+            end = timecode_to_seconds(options['end'])
         else:
-            duration = info['format']['duration']
-
-        if twopass:
-            optlist1 = self.parse_options(options, 1)
-            for timecode in self.ffmpeg.convert(infile, outfile, optlist1,
-                                                timeout=timeout, nice=nice):
-                # yield int((50.0 * timecode) / duration)
-                yield timecode
-            optlist2 = self.parse_options(options, 2)
-            for timecode in self.ffmpeg.convert(infile, outfile, optlist2,
-                                                timeout=timeout, nice=nice):
-                # yield int(50.0 + (50.0 * timecode) / duration)
+            end = info['format']['duration']
+
+        st = os.stat(infile)
+        job = {
+            'source': [os.path.abspath(infile), st.st_size, st.st_mtime],
+            'options': options,
+            'segment_time': segment_time,
+        }
+
+        manifest_path = os.path.join(workdir, 'manifest.json')
+        manifest = None
+        if os.path.exists(manifest_path):
+            try:
+                with open(manifest_path) as manifest_file:
+                    manifest = json.load(manifest_file)
+            except ValueError:
+                manifest = None
+            if manifest is not None and manifest.get('job') != json.loads(json.dumps(job)):
+                logger.info('Discarding the outdated manifest of %s', workdir)
+                manifest = None
+
+        if manifest is None:
+            if os.path.isdir(workdir):
+                shutil.rmtree(workdir)
+            os.makedirs(workdir)
+            keyframes = self.ffmpeg.keyframes(infile)
+            manifest = {
+                'job': job,
+                'segments': self._segment_bounds(keyframes, start, end, segment_time),
+                'done': [],
+            }
+            self._write_manifest(manifest_path, manifest)
+
+        # Measured once up front: the final pass encodes the audio of the
+        # whole range, and a resumed job finds the values in loudness_cache.
+        if self._wants_loudnorm(options) and 'audio' in info:
+            for data in self._loudness(infile, info, timeout, nice):
+                if isinstance(data, dict):
+                    options = self._loudnorm_options(options, data, info)
+                else:
+                    yield data
+
+        video_options = self._source_options(options, info).get('video')
+        parts = []
+        for idx, (seg_start, seg_end) in enumerate(manifest['segments']):
+            part = os.path.join(workdir, 'segment{0:05d}.mkv'.format(idx))
+            parts.append(part)
+            if idx in manifest['done'] and os.path.exists(part):
+                continue
+            segment = {
+                'format': 'mkv',
+                'video': video_options,
+                'start': seg_start,
+                'duration': seg_end - seg_start,
+            }
+            if 'decoder' in options:
+                segment['decoder'] = options['decoder']
+            optlist = self.parse_options(segment)
+            for timecode in self.ffmpeg.convert(infile, part, optlist, timeout=timeout, nice=nice):
                 yield timecode
+            manifest['done'].append(idx)
+            self._write_manifest(manifest_path, manifest)
+
+        final = dict((k, v) for k, v in options.items()
+                     if k not in ('start', 'end', 'duration', 'decoder'))
+        final['video'] = {'codec': 'copy'}
+        optlist = ['-map', '0:v:0']
+        if final.get('audio', {}).get('codec'):
+            optlist.extend(['-map', '1:a:0?'])
+        optlist.extend(self.parse_options(final))
+        inputs = ['-ss', str(start), '-t', str(end - start), '-i', infile]
+        for timecode in self.ffmpeg.concat(parts, outfile, optlist, inputs=inputs,
+                                           timeout=timeout, nice=nice):
+            yield timecode
+
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    @staticmethod
+    def _segment_bounds(keyframes, start, end, segment_time):
+        """
+        Split [start, end] in segments of at least segment_time seconds,
+        starting on keyframes.
+        """
+        bounds = [start]
+        for keyframe in keyframes:
+            if keyframe - bounds[-1] >= segment_time and end - keyframe > 0.001:
+                bounds.append(keyframe)
+        bounds.append(end)
+        return [[bounds[idx], bounds[idx + 1]] for idx in range(len(bounds) - 1)]
+
+    @staticmethod
+    def _write_manifest(path, manifest):
+        # Write then rename, so a crash never leaves a truncated manifest.
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as manifest_file:
+            json.dump(manifest, manifest_file)
+        os.rename(tmp_path, path)
+
+    def smart_cut(self, infile, outfile, options, timeout=10, nice=None, title=None):
+        """
+        Frame accurate trim of media file (infile) between the 'start' and
+        'end' (or 'duration') of options, re-encoding only the partial GOP
+        at each end of the clip and copying all the whole GOPs in between.
+
+        The video encoder of options must produce the codec of the source
+        (ie. 'h264' for an H.264 source); the re-encoded parts keep the
+        source size, pixel format, profile and level so they can be joined
+        with the copied ones. Scaling, cropping and filters are not
+        possible. The audio is encoded as requested in options over the
+        whole clip.
+
+        Like convert(), it returns a generator that needs to be iterated to
+        drive the conversion process. It runs up to four ffmpeg processes
+        (head, copied middle, tail and the final join). The copied middle
+        is read from the beginning of the source.
+
+        >>> conv = Converter().smart_cut('master.mp4', '/tmp/clip.mp4', {
+        ...    'format': 'mp4',
+        ...    'audio': {'codec': 'aac'},
+        ...    'video': {'codec': 'h264', 'preset': 'slow', 'quality': 18},
+        ...    'start': '00:12:03.250',
+        ...    'end': '00:14:41.800'})
+
+        >>> for timecode in conv:
+        ...   pass
+        """
+        if not isinstance(options, dict):
+            raise ConverterError('Invalid options')
+
+        if 'start' not in options or ('end' not in options and 'duration' not in options):
+            raise ConverterError('smart_cut needs start and end (or duration)')
+
+        if not os.path.exists(infile):
+            raise ConverterError("Source file doesn't exist: " + infile)
+
+        info = self.ffmpeg.probe(infile, title=title)
+        if info is None or 'video' not in info:
+            raise ConverterError("Can't get video information about source file")
+
+        start = timecode_to_seconds(options['start'])
+        if 'duration' in options:
+            end = start + timecode_to_seconds(options['duration'])
         else:
-            optlist = self.parse_options(options, twopass)
-            for timecode in self.ffmpeg.convert(infile, outfile, optlist,
-                                                timeout=timeout, nice=nice):
-                # yield int((100.0 * timecode) / duration)
+            end = timecode_to_seconds(options['end'])
+        if end <= start:
+            raise ConverterError('Invalid cut: end before start')
+
+        video = self._cut_video_options(options.get('video'), info['video'])
+
+        # The keyframe timestamps are on the source timeline, the cut points
+        # are from the start of the source like ffmpeg seeking.
+        offset = info['format'].get('start_time') or 0
+        keyframes = [k - offset for k in self.ffmpeg.keyframes(infile)]
+        origin = keyframes[0] if keyframes else 0
+        keyframes = [k for k in keyframes if start <= k <= end]
+        if len(keyframes) < 2:
+            # No whole GOP in the clip, encode all of it.
+            for timecode in self.convert(infile, outfile, options, timeout=timeout, nice=nice, title=title):
+                yield timecode
+            return
+
+        first, last = keyframes[0], keyframes[-1]
+        frame = 1.0 / (info['video'].get('fps') or 25)
+        # The parts meet half a frame before the keyframes, so rounding
+        # can't drop or repeat the frame on a bound. ffmpeg counts the
+        # duration of an encoded part from its first frame, so the head
+        # lasts its number of frames.
+        head_frames = int((first - start) / frame + 0.001)
+        # Seeking a stream copy may start on any earlier keyframe, so the
+        # whole GOPs are split out of the beginning of the source by the
+        # segment muxer, exactly on the keyframes. Its times count from the
+        # first packet of the stream.
+        split = [round(last - origin - frame / 2, 6)]
+        if first - origin > frame / 2:
+            split.insert(0, round(first - origin - frame / 2, 6))
+
+        # Encoded head, copied whole GOPs and encoded tail, as (ffmpeg
+        # output, part, options).
+        segments = []
+        if head_frames:
+            segments.append(('head.ts', 'head.ts', {
+                'format': 'mpg',
+                'video': video,
+                'start': start,
+                'duration': round((head_frames - 0.5) * frame, 6),
+            }))
+        segments.append(('middle%d.ts', 'middle{0}.ts'.format(len(split) - 1), {
+            'format': 'hls',
+            'segment_format': 'mpegts',
+            'segment_times': split,
+            'reset_timestamps': True,
+            'video': {'codec': 'copy'},
+            'duration': round(last + frame, 6),
+        }))
+        if end - last > 0.001:
+            segments.append(('tail.ts', 'tail.ts', {
+                'format': 'mpg',
+                'video': video,
+                'start': round(last - frame / 2, 6),
+                'duration': round(end - last, 6),
+            }))
+
+        tmpdir = tempfile.mkdtemp(prefix='smartcut-')
+        try:
+            parts = []
+            for output, part, segment in segments:
+                optlist = self.parse_options(segment)
+                for timecode in self.ffmpeg.convert(infile, os.path.join(tmpdir, output), optlist,
+                                                    timeout=timeout, nice=nice):
+                    yield timecode
+                parts.append(os.path.join(tmpdir, part))
+
+            final = dict((k, v) for k, v in options.items()
+                         if k not in ('start', 'end', 'duration', 'map', 'decoder'))
+            final['video'] = {'codec': 'copy'}
+            optlist = ['-map', '0:v:0']
+            if final.get('audio', {}).get('codec'):
+                optlist.extend(['-map', '1:a:0?'])
+            optlist.extend(self.parse_options(final))
+            inputs = ['-ss', str(start), '-t', str(end - start), '-i', infile]
+            for timecode in self.ffmpeg.concat(parts, outfile, optlist, inputs=inputs,
+                                               timeout=timeout, nice=nice):
                 yield timecode
+        finally:
+            shutil.rmtree(tmpdir, ignore_errors=True)
 
-    def analyze(self, infile, audio_level=True, interlacing=True, crop=False, start=None, duration=None, end=None, timeout=10, nice=None, title=None):
+    def _cut_video_options(self, video, stream):
+        """
+        Return the video options to encode the ends of a smart cut so they
+        match the copied source stream.
+        """
+        if not isinstance(video, dict) or video.get('codec') not in self.video_codecs:
+            raise ConverterError('Invalid video codec specification')
+
+        cls = self.video_codecs[video['codec']]
+        if (cls.probe_codec_name or cls.codec_name) != stream.get('codec'):
+            raise ConverterError('smart_cut needs an encoder of the source codec: ' + str(stream.get('codec')))
+
+        video = dict((k, v) for k, v in video.items()
+                     if k not in ('max_width', 'max_height', 'sizing_policy', 'crop', 'filters',
+                                  'autorotate', 'fps'))
+        video['pix_fmt'] = stream.get('pix_fmt', 'yuv420p')
+        video['src_width'] = stream['width']
+        video['src_height'] = stream['height']
+        if stream.get('codec') == 'h264':
+            profile = str(stream.get('profile', '')).replace('constrained ', '')
+            if profile and ' ' not in profile and 'profile' in cls.encoder_options:
+                video['profile'] = profile
+            if stream.get('level') and 'level' in cls.encoder_options:
+                video['level'] = str(stream['level'])
+        return video
+
+    def smart_copy(self, options, info):
+        """
+        Replace the audio and video codecs of options by the copy codec
+        when the source stream already matches them: same codec, pixel
+        format, dimensions, frame rate, profile and level for the video,
+        same codec, channels and sample rate for the audio, and a bitrate
+        not above the requested one. See the is_compatible() method of the
+        codec classes for details.
+
+        info is the source information returned by probe(). Returns the
+        new options and the list of copied streams ('audio' and/or 'video').
+
+        Nothing is copied when a start position is set (stream copy can
+        only cut on keyframes) or when streams are mapped explicitly.
+
+        >>> c = Converter()
+        >>> options, copied = c.smart_copy(options, c.probe('test1.mp4'))
+        >>> copied
+        ['audio']
+        """
+        copied = []
+        if 'start' in options or 'map' in options:
+            return options, copied
+
+        options = self._source_options(options, info).copy()
+
+        v = options.get('video')
+        if 'video' in info and isinstance(v, dict) and v.get('codec') in self.video_codecs:
+            if self.video_codecs[v['codec']]().is_compatible(v, info['video']):
+                options['video'] = {'codec': 'copy'}
+                copied.append('video')
+
+        a = options.get('audio')
+        if 'audio' in info and isinstance(a, dict) and a.get('codec') in self.audio_codecs:
+            if self.audio_codecs[a['codec']]().is_compatible(a, info['audio']):
+                options['audio'] = {'codec': 'copy'}
+                copied.append('audio')
+
+        return options, copied
+
+    def analyze(self, infile, audio_level=True, interlacing=True, crop=False, start=None, duration=None, end=None, timeout=10, nice=None, title=None,
+                samples=None, sample_time=10, sample_audio=False, audio_streams=None):
         """
         Analyze the video frames to find if the video need to be deinterlaced.
         Or/and analyze the audio to find if the audio need to be normalize
@@ -288,6 +1324,15 @@ class Converter(object):
         deinterlaced, defaults to True.
         :param timeout: How long should the operation be blocked in case ffmpeg
         gets stuck and doesn't report back, defaults to 10 sec.
+        :param samples: Analyze only that many windows of sample_time seconds
+        of the video, in parallel, see FFMpeg.analyze(); defaults to None
+        (whole source).
+        :param sample_audio: Estimate the audio level from the same windows
+        instead of the whole source, defaults to False.
+        :param audio_streams: Measure the level of these audio streams (their
+        index in the file), or of all of them with True, in the same pass;
+        the audio level is then a dictionary by stream index. Defaults to
+        None (only the default audio stream).
         """
         if not os.path.exists(infile) and not self.ffmpeg.is_url(infile):
             raise ConverterError("Source file doesn't exist: " + infile)
@@ -302,6 +1347,14 @@ class Converter(object):
         if 'audio' not in info:
             audio_level = False
 
+        if audio_level and audio_streams is not None:
+            indexes = [stream['index'] for stream in info['audios']]
+            if audio_streams is True:
+                audio_streams = indexes
+            for stream in audio_streams:
+                if stream not in indexes:
+                    raise ConverterError('Not an audio stream: ' + str(stream))
+
         if 'video' not in info:
             interlacing = False
             crop = False
@@ -309,13 +1362,43 @@ class Converter(object):
         if info['format']['duration'] < 0.01:
             raise ConverterError('Zero-length media')
         for timecode in self.ffmpeg.analyze(infile, audio_level, interlacing,
-                                            crop, start, duration, end, timeout, nice):
+                                            crop, start, duration, end, timeout, nice,
+                                            samples=samples, sample_time=sample_time,
+                                            sample_audio=sample_audio, audio_streams=audio_streams):
             #if isinstance(timecode, float):
             #    yield int((100.0 * timecode) / info['format']['duration'])
             #else:
             #    yield timecode
             yield timecode
 
+    def inspect(self, infile, thumbnails=None, audio_level=True, interlacing=True, crop=True, black=True,
+                silence=True, timeout=10, nice=None, title=None):
+        """
+        Inspect the media file for ingest: analyze() it, check it like
+        validate() and take its thumbnails(), decoding it only once. See
+        the documentation of converter.FFMpeg.inspect() for details.
+
+        >>> for data in Converter().inspect('master.mov', [(10, '/tmp/10.jpg', '320x180')]):
+        ...    pass
+        >>> data['decode_errors'], data['interlaced'], data['crop']
+        (0, False, '1920:800:0:140')
+        """
+        if not os.path.exists(infile) and not self.ffmpeg.is_url(infile):
+            raise ConverterError("Source file doesn't exist: " + infile)
+
+        info = self.ffmpeg.probe(infile, title=title)
+        if info is None:
+            raise ConverterError("Can't get information about source file")
+
+        if 'video' not in info and 'audio' not in info:
+            raise ConverterError('Source file has no audio or video streams')
+
+        if info['format']['duration'] < 0.01:
+            raise ConverterError('Zero-length media')
+
+        return self.ffmpeg.inspect(infile, thumbnails, audio_level, interlacing, crop, black, silence,
+                                   timeout=timeout, nice=nice, title=title, info=info)
+
     def probe(self, *args, **kwargs):
         """
         Examine the media file. See the documentation of
@@ -1,6 +1,10 @@
 #!/usr/bin/env python
 
 import logging
+
+from converter.filters import FilterGraph
+from converter.schema import Schema, Option
+
 logger = logging.getLogger(__name__)
 
 class BaseCodec(object):
@@ -11,17 +15,35 @@ class BaseCodec(object):
     encoder_options = {}
     codec_name = None
     ffmpeg_codec_name = None
+    # Codec name reported by FFMpeg.probe for streams of this codec, when
+    # it differs from codec_name.
+    probe_codec_name = None
+    # Declarative codec specific options (converter.schema.Schema), their
+    # types are also added to encoder_options.
+    schema = None
 
     def parse_options(self, opt):
         if 'codec' not in opt or opt['codec'] != self.codec_name:
             raise ValueError('invalid codec name')
         return None
 
+    def is_compatible(self, opt, stream):
+        """
+        Check if the source stream (as returned by FFMpeg.probe) already
+        matches the options, so it can be copied instead of encoded.
+        """
+        return False
+
+    def _same_codec(self, stream):
+        return stream.get('codec') == (self.probe_codec_name or self.codec_name)
+
     def _codec_specific_parse_options(self, safe):
         return safe
 
     def _codec_specific_produce_ffmpeg_list(self, safe):
-        return []
+        if self.schema is None:
+            return []
+        return self.schema.emit(safe)
 
     def safe_options(self, opts):
         safe = {}
@@ -47,9 +69,17 @@ class AudioCodec(BaseCodec):
       * channels (integer) - number of audio channels
       * bitrate (integer) - stream bitrate
       * samplerate (integer) - sample rate (frequency)
+      * volume (float) - volume change in dB, ie. the audio_level result of
+        Converter.analyze()
+      * loudnorm (dict) - EBU R128 loudness normalization targets: I
+        (integrated loudness, default -23 LUFS), LRA (loudness range,
+        default 7 LU) and TP (true peak, default -2 dBTP). Converter.convert()
+        measures the source first and adds the measured_I, measured_LRA,
+        measured_TP and measured_thresh values, so the normalization is a
+        linear gain when possible.
 
     Supported audio codecs are: null (no audio), copy (copy from
-    original), vorbis, aac, mp3, mp2
+    original), vorbis, aac, mp3, mp2, opus
     """
 
     encoder_options = {
@@ -57,21 +87,46 @@ class AudioCodec(BaseCodec):
         'channels': int,
         'bitrate': int,
         'samplerate': int,
+        'volume': float,
+        'loudnorm': dict,
         'filters': str
     }
 
-    def _extend_af(self, optlist, value):
+    # loudnorm targets: default, min and max
+    LOUDNORM_TARGETS = (('I', -23.0, -70.0, -5.0), ('LRA', 7.0, 1.0, 50.0), ('TP', -2.0, -9.0, 0.0))
+    # measured values of the first pass: min and max
+    LOUDNORM_MEASURED = (('measured_I', -99.0, 0.0), ('measured_LRA', 0.0, 99.0),
+                         ('measured_TP', -99.0, 99.0), ('measured_thresh', -99.0, 0.0))
 
-        if not value:
-            return optlist
+    @classmethod
+    def loudnorm_filter(cls, values):
+        """
+        Return the loudnorm filter of the targets and measured values,
+        linear when all the measured values are known.
 
-        if optlist.count('-af'):
-            current_af = optlist[optlist.index('-af') + 1]
-            new_af = "{0},{1}".format(current_af, value)  # append filters to current
-            optlist[optlist.index('-af') + 1] = new_af
+        >>> AudioCodec.loudnorm_filter({'I': -16})
+        'loudnorm=I=-16.0:LRA=7.0:TP=-2.0'
+        """
+        args = []
+        for name, default, low, high in cls.LOUDNORM_TARGETS:
+            try:
+                value = float(values.get(name, default))
+            except (TypeError, ValueError):
+                value = default
+            if not low <= value <= high:
+                logger.error('%s is not a valid loudnorm %s target ...', value, name)
+                value = default
+            args.append('{0}={1}'.format(name, value))
+
+        measured = []
+        for name, low, high in cls.LOUDNORM_MEASURED:
+            value = values.get(name)
+            if not isinstance(value, (int, float)) or not low <= value <= high:
+                break
+            measured.append('{0}={1}'.format(name, value))
         else:
-            optlist.extend(['-af', value])
-        return optlist
+            args.extend(measured + ['linear=true'])
+        return 'loudnorm=' + ':'.join(args)
 
     def parse_options(self, opt):
         super(AudioCodec, self).parse_options(opt)
@@ -102,14 +157,37 @@ class AudioCodec(BaseCodec):
             optlist.extend(['-ab', str(safe['bitrate']) + 'k'])
         if 'samplerate' in safe:
             optlist.extend(['-ar', str(safe['samplerate'])])
+
+        graph = FilterGraph('a')
         if 'volume' in safe:
-            optlist.extend(['-af', 'volume={0:.1f}dB'.format(safe['volume'])])
+            graph.add('volume={0:.1f}dB'.format(safe['volume']))
+        if 'loudnorm' in safe:
+            graph.add(self.loudnorm_filter(safe['loudnorm']))
         if 'filters' in safe:
-            optlist = self._extend_af(optlist, safe['filters'])
+            graph.add(safe['filters'])
+        optlist.extend(graph.options())
 
         optlist.extend(self._codec_specific_produce_ffmpeg_list(safe))
         return optlist
 
+    def is_compatible(self, opt, stream):
+        if not self._same_codec(stream):
+            return False
+
+        safe = self.safe_options(opt)
+        if safe.get('filters') or 'volume' in safe or 'loudnorm' in safe:
+            return False
+        if 'channels' in safe and safe['channels'] != stream.get('channels'):
+            return False
+        if 'samplerate' in safe and safe['samplerate'] != stream.get('samplerate'):
+            return False
+        if 'bitrate' in safe:
+            # Source bitrate is in kbps, like the bitrate option.
+            bitrate = stream.get('bitrate')
+            if not isinstance(bitrate, (int, float)) or bitrate > safe['bitrate']:
+                return False
+        return True
+
 
 class SubtitleCodec(BaseCodec):
     """
@@ -158,9 +236,13 @@ class SubtitleCodec(BaseCodec):
 
 class DecoderCodec(BaseCodec):
     """
+    Base decoder class. Possible parameters are:
+      * codec (string) - decoder name
+      * threads (integer) - number of decoding threads, 0 for automatic
     """
     encoder_options = {
         'codec': str,
+        'threads': int,
     }
     
     def parse_options(self, opt):
@@ -169,10 +251,18 @@ class DecoderCodec(BaseCodec):
         safe = self._codec_specific_parse_options(safe)
 
         optlist = ['-decoder', self.ffmpeg_codec_name]
+        optlist.extend(self._thread_options(safe))
         
         optlist.extend(self._codec_specific_produce_ffmpeg_list(safe))
         return optlist
 
+    @staticmethod
+    def _thread_options(safe):
+        # moved before the input as -threads by FFMpeg.convert()
+        if safe.get('threads', -1) >= 0:
+            return ['-decoder_threads', str(safe['threads'])]
+        return []
+
 class VideoCodec(BaseCodec):
     """
     Base video codec class handles general video options. Possible
@@ -183,6 +273,12 @@ class VideoCodec(BaseCodec):
       * max_width (integer) - video width
       * max_height (integer) - video height
       * filters (string) - filters (flip, rotate, etc)
+      * scaler (string) - scaler flags (bicubic, lanczos, area, etc), or
+        auto for the area scaler when downscaling by half or more; default:
+        the ffmpeg default scaler
+      * threads (integer) - number of encoder threads, 0 for automatic
+      * thread_type (string) - parallelism of the encoder threads, frame
+        or slice (lower latency, less efficient)
       * sizing_policy (string) - aspect preserval mode; one of:
             ...
       * src_width (int) - source width
@@ -198,7 +294,7 @@ class VideoCodec(BaseCodec):
     is calculated to preserve the aspect ratio.
 
     Supported video codecs are: null (no video), copy (copy directly
-    from the source), Theora, H.264/AVC, DivX, VP8, H.263, Flv,
+    from the source), Theora, H.264/AVC, DivX, VP8, VP9, AV1, H.263, Flv,
     MPEG-1, MPEG-2.
     """
 
@@ -217,30 +313,19 @@ class VideoCodec(BaseCodec):
         'filters': str,
         'autorotate': bool,
         'bufsize': int,
+        'scaler': str,
+        'threads': int,
+        'thread_type': str,
     }
-
-    def _autorotate(self, src_rotate):
-        filters = {
-            90: "transpose=1",
-            180: "transpose=2,transpose=2",
-            270: "transpose=2"
-        }
-        return filters.get(src_rotate)
-
-    def _extend_vf(self, optlist, value):
-
-        if not value:
-            return optlist
-
-        if optlist.count('-vf'):
-            current_vf = optlist[optlist.index('-vf') + 1]
-            new_vf = "{0},{1}".format(current_vf, value)  # append filters to current
-            optlist[optlist.index('-vf') + 1] = new_vf
-        else:
-            optlist.extend(['-vf', value])
-        return optlist
+    # False for the hardware encoders, which don't use encoder threads.
+    encoder_threads = True
+    # (option, value) making the encoder compute the SSIM of its output,
+    # None if it can't
+    ssim_option = None
 
     def _div_by_2(self, d):
+        if d is None:
+            return None
         return float(d) + 1 if float(d) % 2 else float(d)
 
     def _aspect_corrections(self, sw, sh, max_width, max_height, sizing_policy):
@@ -251,19 +336,15 @@ class VideoCodec(BaseCodec):
             print ("invalid option "+sizing_policy)
             return sw, sh, None
 
+        # the source is wider than the target
+        wider = float(sw) / sh > float(max_width) / max_height
+
         """
         Fit: FFMPEG scales the output video so it matches the value
         that you specified in either Max Width or Max Height without exceeding the other value."
         """
         if sizing_policy == 'Fit':
-            if float(sh / sw) == float(max_height):
-                return max_width, max_height, None
-            elif float(sh / sw) < float(max_height):  # scaling height
-                factor = float(float(max_height) / float(sh))
-                return int(sw * factor), max_height, None
-            else:
-                factor = float(float(max_width) / float(sw))
-                return max_width, int(sh * factor), None
+            return self._fit(sw, sh, max_width, max_height, wider)
 
         """
         Fill: FFMPEG scales the output video so it matches the value that you specified
@@ -271,18 +352,7 @@ class VideoCodec(BaseCodec):
         centers the output video and then crops it in the dimension (if any) that exceeds the maximum value.
         """
         if sizing_policy == 'Fill':
-            if float(sh / sw) == float(max_height):
-                return max_width, max_height, None
-            elif float(sh / sw) < float(max_height):  # scaling width
-                factor = float(float(max_width) / float(sw))
-                h0 = int(sh * factor)
-                dh = (h0 - max_height) / 2
-                return max_width, h0, 'crop={0}:{1}:{2}:0'.format(max_width, max_height, dh)
-            else:
-                factor = float(float(max_height) / float(sh))
-                w0 = int(sw * factor)
-                dw = (w0 - max_width) / 2
-                return w0, max_height, 'crop={0}:{1}:{2}:0'.format(max_width, max_height, dw)
+            return self._fill(sw, sh, max_width, max_height, wider)
 
         """
         Stretch: FFMPEG stretches the output video to match the values that you specified for Max
@@ -306,14 +376,7 @@ class VideoCodec(BaseCodec):
         """
         if sizing_policy == 'ShrinkToFit':
             if sh > max_height or sw > max_width:
-                if float(sh / sw) == float(max_height):
-                    return max_width, max_height, None
-                elif float(sh / sw) < float(max_height):  # target is taller
-                    factor = float(float(max_height) / float(sh))
-                    return int(sw * factor), max_height, None
-                else:
-                    factor = float(float(max_width) / float(sw))
-                    return max_width, int(sh * factor), None
+                return self._fit(sw, sh, max_width, max_height, wider)
             else:
                 return sw, sh, None
 
@@ -323,24 +386,38 @@ class VideoCodec(BaseCodec):
         this option, FFMPEG does not scale the video up.
         """
         if sizing_policy == 'ShrinkToFill':
-            if sh < max_height or sw < max_width:
-                if float(sh / sw) == float(max_height):
-                    return max_width, max_height, None
-                elif float(sh / sw) < float(max_height):  # scaling width
-                    factor = float(float(max_width) / float(sw))
-                    h0 = int(sh * factor)
-                    dh = (h0 - max_height) / 2
-                    return max_width, h0, 'crop=%d:%d:%d:0' % (max_width, max_height, dh)
-                else:
-                    factor = float(float(max_height) / float(sh))
-                    w0 = int(sw * factor)
-                    dw = (w0 - max_width) / 2
-                    return w0, max_height, 'crop={0}:{1}:{2}:0'.format(max_width, max_height, dw)
+            if sh > max_height and sw > max_width:
+                return self._fill(sw, sh, max_width, max_height, wider)
             else:
-                return int(sw*factor), max_height, None
+                return sw, sh, None
 
         assert False, sizing_policy
 
+    @staticmethod
+    def _fit(sw, sh, max_width, max_height, wider):
+        """
+        Return the size of the source scaled to the largest size fitting in
+        the target, without filter.
+        """
+        if wider:
+            return max_width, int(round(float(sh) * max_width / sw)), None
+        return int(round(float(sw) * max_height / sh)), max_height, None
+
+    @staticmethod
+    def _fill(sw, sh, max_width, max_height, wider):
+        """
+        Return the size of the source scaled to the smallest size covering
+        the target, and the crop of its center to the target size.
+
+        >>> VideoCodec._fill(1920, 1080, 640, 640, True)
+        (1138, 640, 'crop=640:640:249:0')
+        """
+        if wider:
+            width = int(round(float(sw) * max_height / sh))
+            return width, max_height, 'crop={0}:{1}:{2}:0'.format(max_width, max_height, (width - max_width) // 2)
+        height = int(round(float(sh) * max_width / sw))
+        return max_width, height, 'crop={0}:{1}:0:{2}'.format(max_width, max_height, (height - max_height) // 2)
+
     def parse_options(self, opt):
         super(VideoCodec, self).parse_options(opt)
 
@@ -410,6 +487,8 @@ class VideoCodec(BaseCodec):
         safe['max_width'] = w
         safe['max_height'] = h
         safe['aspect_filters'] = filters
+        # frames are scaled before the rotation
+        scale_w, scale_h = w, h
 
         # swap height and width if vertical rotate
         if safe.get('autorotate') and 'src_rotate' in safe:
@@ -441,28 +520,75 @@ class VideoCodec(BaseCodec):
         if 'bufsize' in safe:
             optlist.extend(['-bufsize', str(safe['bufsize']) + 'k'])
         
-        if 'vaapi' not in self.ffmpeg_codec_name:
-            if w and h:
-                optlist.extend(['-s', '{0}x{1}'.format(int(w), int(h))])
-                if 'aspect' in safe:
-                    optlist.extend(['-aspect', '{0}:{1}'.format(int(w), int(h))])
-
+        # crop, scale, aspect corrections, rotation, then the user filters
+        graph = FilterGraph('v', safe.get('src_width'), safe.get('src_height'))
         if safe.get('crop'):
-            optlist = self._extend_vf(optlist, 'crop={0}'.format(safe['crop']))
-
-        if filters:
-            optlist = self._extend_vf(filters)
-
+            graph.add('crop={0}'.format(safe['crop']))
+        if 'vaapi' not in self.ffmpeg_codec_name and scale_w and scale_h:
+            graph.scale(int(scale_w), int(scale_h), safe.get('scaler'))
+        for f in (filters or '').split(','):
+            graph.add(f)
         if safe.get('autorotate', False) and 'src_rotate' in safe:
-            rotate_filter = self._autorotate(safe['src_rotate'])
-            optlist = self._extend_vf(optlist, rotate_filter)
+            graph.rotate(safe['src_rotate'])
+
+        if 'vaapi' not in self.ffmpeg_codec_name:
+            if w and h and 'aspect' in safe:
+                # the output size, after the crop of the Fill policies
+                if graph.width and graph.height:
+                    w, h = graph.width, graph.height
+                optlist.extend(['-aspect', '{0}:{1}'.format(int(w), int(h))])
 
         if 'filters' in safe:
-            optlist = self._extend_vf(optlist, safe['filters'])
+            graph.add(safe['filters'])
+        optlist.extend(graph.options())
 
+        if self.encoder_threads:
+            optlist.extend(self._thread_options(safe))
         optlist.extend(self._codec_specific_produce_ffmpeg_list(safe))
         return optlist
 
+    def _thread_options(self, safe):
+        """
+        Return the ffmpeg options of the threads and thread_type options,
+        for the encoders using the ffmpeg threading; the other encoders map
+        them to their own options in _codec_specific_parse_options.
+        """
+        optlist = []
+        if safe.get('threads', -1) >= 0:
+            optlist.extend(['-threads', str(safe['threads'])])
+        if safe.get('thread_type') in ('frame', 'slice'):
+            optlist.extend(['-thread_type', safe['thread_type']])
+        return optlist
+
+    def is_compatible(self, opt, stream):
+        if not self._same_codec(stream):
+            return False
+
+        safe = self.safe_options(opt)
+        if safe.get('pix_fmt', 'yuv420p') != stream.get('pix_fmt'):
+            return False
+
+        # Any filter, crop or scaling needs to encode.
+        if '-vf' in self.parse_options(opt):
+            return False
+
+        if 'fps' in safe and abs(round(safe['fps'], 2) - stream.get('fps', 0)) > 0.01:
+            return False
+        if 'bitrate' in safe:
+            # Source bitrate is in Mbps, like the bitrate option.
+            bitrate = stream.get('bitrate')
+            if not isinstance(bitrate, (int, float)) or bitrate > safe['bitrate']:
+                return False
+        if safe.get('profile') and str(safe['profile']).lower() != stream.get('profile'):
+            return False
+        if safe.get('level'):
+            try:
+                if float(safe['level']) != stream.get('level'):
+                    return False
+            except ValueError:
+                return False
+        return True
+
 class AudioNullCodec(BaseCodec):
     """
     Null audio codec (no audio).
@@ -500,9 +626,13 @@ class DecoderNullCodec(BaseCodec):
     """
 
     codec_name = None
+    encoder_options = {
+        'threads': int,
+    }
 
     def parse_options(self, opt):
-        return []
+        # the default decoder may still use several threads
+        return DecoderCodec._thread_options(self.safe_options(opt))
 
 class AudioCopyCodec(BaseCodec):
     """
@@ -542,17 +672,37 @@ class VorbisCodec(AudioCodec):
     """
     codec_name = 'vorbis'
     ffmpeg_codec_name = 'libvorbis'
-    encoder_options = AudioCodec.encoder_options.copy()
-    encoder_options.update({
-        'quality': int,  # audio quality. Range is 0-10(highest quality)
+    schema = Schema('libvorbis', [
+        # audio quality. Range is 0-10(highest quality)
         # 3-6 is a good range to try. Default is 3
-    })
+        ('quality', Option(int, flag='-qscale:a')),
+    ])
+    encoder_options = AudioCodec.encoder_options.copy()
+    encoder_options.update(schema.types())
 
-    def _codec_specific_produce_ffmpeg_list(self, safe):
-        optlist = []
-        if 'quality' in safe:
-            optlist.extend(['-qscale:a', safe['quality']])
-        return optlist
+
+class OpusCodec(AudioCodec):
+    """
+    Opus audio codec, the best quality at low bitrates. Sample rates other
+    than 48, 24, 16, 12 and 8 kHz are resampled to 48 kHz.
+    """
+    codec_name = 'opus'
+    ffmpeg_codec_name = 'libopus'
+    samplerates = (48000, 24000, 16000, 12000, 8000)
+    schema = Schema('libopus', [
+        ('vbr', Option(choices=['on', 'off', 'constrained'])),
+        # 0 (fastest) to 10 (best, default)
+        ('compression_level', Option(int, min=0, max=10)),
+        ('application', Option(choices=['voip', 'audio', 'lowdelay'])),
+        ('frame_duration', Option(float, choices=[2.5, 5, 10, 20, 40, 60, 80, 100, 120])),
+    ])
+    encoder_options = AudioCodec.encoder_options.copy()
+    encoder_options.update(schema.types())
+
+    def _codec_specific_parse_options(self, safe):
+        if 'samplerate' in safe and safe['samplerate'] not in self.samplerates:
+            safe['samplerate'] = 48000
+        return safe
 
 
 class AacCodec(AudioCodec):
@@ -573,6 +723,7 @@ class FdkAacCodec(AudioCodec):
     """
     codec_name = 'libfdk_aac'
     ffmpeg_codec_name = 'libfdk_aac'
+    probe_codec_name = 'aac'
 
 
 class Ac3Codec(AudioCodec):
@@ -623,17 +774,13 @@ class TheoraCodec(VideoCodec):
     """
     codec_name = 'theora'
     ffmpeg_codec_name = 'libtheora'
-    encoder_options = VideoCodec.encoder_options.copy()
-    encoder_options.update({
-        'quality': int,  # audio quality. Range is 0-10(highest quality)
+    schema = Schema('libtheora', [
+        # video quality. Range is 0-10(highest quality)
         # 5-7 is a good range to try (default is 200k bitrate)
-    })
-
-    def _codec_specific_produce_ffmpeg_list(self, safe):
-        optlist = []
-        if 'quality' in safe:
-            optlist.extend(['-qscale:v', safe['quality']])
-        return optlist
+        ('quality', Option(int, flag='-qscale:v')),
+    ])
+    encoder_options = VideoCodec.encoder_options.copy()
+    encoder_options.update(schema.types())
 
 class H264VaapiCodec(VideoCodec):
     """
@@ -641,40 +788,19 @@ class H264VaapiCodec(VideoCodec):
     """
     codec_name = 'h264_vaapi'
     ffmpeg_codec_name = 'h264_vaapi'
+    probe_codec_name = 'h264'
+    encoder_threads = False
+    schema = Schema('h264_vaapi', [
+        ('qp', Option(int, min=0, max=52, default=20)),
+        ('quality', Option(int, min=0, max=8, default=0)),
+        ('low_power', Option(int, choices=[0, 1])),
+        ('coder', Option(int, choices=[0, 1])),
+    ])
     encoder_options = VideoCodec.encoder_options.copy()
+    encoder_options.update(schema.types())
     encoder_options.update({
-        'qp': int,
-        'quality': int,
-        'low_power': int,
-        'coder': int,
         'hwaccel_device': str,
     })
-    
-    def _codec_specific_produce_ffmpeg_list(self, safe):
-        optlist = []
-        if 'qp' in safe:
-            if 0 <= safe['qp'] <= 52:
-                optlist.extend(['-qp', str(safe['qp'])])
-            else:
-                logger.error('Constant QP ({}) invalid. Reverting to default (20) ...'.format(safe['qp']))
-                optlist.extend(['-qp', '20'])
-        if 'quality' in safe:
-            if 0 <= safe['quality'] <= 8:
-                optlist.extend(['-quality', str(safe['quality'])])
-            else:
-                logger.error('Encode quality invalid ({}). Reverting to default (0)...'.format(safe['quality']))
-                optlist.extend(['-quality', '0'])
-        if 'low_power' in safe:
-            if safe['low_power'] in [0, 1]:
-                optlist.extend(['-low_power', str(safe['low_power'])])
-            else:
-                logger.error('Invalid low_power ({})'.format(safe['low_power']))
-        if 'coder' in safe:
-            if safe['coder'] in [0, 1]:
-                optlist.extend(['-coder', str(safe['coder'])])
-            else:
-                logger.error('Invalid coder ({})'.format(safe['coder']))
-        return optlist
         
                 
 class HevcVaapiCodec(VideoCodec):
@@ -683,195 +809,56 @@ class HevcVaapiCodec(VideoCodec):
     """
     codec_name = 'hevc_vaapi'
     ffmpeg_codec_name = 'hevc_vaapi'
+    probe_codec_name = 'hevc'
+    encoder_threads = False
+    schema = Schema('hevc_vaapi', [
+        ('qp', Option(int, min=0, max=52, default=25)),
+        ('vprofile', Option(int, flag='-profile:v', choices=[2])),
+    ])
     encoder_options = VideoCodec.encoder_options.copy()
-    encoder_options.update({
-        'qp': int,
-        'vprofile': int,
-    })
-    
-    def _codec_specific_produce_ffmpeg_list(self, safe):
-        optlist = []
-        if 'qp' in safe:
-            if 0 <= safe['qp'] <= 52:
-                optlist.extend(['-qp', str(safe['qp'])])
-            else:
-                logger.error('Constant QP ({}) invalid. Reverting to default (25) ...'.format(safe['qp']))
-                optlist.extend(['-qp', '25'])
-                
-        if 'vprofile' in safe:
-            if safe['vprofile'] in [2]:
-                optlist.extend(['-profile:v', str(safe['vprofile'])])
-            else:
-                logger.error('Profile ({}) invalid.'.format(safe['vprofile']))
-        return optlist
+    encoder_options.update(schema.types())
               
 
+NVENC_PRESETS = ['default', 'slow', 'medium', 'fast', 'hp', 'hq', 'bd', 'll', 'llhq', 'llhp', 'lossless', 'losslesshp']
+NVENC_RATE_CONTROLS = ['constqp', 'vbr', 'cbr', 'vbr_minqp', 'll_2pass_quality', 'll_2pass_size', 'vbr_2pass']
+
+
 class H264NvencCodec(VideoCodec):
     """
     H264/AVC Video codec by Nvidia.
     """
     codec_name = 'h264_nvenc'
     ffmpeg_codec_name = 'h264_nvenc'
+    probe_codec_name = 'h264'
+    encoder_threads = False
+    schema = Schema('nvenc_h264', [
+        ('preset', Option(choices=NVENC_PRESETS, default='medium')),
+        ('profile', Option(flag='-profile:v', choices=['baseline', 'main', 'high', 'high444p'], default='main')),
+        ('level', Option(choices=['auto', '1', '1.0', '1b', '1.0b', '1.1', '1.2', '1.3', '2', '2.0', '2.1', '2.2',
+                                  '3', '3.0', '3.1', '3.2', '4', '4.0', '4.1', '4.2', '5', '5.0', '5.1'],
+                         default='auto')),
+        ('rc', Option(choices=NVENC_RATE_CONTROLS, default='-1')),
+        ('rc-lookahead', Option(int, min=-1, default=-1)),
+        ('surfaces', Option(int, min=0, default=32)),
+        ('cbr', Option(bool)),
+        ('2pass', Option(bool)),
+        ('gpu', Option(int, min=-2, default='any')),
+        ('delay', Option(int, min=0)),
+        ('no-scenecut', Option(bool)),
+        ('forced-idr', Option(bool)),
+        ('b_adapt', Option(bool)),
+        ('spatial-aq', Option(bool)),
+        ('temporal-aq', Option(bool)),
+        ('zerolatency', Option(bool)),
+        ('nonref_p', Option(bool)),
+        ('strict_gop', Option(bool)),
+        ('aq-strength', Option(int, min=1, max=15, default=8)),
+        ('cq', Option(float, min=0, max=51, default=0)),
+        ('qmin', Option(float, min=0, max=51, default=0)),
+        ('qmax', Option(float, min=0, max=51, default=51)),
+    ])
     encoder_options = VideoCodec.encoder_options.copy()
-    encoder_options.update({
-        'preset': str,
-        'profile': str,
-        'level': str,
-        'rc': str,
-        'rc-lookahead': int,
-        'surfaces': int,
-        'cbr': bool,
-        '2pass': bool,
-        'gpu': int,
-        'delay': int,
-        'no-scenecut': bool,
-        'forced-idr': bool,
-        'b_adapt': bool,
-        'spatial-aq': bool,
-        'temporal-aq': bool,
-        'zerolatency': bool,
-        'nonref_p': bool,
-        'strict_gop': bool,
-        'aq-strength': bool,
-        'cq': float,
-        'qmin': float,
-        'qmax': float
-    })
-    
-    def _codec_specific_produce_ffmpeg_list(self, safe):
-        optlist = []
-        if 'preset' in safe:
-            if safe['preset'] in ['default', 'slow', 'medium', 'fast', 'hp', 'hq', 'bd', 'll', 'llhq', 'llhp', 'lossless', 'losslesshp']:
-                optlist.extend(['-preset', safe['preset']])
-            else:
-                logger.error(safe['preset']+' is not a valid preset for nvenc_h264 encoder ...')
-                optlist.extend(['-preset', 'medium'])
-        if 'profile' in safe:
-            if safe['profile'] in ['baseline', 'main', 'high', 'high444p']:
-                optlist.extend(['-profile:v', safe['profile']])
-            else:
-                logger.error(safe['profile']+' is not a valid profile for nvenc_h264 encoder ...')
-                optlist.extend(['-profile:v', 'main'])
-        if 'level' in safe:
-            if safe['level'] in ['auto', '1', '1.0', '1b', '1.0b', '1.1', '1.2', '1.3', '2', '2.0', '2.1', '2.2', '3', '3.0', '3.1', '3.2', '4', '4.0', '4.1', '4.2', '5', '5.0', '5.1']:
-                optlist.extend(['-level', safe['level']])
-            else:
-                logger.error(safe['level']+' is not a valid level for nvenc_h264 encoder ...')
-                optlist.extend(['-level', 'auto'])
-        if 'rc' in safe:
-            if safe['rc'] in ['constqp', 'vbr', 'cbr', 'vbr_minqp', 'll_2pass_quality', 'll_2pass_size', 'vbr_2pass']:
-                optlist.extend(['-rc', safe['rc']])
-            else:
-                logger.error(safe['rc']+' is not a valid rc for nvenc_h264 encoder ...')
-                optlist.extend(['-rc', '-1'])
-        if 'rc-lookahead' in safe:
-            if safe['rc-lookahead'] >= -1:
-                optlist.extend(['-rc-lookahead', str(safe['rc-lookahead'])])
-            else:
-                logger.error(str(safe['rc-lookahead'])+' is not a valid rc-lookahead for nvenc_h264 encoder ...')
-                optlist.extend(['-rc-lookahead', '-1'])
-        if 'surfaces' in safe:
-            if safe['surfaces'] >= 0:
-                optlist.extend(['-surfaces', str(safe['surfaces'])])
-            else:
-                logger.error(str(safe['surfaces'])+' is not a valid surfaces for nvenc_h264 encoder ...')
-                optlist.extend(['-surfaces', '32'])
-        if 'cbr' in safe:
-            if type(safe['cbr']) == bool:
-                optlist.extend(['-cbr', str(int(safe['cbr']))])
-            else:
-                logger.error(str(int(safe['cbr']))+' is not a valid cbr for nvenc_h264 encoder ...')
-                optlist.extend(['-cbr', '0'])
-        if '2pass' in safe:
-            if type(safe['2pass']) == bool:
-                optlist.extend(['-2pass', str(int(safe['2pass']))])
-            else:
-                logger.error(str(int(safe['2pass']))+' is not a valid 2pass for nvenc_h264 encoder ...')
-                optlist.extend(['-2pass', 'auto'])
-        if 'gpu' in safe:
-            if safe['gpu'] >= -2:
-                optlist.extend(['-gpu', str(safe['gpu'])])
-            else:
-                logger.error(str(safe['gpu'])+' is not a valid gpu for nvenc_h264 encoder ...')
-                optlist.extend(['-gpu', 'any'])
-        if 'delay' in safe:
-            if safe['delay'] >= 0:
-                optlist.extend(['-delay', str(safe['delay'])])
-            else:
-                logger.error(str(safe['delay'])+' is not a valid delay for nvenc_h264 encoder ...')
-        if 'no-scenecut' in safe:
-            if type(safe['no-scenecut']) == bool:
-                optlist.extend(['-no-scenecut', str(int(safe['no-scenecut']))])
-            else:
-                logger.error(str(int(safe['no-scenecut']))+' is not a valid no-scenecut for nvenc_h264 encoder ...')
-                optlist.extend(['-no-scenecut', '0'])
-        if 'forced-idr' in safe:
-            if type(safe['forced-idr']) == bool:
-                optlist.extend(['-forced-idr', str(int(safe['forced-idr']))])
-            else:
-                logger.error(str(int(safe['forced-idr']))+' is not a valid forced-idr for nvenc_h264 encoder ...')
-                optlist.extend(['-forced-idr', 'auto'])
-        if 'b_adapt' in safe:
-            if type(safe['b_adapt']) == bool:
-                optlist.extend(['-b_adapt', str(int(safe['b_adapt']))])
-            else:
-                logger.error(str(int(safe['b_adapt']))+' is not a valid b_adapt for nvenc_h264 encoder ...')
-                optlist.extend(['-b_adapt', '1'])
-        if 'spatial-aq' in safe:
-            if type(safe['spatial-aq']) == bool:
-                optlist.extend(['-spatial-aq', str(int(safe['spatial-aq']))])
-            else:
-                logger.error(str(int(safe['spatial-aq']))+' is not a valid spatial-aq for nvenc_h264 encoder ...')
-                optlist.extend(['-spatial-aq', '0'])
-        if 'temporal-aq' in safe:
-            if type(safe['temporal-aq']) == bool:
-                optlist.extend(['-temporal-aq', str(int(safe['temporal-aq']))])
-            else:
-                logger.error(str(int(safe['temporal-aq']))+' is not a valid temporal-aq for nvenc_h264 encoder ...')
-                optlist.extend(['-temporal-aq', '0'])
-        if 'zerolatency' in safe:
-            if type(safe['zerolatency']) == bool:
-                optlist.extend(['-zerolatency', str(int(safe['zerolatency']))])
-            else:
-                logger.error(str(int(safe['zerolatency']))+' is not a valid zerolatency for nvenc_h264 encoder ...')
-                optlist.extend(['-zerolatency', '0'])
-        if 'nonref_p' in safe:
-            if type(safe['nonref_p']) == bool:
-                optlist.extend(['-nonref_p', str(int(safe['nonref_p']))])
-            else:
-                logger.error(str(int(safe['nonref_p']))+' is not a valid nonref_p for nvenc_h264 encoder ...')
-                optlist.extend(['-nonref_p', '0'])
-        if 'strict_gop' in safe:
-            if type(safe['strict_gop']) == bool:
-                optlist.extend(['-strict_gop', str(int(safe['strict_gop']))])
-            else:
-                logger.error(str(int(safe['strict_gop']))+' is not a valid strict_gop for nvenc_h264 encoder ...')
-                optlist.extend(['-strict_gop', '0'])
-        if 'aq-strength' in safe:
-            if 1 <= safe['aq-strength'] <= 15:
-                optlist.extend(['-aq-strength', str(safe['aq-strength'])])
-            else:
-                logger.error(str(safe['aq-strength'])+' is not a valid aq-strength for nvenc_h264 encoder ...')
-                optlist.extend(['-aq-strength', '8'])
-        if 'cq' in safe:
-            if 0 <= safe['cq'] <= 51:
-                optlist.extend(['-cq', str(safe['cq'])])
-            else:
-                logger.error(str(safe['cq'])+' is not a valid cq for hevc_nvenc encoder ...')
-                optlist.extend(['-cq', '0'])
-        if 'qmin' in safe:
-            if 0 <= safe['qmin'] <= 51:
-                optlist.extend(['-qmin', str(safe['qmin'])])
-            else:
-                logger.error(str(safe['qmin'])+' is not a valid qmin for hevc_nvenc encoder ...')
-                optlist.extend(['-qmin', '0'])
-        if 'qmax' in safe:
-            if 0 <= safe['qmax'] <= 51:
-                optlist.extend(['-qmax', str(safe['qmax'])])
-            else:
-                logger.error(str(safe['qmax'])+' is not a valid qmax for hevc_nvenc encoder ...')
-                optlist.extend(['-qmax', '51'])
-        return optlist
+    encoder_options.update(schema.types())
 
  
 class HEVCNvencCodec(VideoCodec):
@@ -880,195 +867,47 @@ class HEVCNvencCodec(VideoCodec):
     """
     codec_name = 'hevc_nvenc'
     ffmpeg_codec_name = 'hevc_nvenc'
+    probe_codec_name = 'hevc'
+    encoder_threads = False
+    schema = Schema('hevc_nvenc', [
+        ('preset', Option(choices=NVENC_PRESETS, default='medium')),
+        ('profile', Option(flag='-profile:v', choices=['main', 'main10', 'rext'], default='main')),
+        ('level', Option(choices=['auto', '1', '1.0', '2', '2.0', '2.1', '3', '3.0', '3.1', '4', '4.0', '4.1',
+                                  '5', '5.0', '5.1', '5.2', '6', '6.0', '6.1', '6.2'],
+                         default='auto')),
+        ('tier', Option(choices=['main', 'high'], default='main')),
+        ('rc', Option(choices=NVENC_RATE_CONTROLS, default='-1')),
+        ('rc-lookahead', Option(int, min=1, max=32, default=-1)),
+        ('surfaces', Option(int, min=0, default=32)),
+        ('cbr', Option(bool)),
+        ('2pass', Option(bool)),
+        ('gpu', Option(int)),
+        ('delay', Option(int, min=0)),
+        ('no-scenecut', Option(bool)),
+        ('forced-idr', Option(bool)),
+        ('spatial_aq', Option(bool)),
+        ('temporal_aq', Option(bool)),
+        ('zerolatency', Option(bool)),
+        ('nonref_p', Option(bool)),
+        ('strict_gop', Option(bool)),
+        ('aq-strength', Option(int, min=1, max=15, default=8)),
+        ('cq', Option(float, min=0, max=51, default=0)),
+        ('aud', Option(bool)),
+        ('bluray-compat', Option(bool)),
+        ('init_qpP', Option(float, min=-1, max=51, default=-1)),
+        ('init_qpB', Option(float, min=-1, max=51, default=-1)),
+        ('init_qpI', Option(float, min=-1, max=51, default=-1)),
+        ('qp', Option(float, min=-1, max=51, default=-1)),
+    ])
     encoder_options = VideoCodec.encoder_options.copy()
-    encoder_options.update({
-        'preset': str,
-        'profile': str,
-        'level': str,
-        'tier': str,
-        'rc': str,
-        'rc-lookahead': int,
-        'surfaces': int,
-        'cbr': bool,
-        '2pass': bool,
-        'gpu': int,
-        'delay': int,
-        'no-scenecut': bool,
-        'forced-idr': bool,
-        'spatial_aq': bool,
-        'temporal_aq': bool,
-        'zerolatency': bool,
-        'nonref_p': bool,
-        'strict_gop': bool,
-        'aq-strength': int,
-        'cq': float,
-        'aud': bool,
-        'bluray-compat': bool,
-        'init_qpP': float,
-        'init_qpB': float,
-        'init_qpI': float,
-        'qp': float,
-    })
-    
-    def _codec_specific_produce_ffmpeg_list(self, safe):
-        optlist = []
-        
-        if 'preset' in safe:
-            if safe['preset'] in ['default', 'slow', 'medium', 'fast', 'hp', 'hq', 'bd', 'll', 'llhq', 'llhp', 'lossless', 'losslesshp']:
-                optlist.extend(['-preset', safe['preset']])
-            else:
-                logger.error(safe['preset']+' is not a valid preset for hevc_nvenc encoder ...')
-                optlist.extend(['-preset', 'medium'])
-        if 'profile' in safe:
-            if safe['profile'] in ['main', 'main10', 'rext']:
-                optlist.extend(['-profile:v', safe['profile']])
-            else:
-                logger.error(safe['profile']+' is not a valid profile for hevc_nvenc encoder ...')
-                optlist.extend(['-profile:v', 'main'])
-        if 'level' in safe:
-            if safe['level'] in ['auto', '1', '1.0', '2', '2.0', '2.1', '3', '3.0', '3.1', '4', '4.0', '4.1', '5', '5.0', '5.1', '5.2', '6', '6.0', '6.1', '6.2']:
-                optlist.extend(['-level', safe['level']])
-            else:
-                logger.error(safe['level']+' is not a valid level for hevc_nvenc encoder ...')
-                optlist.extend(['-level', 'auto'])
-        if 'tier' in safe:
-            if safe['tier'] in ['main', 'high']:
-                optlist.extend(['-tier', safe['tier']])
-            else:
-                logger.error(safe['tier']+' is not a valid tier for hevc_nvenc encoder ...')
-                optlist.exntend(['-tier', 'main'])
-        if 'rc' in safe:
-            if safe['rc'] in ['constqp', 'vbr', 'cbr', 'vbr_minqp', 'll_2pass_quality', 'll_2pass_size', 'vbr_2pass']:
-                optlist.extend(['-rc', safe['rc']])
-            else:
-                logger.error(safe['rc']+' is not a valid rc for hevc_nvenc encoder ...')
-                optlist.extend(['-rc', '-1'])
-        if 'rc-lookahead' in safe:
-            if 0 < safe['rc-lookahead'] < 33:
-                optlist.extend(['-rc-lookahead', str(safe['rc-lookahead'])])
-            else:
-                logger.error(safe['rc-lookahead']+' is not a valid rc-lookahead for hevc_nvenc encoder ...')
-                optlist.extend(['-rc-lookahead', '-1'])
-        if 'surfaces' in safe:
-            if safe['surfaces'] >= 0:
-                optlist.extend(['-surfaces', str(safe['surfaces'])])
-            else:
-                logger.error(safe['surfaces'+' is not a valid surfaces for hevc_nvenc encoder ...'])
-                optlist.extend(['-surfaces', '32'])
-        if 'cbr' in safe:
-            if safe['cbr'] in [False, True]:
-                optlist.extend(['-cbr', str(int(safe['cbr']))])
-            else:
-                logger.error(str(int(safe['cbr']))+' is not a valid cbr for hevc_nvenc encoder ...')
-                optlist.extend(['-cbr', '0'])
-        if '2pass' in safe:
-            if safe['2pass'] in [False, True]:
-                optlist.extend(['-2pass', str(int(safe['2pass']))])
-            else:
-                logger.error(str(int(safe['2pass']))+' is not a valid 2pass for hevc_nvenc encoder ...')
-                optlist.extend(['-2pass', 'auto'])
-        if 'gpu' in safe:
-            if type(safe['gpu']) == int:
-                optlist.extend(['-gpu', str(safe['gpu'])])
-            else:
-                logger.error(str('gpu')+' is not a valid gpu for hevc_nvenc encoder ...')
-                optlist.extend(['-gpu', 'any'])
-        if 'delay' in safe:
-            if safe['delay'] >= 0:
-                optlist.extend(['-delay', str(safe['delay'])])
-            else:
-                logger.error(str(safe['delay'])+' is not a valid delay for hevc_nvenc encoder ...')
-        if 'no-scenecut' in safe:
-            if safe['no-scenecut'] in [False, True]:
-                optlist.extend(['-no-scenecut', str(int(safe['no-scenecut']))])
-            else:
-                logger.error(str(int(safe['no-scenecut']))+' is not a valid no-scenecut for hevc_nvenc encoder ...')
-                optlist.extend(['-no-scenecut', '0'])
-        if 'forced-idr' in safe:
-            if safe['forced-idr'] in [False, True]:
-                optlist.extend(['-forced-idr', str(int(safe['forced-idr']))])
-            else:
-                logger.error(str(int(safe['forced-idr']))+' is not a valid forced-idr for hevc_nvenc encoder ...')
-                optlist.extend(['-forced-idr', 'auto'])
-        if 'spatial_aq' in safe:
-            if safe['spatial_aq'] in [False, True]:
-                optlist.extend(['-spatial_aq', str(int(safe['spatial_aq']))])
-            else:
-                logger.error(str(int(safe['spatial_aq']))+' is not a valid spatial_aq for hevc_nvenc encoder ...')
-                optlist.extend(['-spatial_aq', '0'])
-        if 'temporal_aq' in safe:
-            if safe['temporal_aq'] in [False, True]:
-                optlist.extend(['-temporal_aq', str(int(safe['temporal_aq']))])
-            else:
-                logger.error(str(int(safe['temporal_aq']))+' is not a valid temporal_aq for hevc_nvenc encoder ...')
-                optlist.extend(['-temporal_aq', '0'])
-        if 'zerolatency' in safe:
-            if safe['zerolatency'] in [False, True]:
-                optlist.extend(['-zerolatency', str(int(safe['zerolatency']))])
-            else:
-                logger.error(str(int(safe['zerolatency']))+' is not a valid zerolatency for hevc_nvenc encoder ...')
-                optlist.extend(['-zerolatency', '0'])
-        if 'nonref_p' in safe:
-            if safe['nonref_p'] in [False, True]:
-                optlist.extend(['-nonref_p', str(int(safe['nonref_p']))])
-            else:
-                logger.error(str(int(safe['nonref_p']))+' is not a valid nonref_p for hevc_nvenc encoder ...')
-                optlist.extend(['-nonref_p', '0'])
-        if 'strict_gop' in safe:
-            if safe['strict_gop'] in [False, True]:
-                optlist.extend(['-strict_gop', str(int(safe['strict_gop']))])
-            else:
-                logger.error(str(int(safe['strict_gop']))+' is not a valid strict_gop for hevc_nvenc encoder ...')
-                optlist.extend(['-strict_gop', '0'])
-        if 'aq-strength' in safe:
-            if 0 < safe['aq-strength'] < 16:
-                optlist.extend(['-aq-strength', str(safe['aq-strength'])])
-            else:
-                logger.error(str(safe['aq-strength'])+' is not a valid aq-strength for hevc_nvenc encoder ...')
-                optlist.extend(['-aq-strength', '8'])
-        if 'cq' in safe:
-            if 0 <= safe['cq'] <= 51:
-                optlist.extend(['-cq', str(safe['cq'])])
-            else:
-                logger.error(str(safe['cq'])+' is not a valid cq for hevc_nvenc encoder ...')
-                optlist.extend(['-cq', '0'])
-        if 'aud' in safe:
-            if safe['aud'] in [False, True]:
-                optlist.extend(['-aud', str(int(safe['aud']))])
-            else:
-                logger.error(str(safe['aud'])+' is not a valid aud for hevc_nvenc encoder ...')
-                optlist.extend(['-aud', '0'])
-        if 'bluray-compat' in safe:
-            if safe['bluray-compat'] in [False, True]:
-                optlist.extend(['-bluray-compat'], str(int(safe['bluray-compat'])))
-            else:
-                logger.error(str(safe['bluray-compat'])+' is not a valid bluray-compat for hevc_nvenc encoder ...')
-                optlist.extend(['-bluray-compat'], '0')
-        if 'init_qpP' in safe:
-            if -1 <= safe['init_qpP'] <= 51:
-                optlist.extend(['-init_qpP', str(safe['init_qpP'])])
-            else:
-                logger.error(str(safe['init_qpP'])+' is not a valid init_qpP for hevc_nvenc encoder ...')
-                optlist.extend(['-init_qpP', '-1'])
-        if 'init_qpB' in safe:
-            if -1 <= safe['init_qpP'] <= 51:
-                optlist.extend(['-init_qpB', str(safe['init_qpB'])])
-            else:
-                logger.error(str(safe['init_qpB'])+' is not a valid init_qpB for hevc_nvenc encoder ...')
-                optlist.extend(['-init_qpB', '-1'])
-        if 'init_qpI' in safe:
-            if -1 <= safe['init_qpI'] <= 51:
-                optlist.extend(['-init_qpI', str(safe['init_qpI'])])
-            else:
-                logger.error(str(safe['init_qpI'])+' is not a valid init_qpI for hevc_nvenc encoder ...')
-                optlist.extend(['-init_qpI', '-1'])
-        if 'qp' in safe:
-            if -1 <= safe['qp'] <= 51:
-                optlist.extend(['-qp', str(safe['qp'])])
-            else:
-                logger.error(str(safe['qp'])+' is not a valid qp for hevc_nvenc encoder ...')
-                optlist.extend(['-qp', '-1'])
-        return optlist
+    encoder_options.update(schema.types())
+
+
+X265_PROFILES = ['main', 'main-intra', 'mainstillpicture', 'main444-8', 'main444-intra', 'main444-stillpicture',
+                 'main10', 'main10-intra', 'main422-10', 'main422-10-intra', 'main444-10', 'main444-10-intra',
+                 'main12', 'main12-intra', 'main422-12', 'main422-12-intra', 'main444-12', 'main444-12-intra']
+X265_LEVELS = ['1', '2', '2.1', '3', '3.1', '4', '4.1', '5', '5.1', '5.2', '6', '6.1', '6.2', '8.5']
+
 
 class HEVCCodec(VideoCodec):
     """
@@ -1076,287 +915,155 @@ class HEVCCodec(VideoCodec):
     """
     codec_name = 'hevc'
     ffmpeg_codec_name = 'libx265'
+    ssim_option = ('ssim', 1)
+    # preset and tune are ffmpeg options, the others are x265 parameters
+    schema = Schema('libx265', [
+        ('preset', Option(choices=['ultrafast', 'superfast', 'veryfast', 'faster', 'fast', 'medium', 'slow',
+                                   'slower', 'veryslow', 'placebo'],
+                          default='medium')),
+        ('tune', Option(choices=['psnr', 'ssim', 'grain', 'fastdecode', 'zerolatency'], default='grain')),
+        ('ssim', Option(int, choices=[0, 1], param=True)),
+        ('psnr', Option(int, choices=[0, 1], param=True)),
+        ('profile', Option(str, choices=X265_PROFILES, param=True)),
+        ('level-idc', Option(str, choices=X265_LEVELS, default=0, param=True)),
+        ('high-tier', Option(bool, param=True)),
+        ('ref', Option(int, min=1, max=16, default=3, param=True)),
+        ('allow-non-conformance', Option(bool, param=True)),
+        ('uhd-bd', Option(bool, param=True)),
+        ('rd', Option(int, min=1, max=6, default=3, param=True)),
+        ('ctu', Option(int, choices=[64, 32, 16], default=64, param=True)),
+        ('min-cu-size', Option(int, choices=[8, 16, 32], default=8, param=True)),
+        ('limit-refs', Option(int, min=0, max=3, default=3, param=True)),
+        ('limit-modes', Option(bool, param=True)),
+        ('rect', Option(bool, param=True)),
+        ('amp', Option(bool, param=True)),
+        ('early-skip', Option(bool, param=True)),
+        ('rskip', Option(bool, param=True)),
+        ('fast-intra', Option(bool, param=True)),
+        ('b-intra', Option(bool, param=True)),
+        ('cu-lossless', Option(bool, param=True)),
+        ('tskip-fast', Option(bool, param=True)),
+        ('rd-refine', Option(bool, param=True)),
+        ('analysis-mode', Option(int, min=0, max=2, param=True)),
+        ('analysis-file', Option(str, param=True)),
+        ('rdoq-level', Option(int, min=0, max=2, off=-1, param=True)),
+        ('tu-intra-depth', Option(int, min=1, max=4, default=1, param=True)),
+        ('tu-inter-depth', Option(int, min=1, max=4, default=1, param=True)),
+        ('limit-tu', Option(int, min=0, max=4, default=0, param=True)),
+        ('nr-intra', Option(int, min=0, max=2000, default=0, param=True)),
+        ('nr-inter', Option(int, min=0, max=2000, default=0, param=True)),
+        ('rdpenalty', Option(int, min=0, max=2, default=0, param=True)),
+        ('tskip', Option(bool, param=True)),
+        ('max-tu-size', Option(int, choices=[4, 8, 16, 32], default=32, param=True)),
+        ('dynamic-rd', Option(int, min=0, max=4, default=0, param=True)),
+        ('ssim-rd', Option(bool, param=True)),
+        ('max-merge', Option(int, min=1, max=5, default=2, param=True)),
+        ('me', Option(int, min=0, max=5, default=1, param=True)),
+        ('subme', Option(int, min=0, max=7, default=2, param=True)),
+        ('merange', Option(int, min=0, max=32768, default=57, param=True)),
+        ('temporal-mvp', Option(bool, param=True)),
+        ('weightp', Option(bool, param=True)),
+        ('weightb', Option(bool, param=True)),
+        ('analyze-src-pics', Option(bool, param=True)),
+        ('strong-intra-smoothing', Option(bool, param=True)),
+        ('constrained-intra', Option(bool, param=True)),
+        ('psy-rd', Option(float, min=0.0, max=5.0, default=2.0, param=True)),
+        ('psy-rdoq', Option(float, min=0.0, max=50.0, default=0.0, param=True)),
+        ('open-gop', Option(bool, param=True)),
+        ('keyint', Option(int, param=True)),
+        ('min-keyint', Option(int, min=0, default=0, param=True)),
+        ('scenecut', Option(bool, param=True)),
+        ('scenecut-bias', Option(float, min=0.0, max=100.0, default=5.0, param=True)),
+        ('intra-refresh', Option(bool, negatable=False, param=True)),
+        ('rc-lookahead', Option(int, min=1, max=250, default=20, param=True)),
+        ('lookahead-slices', Option(int, min=0, max=16, param=True)),
+        ('lookahead-threads', Option(int, param=True)),
+        ('pools', Option(str, param=True)),
+        ('frame-threads', Option(int, min=0, max=16, param=True)),
+        ('wpp', Option(bool, param=True)),
+        ('b-adapt', Option(int, min=0, max=2, default=2, param=True)),
+        ('bframes', Option(int, min=0, max=16, default=4, param=True)),
+        ('bframe-bias', Option(int, min=-90, max=100, default=0, param=True)),
+        ('b-pyramid', Option(bool, param=True)),
+        ('bitrate', Option(int, min=0, default=0, param=True)),
+        ('crf', Option(float, min=0.0, max=51.0, default=28.0, param=True)),
+        ('crf-max', Option(float, min=0.0, max=51.0, param=True)),
+        ('crf-min', Option(float, min=0.0, max=51.0, param=True)),
+        ('vbv-bufsize', Option(int, min=0, default=0, param=True)),
+        ('vbv-maxrate', Option(int, min=0, default=0, param=True)),
+        ('vbv-init', Option(float, min=0.0, max=1.0, default=0.9, param=True)),
+        ('qp', Option(int, min=0, max=51, param=True)),
+        ('lossless', Option(bool, param=True)),
+        ('aq-mode', Option(int, min=0, max=3, default=1, param=True)),
+        ('aq-strength', Option(float, min=0.0, max=3.0, default=1.0, param=True)),
+        ('aq-motion', Option(bool, param=True)),
+        ('qg-size', Option(int, choices=[8, 16, 32, 64], param=True)),
+        ('cutree', Option(bool, param=True)),
+        ('pass', Option(int, min=0, max=3, param=True)),
+        ('stats', Option(str, param=True)),
+        ('slow-firstpass', Option(bool, param=True)),
+        ('multi-pass-opt-analysis', Option(bool, param=True)),
+        ('multi-pass-opt-distortion', Option(bool, param=True)),
+        ('strict-cbr', Option(bool, param=True)),
+        ('cbqpoffs', Option(int, min=-12, max=12, default=0, param=True)),
+        ('crqpoffs', Option(int, min=-12, max=12, default=0, param=True)),
+        ('qcomp', Option(float, min=0, max=1, default=0.6, param=True)),
+        ('qpstep', Option(int, min=0, default=4, param=True)),
+        ('qpmin', Option(int, min=0, default=0, param=True)),
+        ('qpmax', Option(int, min=0, default=69, param=True)),
+        ('rc-grain', Option(bool, param=True)),
+        ('qblur', Option(float, min=0, default=0.5, param=True)),
+        ('cplxblur', Option(float, min=0, default=20, param=True)),
+        ('signhide', Option(bool, param=True)),
+        ('qpfile', Option(str, param=True)),
+        ('scaling-list', Option(str, param=True)),
+        ('lambda-file', Option(str, param=True)),
+        ('sao', Option(bool, param=True)),
+        ('sao-non-deblock', Option(bool, param=True)),
+        ('sar', Option(int, min=1, max=16, param=True)),
+        ('display-window', Option(str, choices=['left', 'top', 'right', 'bottom'], param=True)),
+        ('overscan', Option(str, choices=['show', 'crop'], param=True)),
+        ('videoformat', Option(int, min=0, max=5, param=True)),
+        ('range', Option(str, choices=['full', 'limited'], param=True)),
+        ('colorprim', Option(int, min=1, max=9, param=True)),
+        ('transfer', Option(int, min=1, max=18, param=True)),
+        ('colormatrix', Option(int, min=0, max=10, param=True)),
+        ('chromaloc', Option(int, min=0, max=5, param=True)),
+        ('hdr', Option(bool, param=True)),
+        ('hdr-opt', Option(bool, param=True)),
+        ('min-luma', Option(int, min=0, param=True)),
+        ('max-luma', Option(int, min=0, param=True)),
+        ('annexb', Option(bool, param=True)),
+        ('repeat-headers', Option(bool, param=True)),
+        ('aud', Option(bool, param=True)),
+        ('hrd', Option(bool, param=True)),
+        ('info', Option(bool, param=True)),
+        ('hash', Option(int, min=1, max=3, param=True)),
+        ('temporal-layers', Option(bool, param=True)),
+        ('log2-max-poc-lsb', Option(int, min=0, default=8, param=True)),
+        ('vui-timing-info', Option(bool, param=True)),
+        ('vui-hrd-info', Option(bool, param=True)),
+        ('opt-qp-pps', Option(bool, param=True)),
+        ('opt-ref-list-length-pps', Option(bool, param=True)),
+        ('multi-pass-opt-rps', Option(bool, param=True)),
+        ('opt-cu-delta-qp', Option(bool, param=True)),
+    ], params_flag='-x265-params')
     encoder_options = VideoCodec.encoder_options.copy()
-    encoder_options.update({
-        'preset': str,
-        'tune': str,
-        'ssim': bool,
-        'psnr': bool,
-        'profile': str,
-        'level-idc': str,
-        'high-tier': bool,
-        'ref': int,
-        'allow-non-conformance': bool,
-        'uhd-bd': bool,
-        'rd': int,
-        'ctu': int,
-        'min-cu-size': int,
-        'limit-refs': int,
-        'limit-modes': bool,
-        'rect': bool,
-        'amp': bool,
-        'early-skip': bool,
-        'rskip': bool,
-        'fast-intra': bool,
-        'b-intra': bool,
-        'cu-lossless': bool,
-        'tskip-fast': bool,
-        'rd-refine': bool,
-        'analysis-mode': int,
-        'analysis-file': str,
-        'rdoq-level': int,
-        'tu-intra-depth': int,
-        'tu-inter-depth': int,
-        'limit-tu': int,
-        'nr-intra': int,
-        'nr-inter': int,
-        'tskip': bool,
-        'rdpenalty': int,
-        'max-tu-size': int,
-        'dynamic-rd': int,
-        'ssim-rd': bool,
-        'max-merge': int,
-        'me': int,
-        'subme': int,
-        'merange': int,
-        'temporal-mvp': bool,
-        'weightp': bool,
-        'weightb': bool,
-        'analyze-src-pics': bool,
-        'strong-intra-smoothing': bool,
-        'constrained-intra': bool,
-        'psy-rd': float,
-        'psy-rdoq': float,
-        'open-gop': bool,
-        'keyint': int,
-        'min-keyint': int,
-        'scenecut': bool,
-        'scenecut-bias': float,
-        'intra-refresh': bool,
-        'rc-lookahead': int,
-        'lookahead-slices': int,
-        'lookahead-threads': int,
-        'b-adapt': int,
-        'bframes': int,
-        'bframe-bias': int,
-        'b-pyramid': bool,
-        'bitrate': int,
-        'crf': float,
-        'crf-max': float,
-        'crf-min': float,
-        'vbv-bufsize': int,
-        'vbv-maxrate': int,
-        'vbv-init': float,
-        'qp': int,
-        'lossless': bool,
-        'aq-mode': int,
-        'aq-strength': float,
-        'aq-motion': bool,
-        'qg-size': int,
-        'cutree': bool,
-        'pass': int,
-        'stats': str,
-        'slow-firstpass': bool,
-        'multi-pass-opt-analysis': bool,
-        'multi-pass-opt-distortion': bool,
-        'strict-cbr': bool,
-        'cbqpoffs': int,
-        'crqpoffs': int,
-        'qcomp': float,
-        'qpstep': int,
-        'qpmin': int,
-        'qpmax': int,
-        'rc-grain': bool,
-        'qblur': float,
-        'cplxblur': float,
-        'signhide': bool,
-        'qpfile': str,
-        'scaling-list': str,
-        'lambda-file': str,
-        'sao': bool,
-        'sao-non-deblock': bool,
-        'sar': int,
-        'display-window': str,
-        'overscan': str,
-        'videoformat': int,
-        'range': str,
-        'colorprim': int,
-        'transfer': int,
-        'colormatrix': int,
-        'chromaloc': int,
-        'hdr': bool,
-        'hdr-opt': bool,
-        'min-luma': int,
-        'max-luma': int,
-        'annexb': bool,
-        'repeat-headers': bool,
-        'aud': bool,
-        'hrd': bool,
-        'info': bool,
-        'hash': int,
-        'temporal-layers': bool,
-        'log2-max-poc-lsb': int,
-        'vui-timing-info': bool,
-        'vui-hrd-info': bool,
-        'opt-qp-pps': bool,
-        'opt-ref-list-length-pps': bool,
-        'multi-pass-opt-rps': bool,
-        'opt-cu-delta-qp': bool
-    })
-    
-    def check_condition(self, name, value, default, condition, x265_params):
-        if condition:
-            x265_params.append(name+'='+str(value))
-        else:
-            if type(default) != bool:
-                x265_params.append(name+'='+str(default))
-            logger.error(str(value)+' is not a valid '+name+' for libx265 encoder ...')
-    
-    def _codec_specific_produce_ffmpeg_list(self, safe):
-        optlist = []
-        x265_params = []
-        if 'preset' in safe:
-            if safe['preset'] in ['ultrafast', 'superfast', 'veryfast', 'faster', 'fast', 'medium', 'slow', 'slower', 'veryslow', 'placebo']:
-                optlist.extend(['preset', safe['preset']])
-            else:
-                logger.error(safe['preset']+' is not a valid preset for libx265 encoder ...')
-                optlist.extend(['preset', 'medium'])
-        if 'tune' in safe:
-            if safe['tune'] in ['psnr', 'ssim', 'grain', 'fastdecode', 'zerolatency']:
-                optlist.extend(['tune', safe['tune']])
-            else:
-                logger.error(safe['tune']+' is not a valid tune for libx265 encoder ...')
-                optlist.extend(['tune', 'grain'])
-        if 'ssim' in safe: x265_params.append('ssim' if safe['ssim'] else 'no-ssim')
-        if 'psnr' in safe: x265_params.append('psnr' if safe['psnr'] else 'no-psnr')
-        if 'profile' in safe: self.check_condition('profile', safe['profile'], False, safe['profile'] in [ 'main', 'main-intra', 'mainstillpicture', 'main444-8', 'main444-intra', 'main444-stillpicture', 'main10', 'main10-intra', 'main422-10', 'main422-10-intra', 'main444-10', 'main444-10-intra', 'main12', 'main12-intra', 'main422-12', 'main422-12-intra', 'main444-12', 'main444-12-intra'], x265_params)
-        if 'level-idc' in safe: self.check_condition('level-idc', safe['level-idc'], 0, safe['level-idc'] in ['1', '2', '2.1', '3', '3.1', '4', '4.1', '5', '5.1', '5.2', '6', '6.1', '6.2', '8.5'], x265_params)
-        if 'high-tier' in safe: x265_params.append('high-tier' if safe['high-tier'] else 'no-high-tier')
-        if 'ref' in safe: self.check_condition('ref', safe['ref'], 3, 1 <= safe['ref'] <= 16, x265_params)
-        if 'allow-non-conformance' in safe: x265_params.append('allow-non-conformance' if safe['allow-non-conformance'] else 'no-allow-non-conformance')
-        if 'uhd-bd' in safe: x265_params.append('uhd-bd' if safe['uhd-bd'] else 'no-uhd-bd')
-        if 'rd' in safe: self.check_condition('rd', safe['rd'], 3, 1 <= safe['rd'] <= 6, x265_params)
-        if 'ctu' in safe: self.check_condition('ctu', safe['ctu'], 64, safe['ctu'] in [64, 32, 16], x265_params)
-        if 'min-cu-size' in safe: self.check_condition('min-cu-size', safe['min-cu-size'], 8, safe['min-cu-size'] in [8, 16, 32], x265_params)
-        if 'limit-refs' in safe: self.check_condition('limit-refs', safe['limit-refs'], 3, 0 <= safe['limit-refs'] <= 3, x265_params)
-        if 'limit-modes' in safe: x265_params.append('limit-modes' if safe['limit-modes'] else 'no-limit-modes')
-        if 'rect' in safe: x265_params.append('rect' if safe['rect'] else 'no-rect')
-        if 'amp' in safe: x265_params.append('amp' if safe['amp'] else 'no-amp')
-        if 'early-skip' in safe: x265_params.append('early-skip' if safe['early-skip'] else 'no-early-skip')
-        if 'rskip' in safe: x265_params.append('rskip' if safe['rskip'] else 'no-rskip')
-        if 'fast-intra' in safe: x265_params.append('fast-intra' if safe['fast-intra'] else 'no-fast-intra')
-        if 'b-intra' in safe: x265_params.append('b-intra' if safe['b-intra'] else 'no-b-intra')
-        if 'cu-lossless' in safe: x265_params.append('cu-lossless' if safe['cu-lossless'] else 'no-cu-lossless')
-        if 'tskip-fast' in safe: x265_params.append('tskip-fast' if safe['tskip-fast'] else 'no-tskip-fast')
-        if 'rd-refine' in safe: x265_params.append('rd-refine' if safe['rd-refine'] else 'no-rd-refine')
-        if 'analysis-mode' in safe: self.check_condition('analysis-mode', safe['analysis-mode'], False, 0 <= safe['analysis-mode'] <= 2, x265_params)
-        if 'analysis-file' in safe: self.check_condition('analysis-file', safe['analysis-file'], False, True, x265_params)
-        if 'rdoq-level' in safe:
-            if safe['rdoq-level'] == -1: x265_params.append('no-rdoq-level')
-            else: self.check_condition('rdoq-level', safe['rdoq-level'], False, 0 <= safe['rdoq-level'] <= 2, x265_params)
-        if 'tu-intra-depth' in safe: self.check_condition('tu-intra-depth', safe['tu-intra-depth'], 1, 1 <= safe['tu-intra-depth'] <= 4, x265_params)
-        if 'tu-inter-depth' in safe: self.check_condition('tu-inter-depth', safe['tu-inter-depth'], 1, 1 <= safe['tu-inter-depth'] <= 4, x265_params)
-        if 'limit-tu' in safe: self.check_condition('limit-tu', safe['limit-tu'], 0, 0 <= safe['limit-tu'] <= 4, x265_params)
-        if 'nr-intra' in safe: self.check_condition('nr-intra', safe['nr-intra'], 0, 0 <= safe['nr-intra'] <= 2000, x265_params)
-        if 'nr-inter' in safe: self.check_condition('nr-inter', safe['nr-inter'], 0, 0 <= safe['nr-inter'] <= 2000, x265_params)
-        if 'rdpenalty' in safe: self.check_condition('rdpenalty', safe['rdpenalty'], 0, 0 <= safe['rdpenalty'] <= 2, x265_params)
-        if 'tskip' in safe: x265_params.append('tskip' if safe['tskip'] else 'no-tskip')
-        if 'max-tu-size' in safe: self.check_condition('max-tu-size', safe['max-tu-size'], 32, safe['max-tu-size'] in [4,8,16,32], x265_params)
-        if 'dynamic-rd' in safe: self.check_condition('dynamic-rd', safe['dynamic-rd'], 0, 0 <= safe['dynamic-rd'] <= 4, x265_params)
-        if 'ssim-rd' in safe: x265_params.append('ssim-rd' if safe['ssim-rd'] else 'no-ssim-rd')
-        if 'max-merge' in safe: self.check_condition('max-merge', safe['max-merge'], 2, 1 <= safe['max-merge'] <= 5, x265_params)
-        if 'me' in safe: self.check_condition('me', safe['me'], 1, 0 <= safe['me'] <= 5, x265_params)
-        if 'subme' in safe: self.check_condition('subme', safe['subme'], 2, 0 <= safe['subme'] <= 7, x265_params)
-        if 'merange' in safe: self.check_condition('merange', safe['merange'], 57, 0 <= safe['merange'] <= 32768, x265_params)
-        if 'temporal-mvp' in safe: x265_params.append('temporal-mvp' if safe['temporal-mvp'] else 'no-temporal-mvp')
-        if 'weightp' in safe: x265_params.append('weightp' if safe['weightp'] else 'no-weightp')
-        if 'weightb' in safe: x265_params.append('weightb' if safe['weightb'] else 'no-weightb')
-        if 'analyze-src-pics' in safe: x265_params.append('analyze-src-pics' if safe['analyze-src-pics'] else 'no-analyze-src-pics')
-        if 'strong-intra-smoothing' in safe: x265_params.append('strong-intra-smoothing' if safe['strong-intra-smoothing'] else 'no-strong-intra-smoothing')
-        if 'constrained-intra' in safe: x265_params.append('constrained-intra' if safe['constrained-intra'] else 'no-constrained-intra')
-        if 'psy-rd' in safe: self.check_condition('psy-rd', safe['psy-rd'], 2.0, 0.0 <= safe['psy-rd'] <= 5.0, x265_params)
-        if 'psy-rdoq' in safe: self.check_condition('psy-rdoq', safe['psy-rdoq'], 0.0, 0.0 <= safe['psy-rdoq'] <= 50.0, x265_params)
-        if 'open-gop' in safe: x265_params.append('open-gop' if safe['open-gop'] else 'no-open-gop')
-        if 'keyint' in safe: self.check_condition('keyint', safe['keyint'], 250, True, x265_params)
-        if 'min-keyint' in safe: self.check_condition('min-keyint', safe['min-keyint'], 0, 0 <= safe['min-keyint'], x265_params)
-        if 'scenecut' in safe: x265_params.append('scenecut' if safe['scenecut'] else 'no-scenecut')
-        if 'scenecut-bias' in safe: self.check_condition('scenecut-bias', safe['scenecut-bias'], 5.0, 0.0 <= safe['scenecut-bias'] <= 100.0, x265_params)
-        if 'intra-refresh' in safe:
-            if safe['intra-refresh']: x265_params.append('intra-refresh')
-        if 'rc-lookahead' in safe: self.check_condition('rc-lookahead', safe['rc-lookahead'], 20, 0 < safe['rc-lookahead'] <= 250, x265_params)
-        if 'lookahead-slices' in safe: self.check_condition('lookahead-slices', safe['lookahead-slices'], False, 0 <= safe['lookahead-slices'] <= 16, x265_params)
-        if 'lookahead-threads' in safe: self.check_condition('lookahead-threads', safe['lookahead-threads'], 0, True, x265_params)
-        if 'b-adapt' in safe: self.check_condition('b-adapt', safe['b-adapt'], 2, 0 <= safe['b-adapt'] <= 2, x265_params)
-        if 'bframes' in safe: self.check_condition('bframes', safe['bframes'], 4, 0 <= safe['bframes'] <= 16, x265_params)
-        if 'bframe-bias' in safe: self.check_condition('bframe-bias', safe['bframe-bias'], 0, -90 <= safe['bframe-bias'] <= 100, x265_params)
-        if 'b-pyramid' in safe: x265_params.append('b-pyramid' if safe['b-pyramid'] else 'no-b-pyramid')
-        if 'bitrate' in safe: self.check_condition('bitrate', safe['bitrate'], 0, 0 <= safe['bitrate'], x265_params)
-        if 'crf' in safe: self.check_condition('crf', safe['crf'], 28.0, 0.0 <= safe['crf'] <= 51.0, x265_params)
-        if 'crf-max' in safe: self.check_condition('crf-max', safe['crf-max'], False, 0 <= safe['crf-max'] <= 51.0, x265_params)
-        if 'crf-min' in safe: self.check_condition('crf-min', safe['crf-min'], False, 0 <= safe['crf-min'] <= 51.0, x265_params)
-        if 'vbv-bufsize' in safe: self.check_condition('vbv-bufsize', safe['vbv-bufsize'], 0, 0 <= safe['vbv-bufsize'], x265_params)
-        if 'vbv-maxrate' in safe: self.check_condition('vbv-maxrate', safe['vbv-maxrate'], 0, 0 <= safe['vbv-maxrate'], x265_params)
-        if 'vbv-init' in safe: self.check_condition('vbv-init', safe['vbv-init'], 0.9, 0.0 <= safe['vbv-init'] <= 1.0, x265_params)
-        if 'qp' in safe: self.check_condition('qp', safe['qp'], False, 0 <= safe['qp'] <= 51, x265_params)
-        if 'lossless' in safe: x265_params.append('lossless' if safe['lossless'] else 'no-lossless')
-        if 'aq-mode' in safe: self.check_condition('aq-mode', safe['aq-mode'], 1, 0 <= safe['aq-mode'] <= 3, x265_params)
-        if 'aq-strength' in safe: self.check_condition('aq-strength', safe['aq-strength'], 1.0, 0.0 <= safe['aq-strength'] <= 3.0, x265_params)
-        if 'aq-motion' in safe: x265_params.append('aq-motion' if safe['aq-motion'] else 'no-aq-motion')
-        if 'qg-size' in safe: self.check_condition('qg-size', safe['qg-size'], False, safe['qg-size'] in [8, 16, 32, 64], x265_params)
-        if 'cutree' in safe: x265_params.append('cutree' if safe['cutree'] else 'no-cutree')
-        if 'pass' in safe: self.check_condition('pass', safe['pass'], False, 0 <= safe['pass'] <= 3, x265_params)
-        if 'stats' in safe: self.check_condition('stats', safe['stats'], False, True, x265_params)
-        if 'slow-firstpass' in safe: x265_params.append('slow-firstpass' if safe['slow-firstpass'] else 'no-slow-firstpass')
-        if 'multi-pass-opt-analysis' in safe: x265_params.append('multi-pass-opt-analysis' if safe['multi-pass-opt-analysis'] else 'no-multi-pass-opt-analysis')
-        if 'multi-pass-opt-distortion' in safe: x265_params.append('multi-pass-opt-distortion' if safe['multi-pass-opt-distortion'] else 'no-multi-pass-opt-distortion')
-        if 'strict-cbr' in safe: x265_params.append('strict-cbr' if safe['strict-cbr'] else 'no-strict-cbr')
-        if 'cbqpoffs' in safe: self.check_condition('cbqpoffs', safe['cbqpoffs'], 0, -12 <= safe['cbqpoffs'] <= 12, x265_params)
-        if 'crqpoffs' in safe: self.check_condition('crqpoffs', safe['crqpoffs'], 0, -12 <= safe['crqpoffs'] <= 12, x265_params)
-        if 'qcomp' in safe: self.check_condition('qcomp', safe['qcomp'], 0.6, 0 <= safe['qcomp'] <= 1, x265_params)
-        if 'qpstep' in safe: self.check_condition('qpstep', safe['qpstep'], 4, 0 <= safe['qpstep'], x265_params)
-        if 'qpmin' in safe: self.check_condition('qpmin', safe['qpmin'], 0, 0 <= safe['qpmin'], x265_params)
-        if 'qpmax' in safe: self.check_condition('qpmax', safe['qpmax'], 69, 0 <= safe['qpmax'], x265_params)
-        if 'rc-grain' in safe: x265_params.append('rc-grain' if safe['rc-grain'] else 'no-rc-grain')
-        if 'qblur' in safe: self.check_condition('qblur', safe['qblur'], 0.5, 0 <= safe['qblur'], x265_params)
-        if 'cplxblur' in safe: self.check_condition('cplxblur', safe['cplxblur'], 20, 0 <= safe['cplxblur'], x265_params)
-        if 'signhide' in safe: x265_params.append('signhide' if safe['signhide'] else 'no-signhide')
-        if 'qpfile' in safe: self.check_condition('qpfile', safe['qpfile'], False, True, x265_params)
-        if 'scaling-list' in safe: self.check_condition('scaling-list', safe['scaling-list'], False, True, x265_params)
-        if 'lambda-file' in safe: self.check_condition('lambda-file', safe['lambda-file'], False, True, x265_params)
-        if 'sao' in safe: x265_params.append('sao' if safe['sao'] else 'no-sao')
-        if 'sao-non-deblock' in safe: x265_params.append('sao-non-deblock' if safe['sao-non-deblock'] else 'no-sao-non-deblock')
-        if 'sar' in safe: self.check_condition('sar', safe['sar'], False, 1 <= safe['sar'] <= 16, x265_params)
-        if 'display-window' in safe: self.check_condition('display-window', safe['display-window'], False, safe['display-window'] in ['left', 'top', 'right', 'bottom'], x265_params)
-        if 'overscan' in safe: self.check_condition('overscan', safe['overscan'], False, safe['overscan'] in ['show', 'crop'], x265_params)
-        if 'videoformat' in safe: self.check_condition('videoformat', safe['videoformat'], False, 0 <= safe['videoformat'] <= 5, x265_params)
-        if 'range' in safe: self.check_condition('range', safe['range'], False, safe['range'] in ['full', 'limited'], x265_params)
-        if 'colorprim' in safe: self.check_condition('colorprim', safe['colorprim'], False, 1 <= safe['colorprim'] <= 9, x265_params)
-        if 'transfer' in safe: self.check_condition('transfer', safe['transfer'], False, 1 <= safe['transfer'] <= 18, x265_params)
-        if 'colormatrix' in safe: self.check_condition('colormatrix', safe['colormatrix'], False, 0 <= safe['colormatrix'] <= 10, x265_params)
-        if 'chromaloc' in safe: self.check_condition('chromaloc', safe['chromaloc'], False, 0 <= safe['chromaloc'] <= 5, x265_params)
-        if 'hdr' in safe: x265_params.append('hdr' if safe['hdr'] else 'no-hdr')
-        if 'hdr-opt' in safe: x265_params.append('hdr-opt' if safe['hdr-opt'] else 'no-hdr-opt')
-        if 'min-luma' in safe: self.check_condition('min-luma', safe['min-luma'], False, 0 <= safe['min-luma'], x265_params)
-        if 'max-luma' in safe: self.check_condition('max-luma', safe['max-luma'], False, 0 <= safe['max-luma'], x265_params)
-        if 'annexb' in safe: x265_params.append('annexb' if safe['annexb'] else 'no-annexb')
-        if 'repeat-headers' in safe: x265_params.append('repeat-headers' if safe['repeat-headers'] else 'no-repeat-headers')
-        if 'aud' in safe: x265_params.append('aud' if safe['aud'] else 'no-aud')
-        if 'hrd' in safe: x265_params.append('hrd' if safe['hrd'] else 'no-hrd')
-        if 'info' in safe: x265_params.append('info' if safe['info'] else 'no-info')
-        if 'hash' in safe: self.check_condition('hash', safe['hash'], False, 1 <= safe['hash'] <= 3, x265_params)
-        if 'temporal-layers' in safe: x265_params('temporal-layers' if safe['temporal-layers'] else 'no-temporal-layers')
-        if 'log2-max-poc-lsb' in safe: self.check_condition('log2-max-poc-lsb', safe['log2-max-poc-lsb'], 8, 0 <= safe['log2-max-poc-lsb'], x265_params)
-        if 'vui-timing-info' in safe: x265_params.append('vui-timing-info' if safe['vui-timing-info'] else 'no-vui-timing-info')
-        if 'vui-hrd-info' in safe: x265_params.append('vui-hrd-info' if safe['vui-hrd-info'] else 'no-vui-hrd-info')
-        if 'opt-qp-pps' in safe: x265_params.append('opt-qp-pps' if safe['opt-qp-pps'] else 'no-opt-qp-pps')
-        if 'opt-ref-list-length-pps' in safe: x265_params.append('opt-ref-list-length-pps' if safe['opt-ref-list-length-pps'] else 'no-opt-ref-list-length-pps')
-        if 'multi-pass-opt-rps' in safe: x265_params.append('multi-pass-opt-rps' if safe['multi-pass-opt-rps'] else 'no-multi-pass-opt-rps')
-        if 'opt-cu-delta-qp' in safe: x265_params.append('opt-cu-delta-qp' if safe['opt-cu-delta-qp'] else 'no-opt-cu-delta-qp')
-        
-        if len(x265_params) > 0:
-            optlist.extend(['-x265-params', ':'.join(map(str,x265_params))])
-        
-        return optlist
+    encoder_options.update(schema.types())
+
+    def _codec_specific_parse_options(self, safe):
+        # x265 uses its own thread pools and ignores the ffmpeg threading:
+        # the threads go in the pools, slice threading is done with
+        # wavefront parallel processing in a single frame thread.
+        threads = safe.pop('threads', -1)
+        if threads > 0:
+            safe.setdefault('pools', str(threads))
+        if safe.pop('thread_type', None) == 'slice':
+            safe.setdefault('frame-threads', 1)
+            safe.setdefault('wpp', True)
+        return safe
+
+
 class H264Codec(VideoCodec):
     """
     H.264/AVC video codec.
@@ -1364,59 +1071,38 @@ class H264Codec(VideoCodec):
     """
     codec_name = 'h264'
     ffmpeg_codec_name = 'libx264'
-    encoder_options = VideoCodec.encoder_options.copy()
-    encoder_options.update({
-        'preset': str,  # common presets are ultrafast, superfast, veryfast,
-        # faster, fast, medium(default), slow, slower, veryslow
-        'quality': int,  # constant rate factor, range:0(lossless)-51(worst)
+    ssim_option = ('ssim', 1)
+    schema = Schema('libx264', [
+        # common presets are ultrafast, superfast, veryfast, faster, fast,
+        # medium(default), slow, slower, veryslow
+        ('preset', Option()),
+        # constant rate factor, range:0(lossless)-51(worst)
         # default:23, recommended: 18-28
+        ('quality', Option(int, flag='-crf')),
         # http://mewiki.project357.com/wiki/X264_Settings#profile
-        'profile': str,  # default: not-set, for valid values see above link
-        'tune': str,  # default: not-set, for valid values see above link
-        'level': str,  # The H.264 level that you want to use for the output video
-        'max_reference_frames': int,  # reference frames
-        'max_rate': str,
-        'max_frames_between_keyframes': int,
-        'qmin': int,
-        'qcomp': float,
-        'keyint_min': int,
-        'subq': int,
-        'b-pyramid': int,
-        'trellis': int,
-    })
-
-    def _codec_specific_produce_ffmpeg_list(self, safe):
-        optlist = []
-        if 'preset' in safe:
-            optlist.extend(['-preset', safe['preset']])
-        if 'quality' in safe:
-            optlist.extend(['-crf', str(safe['quality'])])
-        if 'profile' in safe:
-            optlist.extend(['-profile:v', safe['profile']])
-        if 'tune' in safe:
-            optlist.extend(['-tune', safe['tune']])
-        if 'level' in safe:
-            optlist.extend(['-level', safe['level']])
-        if 'max_reference_frames' in safe:
-            optlist.extend(['-refs', str(safe['max_reference_frames'])])
-        if 'max_rate' in safe:
-            optlist.extend(['-maxrate', str(safe['max_rate'])])
-        if 'max_frames_between_keyframes' in safe:
-            optlist.extend(['-g', str(safe['max_frames_between_keyframes'])])
-        if 'qmin' in safe:
-            optlist.extend(['-qmin', str(safe['qmin'])])
-        if 'qcomp' in safe:
-            optlist.extend(['-qcomp', str(safe['qcomp'])])
-        if 'keyint_min' in safe:
-            optlist.extend(['-keyint_min', str(safe['keyint_min'])])
-        if 'subq' in safe:
-            optlist.extend(['-subq', str(safe['subq'])])
-        if 'b-pyramid' in safe:
-            optlist.extend(['-b-pyramid', str(safe['b-pyramid'])])
-        if 'trellis' in safe:
-            optlist.extend(['-trellis', str(safe['trellis'])])
+        ('profile', Option(flag='-profile:v')),  # default: not-set, for valid values see above link
+        ('tune', Option()),  # default: not-set, for valid values see above link
+        ('level', Option()),  # The H.264 level that you want to use for the output video
+        ('max_reference_frames', Option(int, flag='-refs')),  # reference frames
+        ('max_rate', Option(flag='-maxrate')),
+        ('max_frames_between_keyframes', Option(int, flag='-g')),
+        ('qmin', Option(int)),
+        ('qcomp', Option(float)),
+        ('keyint_min', Option(int)),
+        ('subq', Option(int)),
+        ('b-pyramid', Option(int)),
+        ('trellis', Option(int)),
+        ('sliced-threads', Option(int, choices=[0, 1], param=True)),
+        ('ssim', Option(int, choices=[0, 1], param=True)),
+    ], params_flag='-x264-params')
+    encoder_options = VideoCodec.encoder_options.copy()
+    encoder_options.update(schema.types())
 
-        return optlist
+    def _codec_specific_parse_options(self, safe):
+        # x264 does slice threading itself, the ffmpeg -thread_type is ignored.
+        if safe.pop('thread_type', None) == 'slice':
+            safe.setdefault('sliced-threads', 1)
+        return safe
 
 
 class DivxCodec(VideoCodec):
@@ -1425,6 +1111,7 @@ class DivxCodec(VideoCodec):
     """
     codec_name = 'divx'
     ffmpeg_codec_name = 'mpeg4'
+    probe_codec_name = 'mpeg4'
 
 
 class Vp8Codec(VideoCodec):
@@ -1434,6 +1121,96 @@ class Vp8Codec(VideoCodec):
     codec_name = 'vp8'
     ffmpeg_codec_name = 'libvpx'
 
+    def _codec_specific_parse_options(self, safe):
+        # libvpx only does frame threading.
+        safe.pop('thread_type', None)
+        return safe
+
+
+class Vp9Codec(VideoCodec):
+    """
+    Google VP9 video codec, much faster than VP8 with row based
+    multithreading (row-mt) and tile columns.
+
+    With a quality (crf) and no bitrate, the encoding is in constant
+    quality mode. The speed is set by the deadline (good or realtime) and
+    cpu-used (higher is faster, 0-8 for good, up to 8 for realtime).
+    """
+    codec_name = 'vp9'
+    ffmpeg_codec_name = 'libvpx-vp9'
+    schema = Schema('libvpx-vp9', [
+        ('quality', Option(int, flag='-crf', min=0, max=63)),
+        ('deadline', Option(choices=['best', 'good', 'realtime'], default='good')),
+        ('cpu-used', Option(int, min=-8, max=8)),
+        ('row-mt', Option(bool)),
+        # log2 of the number of tile columns and rows
+        ('tile-columns', Option(int, min=0, max=6)),
+        ('tile-rows', Option(int, min=0, max=2)),
+        ('frame-parallel', Option(bool)),
+        ('lag-in-frames', Option(int, min=0, max=25)),
+        ('max_frames_between_keyframes', Option(int, flag='-g')),
+    ])
+    encoder_options = VideoCodec.encoder_options.copy()
+    encoder_options.update(schema.types())
+
+    def _codec_specific_parse_options(self, safe):
+        # libvpx threads encode tile columns (at least 256 pixels wide)
+        # and, with row-mt, the rows of the tiles.
+        safe.pop('thread_type', None)
+        threads = safe.get('threads', 0)
+        if threads > 1:
+            safe.setdefault('row-mt', True)
+            if 'tile-columns' not in safe:
+                columns = 0
+                width = safe.get('max_width') or safe.get('src_width')
+                while 2 ** (columns + 1) <= threads and columns < 6 and \
+                        (not width or width >= 256 * 2 ** (columns + 1)):
+                    columns += 1
+                safe['tile-columns'] = columns
+        return safe
+
+    def _codec_specific_produce_ffmpeg_list(self, safe):
+        optlist = self.schema.emit(safe)
+        if 'quality' in safe and 'bitrate' not in safe:
+            optlist.extend(['-b:v', '0'])
+        return optlist
+
+
+class Av1SvtCodec(VideoCodec):
+    """
+    AV1 video codec, SVT-AV1 encoder. It scales well on many cores and
+    has a good compression per CPU time at its faster presets.
+
+    The preset goes from 0 (slowest, best) to 13 (fastest), the quality
+    (crf) from 1 to 63. Tiles, logical processors (lp), film grain
+    synthesis, tune and fast-decode are SVT-AV1 parameters.
+    """
+    codec_name = 'av1'
+    ffmpeg_codec_name = 'libsvtav1'
+    schema = Schema('libsvtav1', [
+        ('preset', Option(int, min=0, max=13, default=8)),
+        ('quality', Option(int, flag='-crf', min=1, max=63)),
+        ('max_frames_between_keyframes', Option(int, flag='-g')),
+        # 0 visual quality, 1 psnr, 2 ssim
+        ('tune', Option(int, choices=[0, 1, 2], param=True)),
+        ('lp', Option(int, min=0, param=True)),
+        # log2 of the number of tile columns and rows
+        ('tile-columns', Option(int, min=0, max=4, param=True)),
+        ('tile-rows', Option(int, min=0, max=6, param=True)),
+        ('film-grain', Option(int, min=0, max=50, param=True)),
+        ('fast-decode', Option(int, choices=[0, 1, 2], param=True)),
+    ], params_flag='-svtav1-params')
+    encoder_options = VideoCodec.encoder_options.copy()
+    encoder_options.update(schema.types())
+
+    def _codec_specific_parse_options(self, safe):
+        # SVT-AV1 has its own thread pool, sized by the logical processors.
+        threads = safe.pop('threads', -1)
+        if threads > 0:
+            safe.setdefault('lp', threads)
+        safe.pop('thread_type', None)
+        return safe
+
 
 class H263Codec(VideoCodec):
     """
@@ -1449,6 +1226,7 @@ class FlvCodec(VideoCodec):
     """
     codec_name = 'flv'
     ffmpeg_codec_name = 'flv'
+    probe_codec_name = 'flv1'
 
 
 class Ffv1Codec(VideoCodec):
@@ -1457,41 +1235,32 @@ class Ffv1Codec(VideoCodec):
     """
     codec_name = 'ffv1'
     ffmpeg_codec_name = 'ffv1'
+    schema = Schema('ffv1', [
+        ('level', Option(int)),  # 1, 3. Select which FFV1 version to use.
+        ('coder', Option(int)),  # 0=Golomb-Rice, 1=Range Coder,
+                                 # 2=Range Coder(with custom state transition table)
+        ('context', Option(int)),  # 0=small, 1=large
+        ('g', Option(int)),  # GOP size, >= 1. For archival use, GOP-size should be "1".
+        ('slices', Option(int)),  # 4, 6, 9, 12, 16, 24, 30.
+                                  # Each frame is split into this number of slices.
+                                  # This affects multithreading performance, as well as filesize:
+                                  # Increasing the number of slices might speed up
+                                  # performance, but also increases the filesize.
+        ('slicecrc', Option(int)),  # Error correction/detection, 0=off, 1=on.
+                                    # Enabling this option adds CRC information to each slice.
+                                    # This makes it possible for a decoder to detect
+                                    # errors in the bitstream, rather than blindly
+                                    # decoding a broken slice.
+    ])
     encoder_options = VideoCodec.encoder_options.copy()
-    encoder_options.update({
-        'level': int,  # 1, 3. Select which FFV1 version to use.
-        'coder': int,  # 0=Golomb-Rice, 1=Range Coder,
-                       # 2=Range Coder(with custom state transition table)
-        'context': int,  # 0=small, 1=large
-        'g': int,  # GOP size, >= 1. For archival use, GOP-size should be "1".
-        'slices': int,  # 4, 6, 9, 12, 16, 24, 30.
-                        # Each frame is split into this number of slices.
-                        # This affects multithreading performance, as well as filesize:
-                        # Increasing the number of slices might speed up
-                        # performance, but also increases the filesize.
-        'slicecrc': int,  # Error correction/detection, 0=off, 1=on.
-                          # Enabling this option adds CRC information to each slice.
-                          # This makes it possible for a decoder to detect
-                          # errors in the bitstream, rather than blindly
-                          # decoding a broken slice.
-    })
+    encoder_options.update(schema.types())
 
-    def _codec_specific_produce_ffmpeg_list(self, safe):
-        optlist = []
-        if 'level' in safe:
-            optlist.extend(['-level', str(safe['level'])])
-        if 'coder' in safe:
-            optlist.extend(['-coder', str(safe['coder'])])
-        if 'context' in safe:
-            optlist.extend(['-context', str(safe['context'])])
-        if 'g' in safe:
-            optlist.extend(['-g', str(safe['g'])])
-        if 'slices' in safe:
-            optlist.extend(['-slices', str(safe['slices'])])
-        if 'slicecrc' in safe:
-            optlist.extend(['-slicecrc', str(safe['slicecrc'])])
-
-        return optlist
+    def _codec_specific_parse_options(self, safe):
+        # FFV1 threads encode slices, at least one slice per thread.
+        threads = safe.get('threads', 0)
+        if threads > 1 and 'slices' not in safe:
+            safe['slices'] = min([n for n in (4, 6, 9, 12, 16, 24, 30) if n >= threads] or [30])
+        return safe
 
 
 class MpegCodec(VideoCodec):
@@ -1509,7 +1278,7 @@ class MpegCodec(VideoCodec):
 
         if w and h:
             filters = safe['aspect_filters']
-            tmp = 'aspect=%d:%d' % (w, h)
+            tmp = 'setdar=%d/%d' % (w, h)
 
             if filters is None:
                 safe['aspect_filters'] = tmp
@@ -1525,6 +1294,7 @@ class Mpeg1Codec(MpegCodec):
     """
     codec_name = 'mpeg1'
     ffmpeg_codec_name = 'mpeg1video'
+    probe_codec_name = 'mpeg1video'
 
 
 class Mpeg2Codec(MpegCodec):
@@ -1533,6 +1303,7 @@ class Mpeg2Codec(MpegCodec):
     """
     codec_name = 'mpeg2'
     ffmpeg_codec_name = 'mpeg2video'
+    probe_codec_name = 'mpeg2video'
 
 
 # Subtitle Codecs
@@ -1647,7 +1418,7 @@ class Vp9CuvidCodec(DecoderCodec):
         
 audio_codec_list = [
     AudioNullCodec, AudioCopyCodec, VorbisCodec, AacCodec, Mp3Codec, Mp2Codec,
-    FdkAacCodec, Ac3Codec, DtsCodec, FlacCodec
+    FdkAacCodec, Ac3Codec, DtsCodec, FlacCodec, OpusCodec
 ]
 
 decoder_codec_list = [
@@ -1660,7 +1431,7 @@ video_codec_list = [
     VideoNullCodec, VideoCopyCodec, TheoraCodec, H264Codec,
     DivxCodec, Vp8Codec, H263Codec, FlvCodec, Ffv1Codec, Mpeg1Codec,
     Mpeg2Codec, HEVCNvencCodec, H264NvencCodec, HEVCCodec, H264VaapiCodec,
-    HevcVaapiCodec
+    HevcVaapiCodec, Vp9Codec, Av1SvtCodec
 ]
 
 subtitle_codec_list = [
@@ -0,0 +1,338 @@
+#!/usr/bin/env python
+
+import glob
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: plain copies
+    fcntl = None
+
+# ioctl cloning the data blocks of a file (reflink) on Linux
+FICLONE = 0x40049409
+
+
+def fingerprint(fname, blocks=16, block_size=64 * 1024):
+    """
+    Fast content fingerprint of a file: hash of its size and of a few
+    blocks sampled evenly over the file (including the first and the last
+    ones), so large media files don't need to be read completely.
+    """
+    size = os.path.getsize(fname)
+    digest = hashlib.sha1(str(size).encode('ascii'))
+    with open(fname, 'rb') as f:
+        if size <= blocks * block_size:
+            digest.update(f.read())
+        else:
+            step = (size - block_size) // (blocks - 1)
+            for idx in range(blocks):
+                f.seek(idx * step)
+                digest.update(f.read(block_size))
+    return digest.hexdigest()
+
+
+class PassLogCache(object):
+    """
+    Two-pass encoding statistics files (ffmpeg -passlogfile) of the first
+    passes, kept for reuse by later encodes of the same source.
+
+    Entries are keyed by the source file identity (path, size and
+    modification time) and by the first pass options, except the rate
+    control targets (bitrate, max rate and buffer size) which don't prevent
+    the reuse of the statistics. The least recently used entries and their
+    files are removed when there are more than max_entries entries.
+
+    The prefixes returned by get() and add() are in use until given back to
+    release(): the files of an entry evicted meanwhile are only removed by
+    the last release().
+    """
+    RATE_OPTIONS = ('-vb', '-b:v', '-maxrate', '-bufsize')
+
+    def __init__(self, directory=None, max_entries=32):
+        if directory is None:
+            directory = os.path.join(tempfile.gettempdir(), 'converter-passlog')
+        self.directory = directory
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        # number of users of each prefix in use
+        self.users = {}
+        self.lock = threading.Lock()
+
+    def key(self, infile, optlist):
+        """
+        Return the cache key of the first pass of infile with optlist, or
+        None if infile is not a local file.
+        """
+        try:
+            st = os.stat(infile)
+        except OSError:
+            return None
+
+        opts = []
+        idx = 0
+        while idx < len(optlist):
+            if optlist[idx] in self.RATE_OPTIONS:
+                idx += 2
+                continue
+            opts.append(optlist[idx])
+            idx += 1
+        return (os.path.abspath(infile), st.st_size, st.st_mtime, tuple(opts))
+
+    def new_prefix(self):
+        """
+        Return a new unique passlog files prefix.
+        """
+        if not os.path.isdir(self.directory):
+            try:
+                os.makedirs(self.directory)
+            except OSError:
+                if not os.path.isdir(self.directory):
+                    raise
+        fd, path = tempfile.mkstemp(prefix='passlog-', dir=self.directory)
+        os.close(fd)
+        return path
+
+    def get(self, key):
+        """
+        Return the passlog files prefix cached for key, in use until
+        released, or None.
+        """
+        with self.lock:
+            prefix = self.entries.get(key)
+            if prefix is None:
+                return None
+            if not glob.glob(prefix + '-*.log'):
+                del self.entries[key]
+                return None
+            # Mark as recently used.
+            del self.entries[key]
+            self.entries[key] = prefix
+            self.users[prefix] = self.users.get(prefix, 0) + 1
+            return prefix
+
+    def add(self, key, prefix):
+        """
+        Cache the passlog files prefix for key, in use until released.
+        """
+        with self.lock:
+            self.users[prefix] = self.users.get(prefix, 0) + 1
+            old = self.entries.pop(key, None)
+            self.entries[key] = prefix
+            evicted = []
+            while len(self.entries) > self.max_entries:
+                evicted.append(self.entries.popitem(last=False)[1])
+            if old is not None and old != prefix:
+                evicted.append(old)
+            # The files in use are removed by their last release().
+            evicted = [p for p in evicted if p not in self.users]
+        for prefix in evicted:
+            self.remove_files(prefix)
+
+    def release(self, prefix):
+        """
+        Give back a prefix returned by get() or add(), removing its files if
+        it is no longer cached nor in use.
+        """
+        with self.lock:
+            self.users[prefix] -= 1
+            if self.users[prefix]:
+                return
+            del self.users[prefix]
+            if prefix in self.entries.values():
+                return
+        self.remove_files(prefix)
+
+    @staticmethod
+    def remove_files(prefix):
+        for path in glob.glob(prefix + '*'):
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+
+
+class LoudnessCache(object):
+    """
+    Loudness measurements (see FFMpeg.loudness()) of the audio streams of
+    the sources, keyed by the fingerprint of the source file and the index
+    of the stream, so all the outputs of a source share one measurement.
+    The least recently used entries are dropped when there are more than
+    max_entries entries.
+    """
+
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def key(infile, stream=None):
+        """
+        Return the cache key of the audio stream of infile, or None if
+        infile is not a local file (an URL, a device...).
+        """
+        if not os.path.isfile(infile):
+            return None
+        return fingerprint(infile), stream
+
+    def get(self, key):
+        """
+        Return a copy of the measurement cached for key, or None.
+        """
+        with self.lock:
+            measurement = self.entries.pop(key, None)
+            if measurement is None:
+                return None
+            self.entries[key] = measurement
+            return dict(measurement)
+
+    def add(self, key, measurement):
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = dict(measurement)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+
+class ResultCache(object):
+    """
+    Cache of conversion results, keyed by the fingerprint of the source
+    file and the ffmpeg option list of the conversion, so identical
+    requests get the existing output instead of being encoded again.
+
+    Outputs are stored in directory and given back as copies, sharing the
+    data blocks (reflinks) where the file system supports it: the cache
+    never shares a file with the callers, which may rewrite theirs. The least
+    recently used entries are evicted when the cache is larger than
+    max_bytes. Hits, misses and the bytes of the outputs given back from
+    the cache are counted in stats().
+    """
+
+    def __init__(self, directory=None, max_bytes=10 * 1024 ** 3):
+        if directory is None:
+            directory = os.path.join(tempfile.gettempdir(), 'converter-results')
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+        self.lock = threading.Lock()
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        # Reload the entries of a previous process, oldest first.
+        files = []
+        for name in os.listdir(directory):
+            path = os.path.join(directory, name)
+            if os.path.isfile(path) and not name.startswith('.'):
+                st = os.stat(path)
+                files.append((st.st_mtime, name, st.st_size))
+        for _, name, size in sorted(files):
+            self.entries[name] = size
+            self.total_bytes += size
+
+    @staticmethod
+    def key(infile, optlist, extension=''):
+        """
+        Return the cache key of the conversion of infile with optlist.
+        """
+        digest = hashlib.sha1(fingerprint(infile).encode('ascii'))
+        digest.update(json.dumps(list(optlist)).encode('utf-8'))
+        return digest.hexdigest() + extension
+
+    def get(self, key, outfile):
+        """
+        Put the cached output for key at outfile. Returns False if there
+        is no such output.
+        """
+        path = os.path.join(self.directory, key)
+        with self.lock:
+            if key not in self.entries or not os.path.exists(path):
+                self.misses += 1
+                return False
+            size = self.entries.pop(key)
+            self.entries[key] = size
+            self.hits += 1
+            self.bytes_saved += size
+            try:
+                # Keep the recently used order for the next processes.
+                os.utime(path, None)
+            except OSError:
+                pass
+
+        self._copy(path, outfile)
+        return True
+
+    def add(self, key, outfile):
+        """
+        Store the conversion output outfile for key.
+        """
+        path = os.path.join(self.directory, key)
+        self._copy(outfile, path)
+        size = os.path.getsize(path)
+
+        evicted = []
+        with self.lock:
+            self.total_bytes -= self.entries.pop(key, 0)
+            self.entries[key] = size
+            self.total_bytes += size
+            while self.total_bytes > self.max_bytes and len(self.entries) > 1:
+                old_key, old_size = self.entries.popitem(last=False)
+                self.total_bytes -= old_size
+                evicted.append(old_key)
+
+        for old_key in evicted:
+            try:
+                os.unlink(os.path.join(self.directory, old_key))
+            except OSError:
+                pass
+
+    def stats(self):
+        """
+        Return the cache statistics: number of entries, total size, hits,
+        misses, hit rate and bytes given back from the cache.
+        """
+        with self.lock:
+            requests = self.hits + self.misses
+            return {
+                'entries': len(self.entries),
+                'bytes': self.total_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': float(self.hits) / requests if requests else 0.0,
+                'bytes_saved': self.bytes_saved,
+            }
+
+    @staticmethod
+    def _copy(src, dst):
+        """
+        Copy src to a new file replacing dst, cloning its data blocks where
+        the file system supports it (Linux FICLONE ioctl).
+        """
+        directory, name = os.path.split(dst)
+        tmp_path = os.path.join(directory, '.{0}.{1}.{2}'.format(name, os.getpid(),
+                                                                 threading.current_thread().ident))
+        try:
+            with open(src, 'rb') as fsrc:
+                with open(tmp_path, 'wb') as fdst:
+                    try:
+                        if fcntl is None:
+                            raise OSError('no reflink')
+                        fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+                    except (IOError, OSError):
+                        shutil.copyfileobj(fsrc, fdst)
+            os.rename(tmp_path, dst)
+        except:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
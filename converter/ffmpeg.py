@@ -1,17 +1,22 @@
 #!/usr/bin/env python
 
+import array
+import math
 import os.path
 import os
 import re
 import signal
-from urllib3.util import parse_url
 from subprocess import Popen, PIPE
 import logging
 import datetime
 import locale
 import json
+import tempfile
+import threading
 import time
 import types
+
+from converter.tuning import run_parallel, sample_windows
 try:
     unicode = unicode
 except NameError:
@@ -36,6 +41,20 @@ class FFMpegError(Exception):
     pass
 
 
+# Process-wide caches of the binaries found in $PATH, and of the version
+# and capabilities of each binary with its modification time.
+_binary_lock = threading.Lock()
+_binary_paths = {}
+_binary_info = {}
+
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
+
+
 class SeekError(FFMpegError):
     pass
 
@@ -84,8 +103,18 @@ class FFMpeg(object):
     """
     DEFAULT_JPEG_QUALITY = 4
     AUDIO_PEAK_MAX = -1  # dBTP
+    # codecs (as in probe()) whose decoder can decode at a lower resolution
+    LOWRES_CODECS = ('mpeg1video', 'mpeg2video', 'mpeg4', 'h263', 'mjpeg', 'jpeg2000')
     AUDIO_LOUDNESS_TARGET = -16  # LUFS
     DVD_CONCAT_FILE = '/tmp/dvd_concat.txt'
+    PIPE_CHUNK_SIZE = 64 * 1024
+    # ffmpeg output read at once and kept in memory, when it is parsed
+    PARSER_CHUNK_SIZE = 64 * 1024
+    OUTPUT_TAIL = 16 * 1024
+    # black frames and silences of at least 2 s, see inspect()
+    BLACK_FILTER = 'blackdetect=d=2:pix_th=0.10'
+    SILENCE_FILTER = 'silencedetect=n=-60dB:d=2'
+    _shared = {}
 
     def __init__(self, ffmpeg_path=None, ffprobe_path=None, dvd2concat_path=None):
         """
@@ -94,14 +123,7 @@ class FFMpeg(object):
         """
 
         self.current_process = None
-
-        def which(name):
-            path = os.environ.get('PATH', os.defpath)
-            for d in path.split(':'):
-                fpath = os.path.join(d, name)
-                if os.path.exists(fpath) and os.access(fpath, os.X_OK):
-                    return fpath
-            return None
+        which = self.which
 
         if ffmpeg_path is None:
             ffmpeg_path = 'ffmpeg'
@@ -129,6 +151,102 @@ class FFMpeg(object):
         if not os.path.exists(self.ffprobe_path):
             raise FFMpegError("ffprobe binary not found: " + self.ffprobe_path)
 
+    @classmethod
+    def shared(cls, ffmpeg_path=None, ffprobe_path=None):
+        """
+        Return a FFMpeg object shared by all the callers asking for the same
+        binaries. It is replaced by a new one when a binary changed (new
+        modification time). FFMpeg objects keep no state between calls, so
+        the shared object can be used from several threads.
+        """
+        key = (cls, ffmpeg_path, ffprobe_path, os.environ.get('PATH', os.defpath))
+        with _binary_lock:
+            ffmpeg, mtimes = cls._shared.get(key, (None, None))
+        if ffmpeg is not None and mtimes == (_mtime(ffmpeg.ffmpeg_path), _mtime(ffmpeg.ffprobe_path)):
+            return ffmpeg
+
+        ffmpeg = cls(ffmpeg_path=ffmpeg_path, ffprobe_path=ffprobe_path)
+        with _binary_lock:
+            cls._shared[key] = (ffmpeg, (_mtime(ffmpeg.ffmpeg_path), _mtime(ffmpeg.ffprobe_path)))
+        return ffmpeg
+
+    @staticmethod
+    def which(name):
+        """
+        Return the path of the executable name found in $PATH, or None.
+        Found paths are cached for the process, as long as they remain
+        executable.
+        """
+        path = os.environ.get('PATH', os.defpath)
+        key = (name, path)
+        with _binary_lock:
+            fpath = _binary_paths.get(key)
+        if fpath and os.access(fpath, os.X_OK):
+            return fpath
+
+        for d in path.split(':'):
+            fpath = os.path.join(d, name)
+            if os.path.exists(fpath) and os.access(fpath, os.X_OK):
+                with _binary_lock:
+                    _binary_paths[key] = fpath
+                return fpath
+        return None
+
+    def _binary_info(self, name, fn):
+        """
+        Return the information name about the ffmpeg binary, computed by fn
+        once per binary version (modification time).
+        """
+        mtime = _mtime(self.ffmpeg_path)
+        with _binary_lock:
+            cached_mtime, info = _binary_info.get(self.ffmpeg_path, (None, {}))
+            if cached_mtime != mtime:
+                info = {}
+                _binary_info[self.ffmpeg_path] = (mtime, info)
+            if name in info:
+                return info[name]
+        value = info[name] = fn()
+        return value
+
+    def version(self):
+        """
+        Return the version of the ffmpeg binary (like '6.1.1'), or None if it
+        can't be found.
+
+        >>> FFMpeg().version()
+        '6.1.1'
+        """
+        def get_version():
+            p = self._spawn([self.ffmpeg_path, '-version'])
+            stdout_data, _ = p.communicate()
+            words = stdout_data.decode(console_encoding, 'ignore').split()
+            if len(words) > 2 and words[1] == 'version':
+                return words[2]
+            return None
+        return self._binary_info('version', get_version)
+
+    def encoders(self):
+        """
+        Return the set of the encoders supported by the ffmpeg binary.
+
+        >>> 'libx264' in FFMpeg().encoders()
+        True
+        """
+        def get_encoders():
+            p = self._spawn([self.ffmpeg_path, '-hide_banner', '-encoders'])
+            stdout_data, _ = p.communicate()
+            encoders = set()
+            listed = False
+            # The encoders are listed after the legend, ended by ' ------'.
+            for line in stdout_data.decode(console_encoding, 'ignore').splitlines():
+                fields = line.split()
+                if listed and len(fields) > 1:
+                    encoders.add(fields[1])
+                elif fields == ['------']:
+                    listed = True
+            return frozenset(encoders)
+        return self._binary_info('encoders', get_encoders)
+
     @staticmethod
     def _spawn(cmds, stdin=PIPE):
         logger.debug('Spawning ffmpeg with command: ' + ' '.join(cmds))
@@ -191,6 +309,9 @@ class FFMpeg(object):
         except UnicodeDecodeError:
             pass
 
+        # Imported here, only a few callers need it and it is slow to import.
+        from urllib3.util import parse_url
+
         # Support for unicode domain names and paths.
         scheme, auth, host, port, path, query, fragment = parse_url(url)
 
@@ -406,7 +527,7 @@ class FFMpeg(object):
 
         return info
 
-    def convert(self, infile, outfile, opts, timeout=10, nice=None, get_output=False, title=None):
+    def convert(self, infile, outfile, opts, timeout=10, nice=None, get_output=False, title=None, parser=None):
         """
         Convert the source media (infile) according to specified options
         (a list of ffmpeg switches as strings) and save it to outfile.
@@ -421,38 +542,47 @@ class FFMpeg(object):
         the documentation in Converter.convert() for more details about this
         option.
 
+        The source may also be a file-like object or an iterator of bytes,
+        fed to ffmpeg through its standard input, and the output a writable
+        file-like object receiving what ffmpeg writes on its standard
+        output. The output format must then be given in opts and allow
+        non-seekable output (ie. matroska, mpegts, or mp4/mov which are
+        then fragmented).
+
+        The optional parser (ie. an AnalysisParser) is given each line of
+        the ffmpeg output as it arrives, and only the end of the output is
+        kept in memory.
+
         >>> conv = FFMpeg().convert('test.ogg', '/tmp/output.mp3',
         ...    ['-acodec libmp3lame', '-vn'])
         >>> for timecode in conv:
         ...    pass # can be used to inform the user about conversion progress
 
+        >>> with open('/tmp/output.mkv', 'wb') as sink:
+        ...    for timecode in FFMpeg().convert(open('test1.ogg', 'rb'), sink,
+        ...                                     ['-c', 'copy', '-f', 'matroska']):
+        ...        pass
         """
-        if not os.path.exists(infile) and not self.is_url(infile):
+        source = sink = None
+        if self.is_stream(infile):
+            source, infile = infile, 'pipe:0'
+        elif not os.path.exists(infile) and not self.is_url(infile):
             raise FFMpegError("Input file doesn't exist: " + infile)
 
+        if hasattr(outfile, 'write'):
+            sink, outfile = outfile, 'pipe:1'
+            opts = self._pipe_output_options(opts)
+
         # infile = self._dvd2concat(infile)
 
         cmds = [self.ffmpeg_path, '-hide_banner']
 
-        if '-decoder' in opts:
-            idx = opts.index('-decoder')
-            cmds.append(opts.pop(idx).replace('decoder','c:v'))
-            cmds.append(opts.pop(idx))
-        
         if 'hevc_vaapi' in opts or 'h264_vaapi' in opts:
             cmds.extend(['-vaapi_device', '/dev/dri/renderD128'])
         
         if infile == self.DVD_CONCAT_FILE:
             cmds.extend(['-f', 'concat', '-safe', '0'])
-        # Add duration and position flag before input when we can.
-        if '-t' in opts:
-            idx = opts.index('-t')
-            cmds.append(opts.pop(idx))
-            cmds.append(opts.pop(idx))
-        if '-ss' in opts and ('-t' in opts or '-to' not in opts):
-            idx = opts.index('-ss')
-            cmds.append(opts.pop(idx))
-            cmds.append(opts.pop(idx))
+        cmds.extend(self._input_options(opts))
 
         ext = os.path.splitext(infile)[1].upper()
         if get_output and (ext == '.ISO'
@@ -463,9 +593,299 @@ class FFMpeg(object):
         cmds.extend(opts)
         cmds.extend(['-y', outfile])
 
-        return self._run_ffmpeg(infile, cmds, timeout=timeout, nice=nice, get_output=get_output, title=title)
+        return self._run_ffmpeg(infile, cmds, timeout=timeout, nice=nice, get_output=get_output, title=title,
+                                source=source, sink=sink, parser=parser)
+
+    @staticmethod
+    def is_stream(obj):
+        """
+        Check if obj is a file-like object or an iterator of bytes rather
+        than a file name or an URL.
+        """
+        return hasattr(obj, 'read') or (not isinstance(obj, basestring) and hasattr(obj, '__iter__'))
+
+    @staticmethod
+    def _pipe_output_options(opts):
+        """
+        Return opts adapted to a non-seekable output.
+        """
+        if '-f' not in opts:
+            raise FFMpegError('Output format needed to write to a stream')
+        fmt = opts[opts.index('-f') + 1]
+        opts = list(opts)
+        if fmt in ('mp4', 'mov', 'ipod', 'ismv'):
+            # Fragmented mp4 doesn't need to seek back to write the index.
+            flags = 'frag_keyframe+empty_moov+default_base_moof'
+            if '-movflags' in opts:
+                opts[opts.index('-movflags') + 1] = flags
+            else:
+                opts[:0] = ['-movflags', flags]
+        return opts
+
+    @staticmethod
+    def _start_pump(chunks, dest, close=False):
+        """
+        Copy chunks to the dest file in a thread. Writes to a full pipe
+        block, so the copy goes at the pace of the reader.
+        """
+        def pump():
+            try:
+                for chunk in chunks:
+                    dest.write(chunk)
+            except (IOError, OSError, ValueError):
+                # ffmpeg exited or stopped reading, _run_ffmpeg reports
+                # the error if any.
+                pass
+            finally:
+                if close:
+                    try:
+                        dest.close()
+                    except (IOError, OSError, ValueError):
+                        pass
+
+        thread = threading.Thread(target=pump)
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def convert_multi(self, infile, outputs, filter_complex=None, timeout=10, nice=None, get_output=False, title=None,
+                      parser=None):
+        """
+        Convert the source media (infile) to several outputs with a single
+        ffmpeg process, so the source is read and decoded only once.
+
+        outputs is a list of (outfile, opts) tuples, opts being a list of
+        ffmpeg switches like for convert(). The input side options (decoder,
+        start, duration and end) are taken from the first output and dropped
+        from the others. The optional filter_complex is a filter graph whose
+        labeled outputs are mapped by the output options. The optional
+        parser is given each line of the ffmpeg output, see convert().
+
+        Like convert(), it returns a generator that needs to be iterated to
+        drive the conversion process.
+
+        >>> conv = FFMpeg().convert_multi('test.ogg', [
+        ...    ('/tmp/output.mp3', ['-acodec', 'libmp3lame', '-vn']),
+        ...    ('/tmp/output.ogg', ['-acodec', 'libvorbis', '-vn'])])
+        >>> for timecode in conv:
+        ...    pass
+        """
+        if not os.path.exists(infile) and not self.is_url(infile):
+            raise FFMpegError("Input file doesn't exist: " + infile)
+
+        if not outputs:
+            raise FFMpegError('No output requested')
+
+        outputs = [(outfile, list(opts)) for outfile, opts in outputs]
+
+        cmds = [self.ffmpeg_path, '-hide_banner', '-y']
+
+        for _, opts in outputs:
+            if 'hevc_vaapi' in opts or 'h264_vaapi' in opts:
+                cmds.extend(['-vaapi_device', '/dev/dri/renderD128'])
+                break
 
-    def _run_ffmpeg(self, infile, cmds, timeout=10, nice=None, get_output=False, title=None):
+        if infile == self.DVD_CONCAT_FILE:
+            cmds.extend(['-f', 'concat', '-safe', '0'])
+        cmds.extend(self._input_options(outputs[0][1]))
+        # An end position (left with the start one) trims the shared input too.
+        cmds.extend(self._trim_options(outputs[0][1]))
+        for _, opts in outputs[1:]:
+            # Every output shares the same input, drop the duplicates.
+            self._input_options(opts)
+            self._trim_options(opts)
+
+        cmds.extend(['-i', infile])
+        if filter_complex:
+            cmds.extend(['-filter_complex', filter_complex])
+
+        for outfile, opts in outputs:
+            cmds.extend(opts)
+            cmds.append(outfile)
+
+        return self._run_ffmpeg(infile, cmds, timeout=timeout, nice=nice, get_output=get_output, title=title,
+                                parser=parser)
+
+    @staticmethod
+    def _input_options(opts):
+        """
+        Remove the options which have to be placed before the input (decoder
+        and its threads and frame skipping, duration and position) from opts
+        and return them.
+        """
+        input_opts = []
+        if '-decoder' in opts:
+            idx = opts.index('-decoder')
+            input_opts.append(opts.pop(idx).replace('decoder','c:v'))
+            input_opts.append(opts.pop(idx))
+        if '-decoder_threads' in opts:
+            idx = opts.index('-decoder_threads')
+            opts.pop(idx)
+            input_opts.extend(['-threads', opts.pop(idx)])
+        for flag in ('-skip_frame', '-lowres'):
+            if flag in opts:
+                idx = opts.index(flag)
+                input_opts.append(opts.pop(idx))
+                input_opts.append(opts.pop(idx))
+
+        # Add duration and position flag before input when we can.
+        if '-t' in opts:
+            idx = opts.index('-t')
+            input_opts.append(opts.pop(idx))
+            input_opts.append(opts.pop(idx))
+        if '-ss' in opts and ('-t' in opts or '-to' not in opts):
+            idx = opts.index('-ss')
+            input_opts.append(opts.pop(idx))
+            input_opts.append(opts.pop(idx))
+        return input_opts
+
+    @staticmethod
+    def _trim_options(opts):
+        """
+        Remove the start, duration and end options from opts and return
+        them.
+        """
+        trim_opts = []
+        for flag in ('-ss', '-t', '-to'):
+            while flag in opts:
+                idx = opts.index(flag)
+                trim_opts.append(opts.pop(idx))
+                trim_opts.append(opts.pop(idx))
+        return trim_opts
+
+    def concat(self, parts, outfile, opts, inputs=None, timeout=10, nice=None):
+        """
+        Join media files (parts) with the concat demuxer and save the
+        result to outfile. The parts must have the same streams and codec
+        parameters; use ['-c', 'copy'] in opts to join them without
+        re-encoding.
+
+        The optional inputs is a list of ffmpeg switches adding other inputs
+        after the concatenated one, ie. ['-i', 'audio.wav'], to be mapped
+        in opts.
+
+        Like convert(), it returns a generator that needs to be iterated to
+        drive the process.
+
+        >>> conv = FFMpeg().concat(['/tmp/part1.ts', '/tmp/part2.ts'],
+        ...    '/tmp/output.mp4', ['-c', 'copy', '-f', 'mp4'])
+        >>> for timecode in conv:
+        ...    pass
+        """
+        for part in parts:
+            if not os.path.exists(part):
+                raise FFMpegError("Input file doesn't exist: " + part)
+
+        fd, listfile = tempfile.mkstemp(suffix='.txt', prefix='concat-')
+        with os.fdopen(fd, 'w') as concat_file:
+            concat_file.write('ffconcat version 1.0\n')
+            for part in parts:
+                concat_file.write("file '{0}'\n".format(
+                    os.path.abspath(part).replace("'", "'\\''")))
+
+        cmds = [self.ffmpeg_path, '-hide_banner', '-f', 'concat', '-safe', '0', '-i', listfile]
+        cmds.extend(inputs or [])
+        cmds.extend(opts)
+        cmds.extend(['-y', outfile])
+
+        try:
+            for timecode in self._run_ffmpeg(listfile, cmds, timeout=timeout, nice=nice):
+                yield timecode
+        finally:
+            os.unlink(listfile)
+
+    def keyframes(self, fname, stream='v:0'):
+        """
+        Return the sorted timestamps (in seconds) of the keyframes of a
+        stream of the media file. Only the packets are read, nothing is
+        decoded.
+
+        >>> FFMpeg().keyframes('test1.ogg')[:3]
+        [0.0, 2.56, 5.12]
+        """
+        if not os.path.exists(fname) and not self.is_url(fname):
+            raise IOError('No such file: ' + fname)
+
+        p = self._spawn([self.ffprobe_path, '-v', 'quiet', '-select_streams', stream,
+                         '-show_entries', 'packet=pts_time,flags', '-of', 'csv=p=0', fname])
+        stdout_data, _ = p.communicate()
+        stdout_data = stdout_data.decode(console_encoding, 'ignore')
+
+        keyframes = []
+        for line in stdout_data.splitlines():
+            pts, _, flags = line.partition(',')
+            if 'K' not in flags:
+                continue
+            try:
+                keyframes.append(float(pts))
+            except ValueError:
+                # N/A timestamp
+                pass
+        keyframes.sort()
+        return keyframes
+
+    def compare(self, fname, reference, metrics=('ssim', 'psnr'), start=None, duration=None, timeout=10, nice=None):
+        """
+        Return the quality of the video of fname against the video of the
+        reference file, as a dictionary of the average of each metric
+        (ssim and/or psnr) computed by the ffmpeg filters. The reference is
+        read from start (in seconds) for duration seconds, and scaled to the
+        size of fname.
+
+        >>> FFMpeg().compare('/tmp/sample.mkv', 'master.mov', start=20, duration=4)
+        {'ssim': 0.987213, 'psnr': 42.31}
+        """
+        info = self.probe(fname)
+        if info is None or 'video' not in info:
+            raise FFMpegError('No video stream in ' + fname)
+
+        # same time base and timestamps from 0, so the frames are paired
+        sync = 'settb=AVTB,setpts=PTS-STARTPTS'
+        graph = ['[0:v]{0},split={1}{2}'.format(sync, len(metrics), ''.join('[d%d]' % i for i in range(len(metrics)))),
+                 '[1:v]scale={0}:{1},{2},split={3}{4}'.format(info['video']['width'], info['video']['height'], sync,
+                                                              len(metrics),
+                                                              ''.join('[r%d]' % i for i in range(len(metrics))))]
+        for idx, metric in enumerate(metrics):
+            graph.append('[d{0}][r{0}]{1}'.format(idx, metric))
+
+        cmds = [self.ffmpeg_path, '-hide_banner', '-i', fname]
+        if start:
+            cmds.extend(['-ss', str(start)])
+        if duration:
+            cmds.extend(['-t', str(duration)])
+        cmds.extend(['-i', reference, '-lavfi', ';'.join(graph), '-f', 'null', '/dev/null'])
+
+        data = ''
+        for data in self._run_ffmpeg(fname, cmds, timeout=timeout, nice=nice, get_output=True):
+            pass
+        return parse_quality(data)
+
+    def loudness(self, infile, stream=None, timeout=10, nice=None):
+        """
+        Measure the EBU R128 loudness of an audio stream of infile (given by
+        its index in the file, default: the first audio stream) with the
+        first pass of the loudnorm filter. Returns a generator yielding the
+        timecodes, then a dictionary of the integrated loudness (I), the
+        loudness range (LRA), the true peak (TP) and the gating threshold
+        (thresh), as used by avcodecs.AudioCodec.loudnorm_filter().
+
+        >>> for data in FFMpeg().loudness('master.mov'):
+        ...    pass
+        >>> data
+        {'I': -27.61, 'LRA': 18.06, 'TP': -4.47, 'thresh': -39.2}
+        """
+        opts = ['-map', '0:a:0' if stream is None else '0:{0}'.format(stream), '-vn', '-sn', '-dn',
+                '-af', 'loudnorm=print_format=json', '-f', 'null']
+        output = ''
+        for data in self.convert(infile, '/dev/null', opts, timeout, nice=nice, get_output=True):
+            if isinstance(data, float):
+                yield data
+            else:
+                output = data
+        yield parse_loudnorm(output)
+
+    def _run_ffmpeg(self, infile, cmds, timeout=10, nice=None, get_output=False, title=None,
+                    source=None, sink=None, parser=None):
         if nice is not None:
             if 0 < nice < 20:
                 cmds = ['nice', '-n', str(nice)] + cmds
@@ -477,6 +897,17 @@ class FFMpeg(object):
         except OSError:
             raise FFMpegError('Error while calling ffmpeg binary')
 
+        output_pump = None
+        if source is not None:
+            if hasattr(source, 'read'):
+                chunks = iter(lambda: source.read(self.PIPE_CHUNK_SIZE), b'')
+            else:
+                chunks = iter(source)
+            self._start_pump(chunks, p.stdin, close=True)
+        if sink is not None:
+            output_pump = self._start_pump(
+                iter(lambda: p.stdout.read(self.PIPE_CHUNK_SIZE), b''), sink)
+
         if timeout:
             def on_sigvtalrm(*_):
                 try:
@@ -495,6 +926,13 @@ class FFMpeg(object):
         yielded = False
         buf = ''
         total_output = ''
+        # with a parser, the output is read by larger chunks and only the
+        # end of it is kept, for the error messages
+        read = p.stderr.read
+        if parser is not None:
+            read = getattr(p.stderr, 'read1', read)
+        chunk_size = self.PARSER_CHUNK_SIZE if parser is not None else 10
+        lines = ''
         if '/dev/null' in cmds:
             pat = re.compile(r'time=\s*([0-9.:]+)')
         else:
@@ -522,7 +960,7 @@ class FFMpeg(object):
                 except ValueError:
                     pass
 
-            ret = p.stderr.read(10)
+            ret = read(chunk_size)
 
             if timeout:
                 try:
@@ -535,6 +973,18 @@ class FFMpeg(object):
 
             ret = ret.decode(console_encoding, "replace")
             total_output += ret
+            if parser is not None:
+                total_output = total_output[-self.OUTPUT_TAIL:]
+                parts = re.split('[\r\n]', lines + ret)
+                lines = parts.pop()
+                for line in parts:
+                    timecode = get_res(line)
+                    if timecode is not None:
+                        yielded = True
+                        yield timecode
+                    else:
+                        parser.feed(line)
+                continue
             buf += ret
             if '\r' in buf:
                 line, buf = buf.split('\r', 1)
@@ -542,6 +992,8 @@ class FFMpeg(object):
                 if timecode is not None:
                     yielded = True
                     yield timecode
+        if parser is not None and lines:
+            parser.feed(lines)
         if not yielded:
             # There may have been a single time, check it
             timecode = get_res(total_output)
@@ -555,6 +1007,9 @@ class FFMpeg(object):
             except ValueError:
                 pass
 
+        if output_pump is not None:
+            # Get all the output before communicate() reads stdout.
+            output_pump.join()
         p.communicate()  # wait for process to exit
 
         if total_output == '':
@@ -584,36 +1039,73 @@ class FFMpeg(object):
             raise FFMpegConvertError('Exited with code %d' % p.returncode, cmd,
                                      total_output, pid=p.pid)
 
-    def analyze(self, infile, audio_level=True, interlacing=True, crop=False, start=None, duration=None, end=None, timeout=10, nice=None, title=None):
+    def analyze(self, infile, audio_level=True, interlacing=True, crop=False, start=None, duration=None, end=None,
+                timeout=10, nice=None, title=None, samples=None, sample_time=10, sample_audio=False,
+                skip_frame=None, lowres=0, crop_scale=1, split=False, audio_streams=None):
         """
         Analyze the video frames to find if the video need to be deinterlaced
         and/or crop to remove black strips.
         Analyze the audio to find if the audio need to be normalize
         and by how much. All analyses are together so FFMpeg can do them
         in the same pass.
+
+        With samples, only that many windows of sample_time seconds spread
+        over the source (or the start/duration/end range) are analyzed for interlacing and crop, each by its
+        own ffmpeg process, all at once, and the results of the windows are
+        merged. The loudness is still measured over the whole source, by
+        another process running at the same time, unless sample_audio is
+        set: then it is estimated from the same windows.
+
+        The crop detection doesn't need every frame at full resolution, it
+        can decode less with:
+          * skip_frame - decode only the 'nokey' (keyframes) or 'nonref'
+            (reference frames) of the video; few frames are then left in
+            short sample windows
+          * lowres - decode at 1/2, 1/4 or 1/8 of the size (1, 2 or 3), for
+            the codecs supporting it (MPEG-1/2/4, H.263, MJPEG, JPEG 2000)
+          * crop_scale - downscale the frames by that factor before the
+            detection
+        The crop coordinates are given back at the source size, rounded to
+        the decoded scale: with lowres or crop_scale, the borders can be off
+        by up to 2 pixels times the scale (8 pixels with crop_scale=4),
+        which the full size detection doesn't lose.
+
+        With one of these options, or with split, the audio, the
+        interlacing and the crop are analyzed by separate ffmpeg processes
+        running at the same time. The interlacing detection still decodes
+        all the frames at full size, so the options only save time when
+        there are spare cores for the extra processes: on a single core
+        (see benchmark.py analyze), none was clearly faster than the single
+        process.
+
+        With samples or separate processes, no timecode is yielded, only
+        the result.
+
+        audio_streams selects the audio streams whose level is measured, by
+        their index in the file, or True for all of them (default: only the
+        one ffmpeg selects). They are all measured by the same process, each
+        by its own ebur128 filter, and the audio level result is then a
+        dictionary of the adjustment of each stream, by index.
         """
+        if audio_streams is True:
+            info = self.probe(infile, title=title) or {}
+            audio_streams = [stream['index'] for stream in info.get('audios', [])]
+        if audio_streams is not None:
+            audio_streams = list(audio_streams)
+            if not audio_streams:
+                audio_level = False
+
         if not audio_level and not interlacing and not crop:
             raise FFMpegError('Nothing selected to analyze (audio level, '
                               'interlacing or crop).')
 
-        opts = ['-f', 'null']
-        if audio_level:
-            opts.extend(['-af', 'ebur128=peak=true:framelog=verbose'])
-        else:
-            opts.append('-an')
-
-        video_filters = []
-        if interlacing:
-            video_filters.append('idet')
+        if samples or split or skip_frame or lowres or crop_scale > 1:
+            yield self._analyze_parallel(infile, audio_level, interlacing, crop, samples, sample_time,
+                                         sample_audio, skip_frame, lowres, crop_scale, nice, title,
+                                         audio_streams, start, duration, end)
+            return
 
-        if crop:
-            video_filters.append('cropdetect=0.12:2:1')
-
-        if video_filters:
-            video_filters = ','.join(video_filters)
-            opts.extend(['-vf', video_filters])
-        else:
-            opts.append('-vn')
+        opts = self._analyze_options(audio_level, interlacing, crop, audio_streams=audio_streams)
 
         if start:
             start = parse_time(start)
@@ -633,71 +1125,313 @@ class FFMpeg(object):
             else:
                 opts.extend(['-to', end])
 
-        for data in self.convert(infile, '/dev/null',
-                                 opts, timeout, nice=nice, get_output=True):
-            if 'sre' in str(type(data)) or \
-               'float' in str(type(data)):
-                yield data
+        parser = StreamsParser(audio_streams) if audio_streams else AnalysisParser()
+        for timecode in self.convert(infile, '/dev/null', opts, timeout, nice=nice, parser=parser):
+            yield timecode
+
+        adjustement = None
+        if audio_level and audio_streams:
+            adjustement = dict((stream, self._audio_adjustment(p.loudness, p.peak))
+                               for stream, p in parser.streams.items())
+        elif audio_level:
+            adjustement = self._audio_adjustment(parser.loudness, parser.peak)
+        interlace = self._interlaced(parser.interlace_counts()) if interlacing else None
+        crop_size = self._crop_size(infile, parser.crops, title) if crop else None
+        yield adjustement, interlace, crop_size
+
+    def inspect(self, infile, thumbnails=None, audio_level=True, interlacing=True, crop=True, black=True,
+                silence=True, timeout=10, nice=None, title=None, info=None):
+        """
+        Inspect the media file for ingest in a single ffmpeg run, decoding
+        the source once: the audio level, interlacing and crop of analyze(),
+        the black video and silent audio intervals (of at least 2 s), the
+        decoding errors checked by Converter.validate(), and the thumbnails
+        of thumbnails(), given as a list of (time, outfile, size=None,
+        quality=DEFAULT_JPEG_QUALITY) tuples. The thumbnails are taken from
+        the whole frames (not cropped nor deinterlaced), at the first frame
+        from time on (counted from the first frame of the video).
+
+        Returns a generator yielding the timecodes, then the report, a
+        dictionary of:
+          * audio_level - as in analyze(), None without audio
+          * loudness, true_peak - integrated loudness (LUFS) and true peak
+            (dBFS) of the audio
+          * interlaced - True if the video needs to be deinterlaced, None
+            without video
+          * crop - the crop (width:height:x:y) removing the black borders,
+            None without video
+          * black, silence - lists of (start, end) intervals in seconds, the
+            end is None if the interval lasts until the end of the source
+          * decode_errors - number of decoding errors, and errors the first
+            InspectionParser.MAX_ERRORS messages
+          * thumbnails - dictionary telling for each thumbnail file if it
+            was created
+
+        info is the probe() result of infile, if already known.
+
+        >>> for data in FFMpeg().inspect('master.mov', [(10, '/tmp/10.jpg', '320x180')]):
+        ...    pass
+        >>> data['crop'], data['black']
+        ('1920:800:0:140', [(0.0, 2.04)])
+        """
+        if info is None:
+            info = self.probe(infile, title=title)
+        if info is None:
+            raise FFMpegError("Can't get information about source file")
+        thumbnails = list(thumbnails or [])
+        if 'video' not in info:
+            interlacing = crop = black = False
+            thumbnails = []
+        if 'audio' not in info:
+            audio_level = silence = False
+
+        graph = []
+        maps = []
+        video_filters = []
+        if interlacing:
+            video_filters.append('idet')
+        if crop:
+            video_filters.append('cropdetect=0.12:2:1')
+        if black:
+            video_filters.append(self.BLACK_FILTER)
+        labels = (['vi'] if video_filters else []) + ['t{0}'.format(idx) for idx in range(len(thumbnails))]
+        if labels:
+            graph.append('[0:v:0]split={0}{1}'.format(len(labels), ''.join('[{0}]'.format(l) for l in labels)))
+        if video_filters:
+            graph.append('[vi]{0}[v]'.format(','.join(video_filters)))
+            maps.extend(['-map', '[v]'])
+
+        audio_filters = []
+        if audio_level:
+            audio_filters.append('ebur128=peak=true:framelog=verbose')
+        if silence:
+            audio_filters.append(self.SILENCE_FILTER)
+        if audio_filters:
+            graph.append('[0:a:0]{0}[a]'.format(','.join(audio_filters)))
+            maps.extend(['-map', '[a]'])
+
+        if not maps:
+            raise FFMpegError('Nothing selected to inspect (audio level, '
+                              'interlacing, crop, black or silence).')
+
+        outputs = [('/dev/null', maps + ['-f', 'null'])]
+        for idx, thumb in enumerate(thumbnails):
+            start = timecode_to_seconds(parse_time(thumb[0]))
+            chain = ['setpts=PTS-STARTPTS', 'select=gte(t\\,{0})'.format(start)]
+            if len(thumb) > 2 and thumb[2]:
+                chain.append('scale=' + str(thumb[2]).replace('x', ':'))
+            graph.append('[t{0}]{1}[th{0}]'.format(idx, ','.join(chain)))
+            quality = thumb[3] if len(thumb) > 3 else self.DEFAULT_JPEG_QUALITY
+            outputs.append((thumb[1], ['-map', '[th{0}]'.format(idx), '-frames:v', '1',
+                                       '-q:v', str(quality), '-f', 'image2']))
+
+        parser = InspectionParser()
+        for timecode in self.convert_multi(infile, outputs, ';'.join(graph), timeout=timeout, nice=nice,
+                                           parser=parser):
+            yield timecode
+
+        report = {
+            'audio_level': None,
+            'loudness': parser.loudness,
+            'true_peak': parser.peak,
+            'interlaced': None,
+            'crop': None,
+            'black': parser.black,
+            'silence': parser.silence,
+            'decode_errors': parser.decode_errors,
+            'errors': parser.errors,
+            'thumbnails': dict((thumb[1], os.path.exists(thumb[1])) for thumb in thumbnails),
+        }
+        if audio_level:
+            report['audio_level'] = self._audio_adjustment(parser.loudness, parser.peak)
+        if interlacing and parser.idet is not None:
+            report['interlaced'] = self._interlaced(parser.idet)
+        if crop and len(parser.crops[0]):
+            report['crop'] = self._crop_size(infile, parser.crops, title, info)
+        yield report
+
+    @staticmethod
+    def _analyze_options(audio_level, interlacing, crop, crop_filter='cropdetect=0.12:2:1', audio_streams=None):
+        """
+        Return the ffmpeg options of an analysis run. With audio_streams, a
+        list of audio stream indexes, each stream goes through its own
+        ebur128 filter of a filter graph (in this order, see StreamsParser).
+        """
+        opts = ['-f', 'null']
+        video_filters = []
+        if interlacing:
+            video_filters.append('idet')
+
+        if crop:
+            video_filters.append(crop_filter)
+
+        if audio_level and audio_streams:
+            graph = ['[0:{0}]ebur128=peak=true:framelog=verbose[a{1}]'.format(stream, idx)
+                     for idx, stream in enumerate(audio_streams)]
+            maps = []
+            for idx in range(len(audio_streams)):
+                maps.extend(['-map', '[a{0}]'.format(idx)])
+            if video_filters:
+                graph.append('[0:v:0]{0}[v]'.format(','.join(video_filters)))
+                maps.extend(['-map', '[v]'])
             else:
-                interlace = None
-                adjustement = None
-                crop_size = None
-
-                if audio_level:
-                    match = re.search('Integrated loudness:\s+I:\s+(-?\d+\.\d)\s+LUFS(?s).+True peak:\s+Peak:\s+(-?\d+\.\d)\s+dBFS', data, re.UNICODE)
-                    if match is None:
-                        adjustement = 'noise'
-                    else:
-                        # Adjust audio volume so loudness will be close as possible
-                        # as the target but max peak will not be above AUDIO_PEAK_MAX.
-                        loudness = float(match.group(1))
-                        peak = float(match.group(2))
-                        # Check if audio is only noise.
-                        # Values are good only for 16 bits audio.
-                        if loudness < -56 and peak < -40:
-                            adjustement = 'noise'
-                        else:
-                            loudness_adj = self.AUDIO_LOUDNESS_TARGET - loudness
-                            if loudness_adj > 0:
-                                peak_adj = self.AUDIO_PEAK_MAX - peak
-                                if peak_adj < 0:
-                                    peak_adj = 0
-                                adjustement = min(peak_adj, loudness_adj)
-                            else:
-                                adjustement = loudness_adj
-                            # Don't adjust if adjustment is too small
-                            if -1 < adjustement < 1:
-                                adjustement = 0
-
-                if interlacing:
-                    match = re.search('Multi frame detection:\s*TFF:\s*(\d+)\s*BFF:\s*(\d+)\s*Progressive:\s*(\d+)\s*Undetermined:\s*(\d+)', data, re.UNICODE)
-                    if match is None:
-                        raise FFMpegConvertError(
-                            'No interlaced data.',
-                            opts,
-                            data
-                        )
-                    tff = int(match.group(1))
-                    bff = int(match.group(2))
-                    progressive = int(match.group(3))
-                    undetermined = int(match.group(4))
-                    interlaced = tff + bff
-                    total = interlaced + progressive + undetermined
-                    # If more then 10% of frames are detected as interlaced,
-                    # assume video is at least partly interlaced frames.
-                    if interlaced > total / 10:
-                        interlace = True
-                    else:
-                        interlace = False
+                maps.append('-vn')
+            return opts + ['-filter_complex', ';'.join(graph)] + maps
 
-                if crop:
-                    info = self.probe(infile, title=title)
-                    video = info['video']
-                    size = (video['width'], video['height'])
-                    fps = video.get('fps', 29.97)
-                    crop_size = parse_crop(data, size, fps)
+        if audio_level:
+            opts.extend(['-af', 'ebur128=peak=true:framelog=verbose'])
+        else:
+            opts.append('-an')
 
-                yield adjustement, interlace, crop_size
+        if video_filters:
+            video_filters = ','.join(video_filters)
+            opts.extend(['-vf', video_filters])
+        else:
+            opts.append('-vn')
+        return opts
+
+    def _analyze_parallel(self, infile, audio_level, interlacing, crop, samples, sample_time, sample_audio,
+                          skip_frame, lowres, crop_scale, nice, title, audio_streams=None, start=None,
+                          duration=None, end=None):
+        info = self.probe(infile, title=title)
+        if info is None:
+            raise FFMpegError("Can't get information about source file")
+
+        # The analyzed range, covered by each run or by the sample windows.
+        range_start = timecode_to_seconds(parse_time(start)) if start else 0.0
+        range_end = info['format']['duration']
+        if duration:
+            range_end = min(range_end, range_start + timecode_to_seconds(parse_time(duration)))
+        elif end:
+            range_end = min(range_end, timecode_to_seconds(parse_time(end)))
+        length = range_end - range_start
+        if length <= 0:
+            raise FFMpegError('Nothing to analyze between {0} and {1}'.format(range_start, range_end))
+        whole = ['-ss', str(range_start), '-t', str(round(length, 3))] if start or duration or end else []
+        if samples:
+            windows = [['-ss', str(round(range_start + w, 3)), '-t', str(min(sample_time, round(length, 3)))]
+                       for w in sample_windows(length, samples, sample_time)]
+        else:
+            windows = [whole]
+
+        # (analysis, options) of the ffmpeg runs
+        jobs = []
+        if audio_level:
+            opts = self._analyze_options(True, False, False, audio_streams=audio_streams)
+            for window in (windows if sample_audio else [whole]):
+                jobs.append(('audio', opts + window))
+
+        scale = 1
+        crop_opts = []
+        if crop:
+            if skip_frame:
+                crop_opts.extend(['-skip_frame', skip_frame])
+            if lowres and info.get('video', {}).get('codec') in self.LOWRES_CODECS:
+                crop_opts.extend(['-lowres', str(lowres)])
+                scale = 2 ** lowres
+            crop_filter = 'cropdetect=0.12:2:1'
+            if crop_scale > 1:
+                crop_filter = 'scale=iw/{0}:ih/{0},{1}'.format(crop_scale, crop_filter)
+                scale *= crop_scale
+            if crop_opts or scale > 1:
+                crop_opts.extend(self._analyze_options(False, False, True, crop_filter))
+            else:
+                crop_opts = None
+
+        if interlacing and (crop_opts is None or not crop):
+            # a single video run for both
+            opts = self._analyze_options(False, True, crop)
+            jobs.extend(('video', opts + window) for window in windows)
+        else:
+            if interlacing:
+                opts = self._analyze_options(False, True, False)
+                jobs.extend(('idet', opts + window) for window in windows)
+            if crop:
+                jobs.extend(('crop', (crop_opts or self._analyze_options(False, False, True)) + window)
+                            for window in windows)
+
+        def run(job):
+            parser = StreamsParser(audio_streams) if job[0] == 'audio' and audio_streams else AnalysisParser()
+            # no timeout: the signal based timeout only works in the main thread
+            for _ in self.convert(infile, '/dev/null', list(job[1]), None, nice=nice, parser=parser):
+                pass
+            return parser
+
+        parsers = run_parallel(run, jobs, len(jobs))
+        by_kind = {}
+        for (kind, _), parser in zip(jobs, parsers):
+            by_kind.setdefault(kind, []).append(parser)
+        video_parsers = by_kind.get('video', [])
+
+        adjustement = interlace = crop_size = None
+        if audio_level:
+            def adjustment(parsers):
+                if sample_audio and samples:
+                    return self._audio_adjustment(*merge_loudness((p.loudness, p.peak) for p in parsers))
+                return self._audio_adjustment(parsers[0].loudness, parsers[0].peak)
+
+            audio = by_kind['audio']
+            if audio_streams:
+                adjustement = dict((stream, adjustment([a.streams[stream] for a in audio]))
+                                   for stream in audio_streams)
+            else:
+                adjustement = adjustment(audio)
+        if interlacing:
+            counts = [parser.interlace_counts() for parser in by_kind.get('idet', video_parsers)]
+            interlace = self._interlaced([sum(c[idx] for c in counts) for idx in range(4)])
+        if crop:
+            values = [v for parser in by_kind.get('crop', video_parsers) for v in parser.crop_values()]
+            if scale > 1:
+                values = rescale_crop(values, scale)
+            crop_size = self._crop_size(infile, values, title, info)
+        return adjustement, interlace, crop_size
+
+    def _audio_adjustment(self, loudness, peak):
+        """
+        Return by how much dB the audio volume should be changed, from the
+        ebur128 integrated loudness and true peak, or 'noise' if the audio
+        is only noise (or wasn't measured).
+        """
+        if loudness is None or peak is None:
+            return 'noise'
+        # Adjust audio volume so loudness will be close as possible
+        # as the target but max peak will not be above AUDIO_PEAK_MAX.
+        # Check if audio is only noise.
+        # Values are good only for 16 bits audio.
+        if loudness < -56 and peak < -40:
+            return 'noise'
+        loudness_adj = self.AUDIO_LOUDNESS_TARGET - loudness
+        if loudness_adj > 0:
+            peak_adj = self.AUDIO_PEAK_MAX - peak
+            if peak_adj < 0:
+                peak_adj = 0
+            adjustement = min(peak_adj, loudness_adj)
+        else:
+            adjustement = loudness_adj
+        # Don't adjust if adjustment is too small
+        if -1 < adjustement < 1:
+            adjustement = 0
+        return adjustement
+
+    @staticmethod
+    def _interlaced(counts):
+        """
+        Return if the video is interlaced, from the idet frame counts.
+        """
+        tff, bff, progressive, undetermined = counts
+        interlaced = tff + bff
+        total = interlaced + progressive + undetermined
+        # If more then 10% of frames are detected as interlaced,
+        # assume video is at least partly interlaced frames.
+        return interlaced > total / 10
+
+    def _crop_size(self, infile, data, title=None, info=None):
+        if info is None:
+            info = self.probe(infile, title=title)
+        video = info['video']
+        size = (video['width'], video['height'])
+        fps = video.get('fps', 29.97)
+        return parse_crop(data, size, fps)
 
     def thumbnails_by_interval(self, source, output_pattern, interval=1,
                                max_width=None, max_height=None, autorotate=False,
@@ -1101,60 +1835,356 @@ def time_sort(options):
     return timecode_to_seconds(options[0])
 
 
+class AnalysisParser(object):
+    """
+    Incremental parser of the output of the analysis filters (ebur128,
+    idet and cropdetect), fed line by line by FFMpeg.convert(), so the
+    output of a long source is never kept in memory. The values of each
+    frame are stored in compact arrays:
+      * momentary, short_term - ebur128 momentary (400 ms) and short-term
+        (3 s) loudness, every 100 ms, in LUFS
+      * crops - cropdetect (width, height, x, y) arrays
+    and the summaries in loudness and peak (ebur128 integrated loudness
+    and true peak) and idet (TFF, BFF, progressive and undetermined
+    frame counts).
+
+    >>> parser = AnalysisParser()
+    >>> parser.feed('[Parsed_cropdetect_1 @ 0x1] x1:0 x2:1919 y1:140 y2:939 w:1920 h:800 x:0 y:140 crop=1920:800:0:140')
+    >>> parser.crop_values()
+    [(1920, 800, 0, 140)]
+    """
+
+    EBUR128_FRAME = re.compile(r'\bM:\s*(-?(?:[\d.]+|inf))\s+S:\s*(-?(?:[\d.]+|inf))')
+    CROP = re.compile(r'crop=(\d{1,4}):(\d{1,4}):(\d{1,3}):(\d{1,3})')
+    IDET = re.compile(r'Multi frame detection:\s*TFF:\s*(\d+)\s*BFF:\s*(\d+)\s*Progressive:\s*(\d+)'
+                      r'\s*Undetermined:\s*(\d+)')
+    SUMMARY_VALUE = re.compile(r'^\s*(I|Peak):\s+(-?\d+\.\d)\s')
+
+    def __init__(self):
+        self.momentary = array.array('f')
+        self.short_term = array.array('f')
+        self.crops = tuple(array.array('l') for _ in range(4))
+        self.loudness = None
+        self.peak = None
+        self.idet = None
+        self._section = None
+
+    def feed(self, line):
+        if 'crop=' in line:
+            match = self.CROP.search(line)
+            if match:
+                for values, value in zip(self.crops, match.groups()):
+                    values.append(int(value))
+        elif 'TARGET:' in line:
+            match = self.EBUR128_FRAME.search(line)
+            if match:
+                self.momentary.append(float(match.group(1)))
+                self.short_term.append(float(match.group(2)))
+        elif 'Multi frame detection' in line:
+            match = self.IDET.search(line)
+            if match:
+                self.idet = [int(g) for g in match.groups()]
+        elif 'Integrated loudness:' in line:
+            self._section = 'I'
+        elif 'True peak:' in line:
+            self._section = 'Peak'
+        elif self._section:
+            match = self.SUMMARY_VALUE.match(line)
+            if match and match.group(1) == self._section:
+                if self._section == 'I':
+                    self.loudness = float(match.group(2))
+                else:
+                    self.peak = float(match.group(2))
+                self._section = None
+
+    def crop_values(self):
+        """
+        Return the list of the detected (width, height, x, y) crops.
+        """
+        return list(zip(*self.crops))
+
+    def interlace_counts(self):
+        """
+        Return the idet frame counts, or raise FFMpegConvertError if there
+        were none.
+        """
+        if self.idet is None:
+            raise FFMpegConvertError('No interlaced data.', None, '')
+        return self.idet
+
+
+class StreamsParser(AnalysisParser):
+    """
+    AnalysisParser of a run measuring several audio streams, each by its
+    own ebur128 filter (see FFMpeg._analyze_options()). The lines of the
+    nth ebur128 filter of the graph, and the summary following them, are
+    given to the parser of the nth stream of streams, in the streams
+    dictionary; the other lines are parsed as usual.
+
+    >>> parser = StreamsParser([1, 2])
+    >>> parser.feed('[Parsed_ebur128_1 @ 0x1] t: 0.1 TARGET:-23 LUFS    M: -25.1 S:-120.7     I: -25.1 LUFS')
+    >>> len(parser.streams[2].momentary), len(parser.momentary)
+    (1, 0)
+    """
+
+    EBUR128_PREFIX = re.compile(r'\[Parsed_ebur128_(\d+) @')
+
+    def __init__(self, streams):
+        super(StreamsParser, self).__init__()
+        self.streams = dict((stream, AnalysisParser()) for stream in streams)
+        self._stream_parsers = [self.streams[stream] for stream in streams]
+        self._current = None
+
+    def feed(self, line):
+        if line.startswith('['):
+            match = self.EBUR128_PREFIX.match(line)
+            self._current = self._stream_parsers[int(match.group(1))] if match else None
+        if self._current is None:
+            super(StreamsParser, self).feed(line)
+        else:
+            self._current.feed(line)
+
+
+class InspectionParser(AnalysisParser):
+    """
+    AnalysisParser also collecting, for FFMpeg.inspect(), the black
+    (blackdetect) and silent (silencedetect) intervals, as lists of (start,
+    end) in seconds, and the decoding errors: their number and the first
+    MAX_ERRORS messages.
+
+    >>> parser = InspectionParser()
+    >>> parser.feed('[Parsed_blackdetect_2 @ 0x1] black_start:0 black_end:2.04 black_duration:2.04')
+    >>> parser.black
+    [(0.0, 2.04)]
+    """
+
+    MAX_ERRORS = 20
+    BLACK = re.compile(r'black_start:\s*(-?[\d.]+)\s+black_end:\s*(-?[\d.]+)')
+    SILENCE = re.compile(r'silence_(start|end):\s*(-?[\d.]+)')
+    DECODE_ERROR = re.compile(r'error while decoding|corrupt decoded frame|concealing \d+ .*errors', re.IGNORECASE)
+
+    def __init__(self):
+        super(InspectionParser, self).__init__()
+        self.black = []
+        self.silence = []
+        self.decode_errors = 0
+        self.errors = []
+
+    def feed(self, line):
+        if 'black_start:' in line:
+            match = self.BLACK.search(line)
+            if match:
+                self.black.append((float(match.group(1)), float(match.group(2))))
+        elif 'silence_' in line:
+            match = self.SILENCE.search(line)
+            if match and match.group(1) == 'start':
+                self.silence.append((float(match.group(2)), None))
+            elif match and self.silence and self.silence[-1][1] is None:
+                self.silence[-1] = (self.silence[-1][0], float(match.group(2)))
+        elif ('rror' in line or 'orrupt' in line or 'oncealing' in line) and self.DECODE_ERROR.search(line):
+            self.decode_errors += 1
+            if len(self.errors) < self.MAX_ERRORS:
+                self.errors.append(line.strip())
+        else:
+            super(InspectionParser, self).feed(line)
+
+
+def rescale_crop(values, factor):
+    """
+    Return the (width, height, x, y) crop values multiplied by factor, for
+    a detection on downscaled frames.
+
+    >>> rescale_crop([(480, 200, 0, 34)], 4)
+    [(1920, 800, 0, 136)]
+    """
+    return [tuple(v * factor for v in crop) for crop in values]
+
+
+def merge_loudness(levels):
+    """
+    Return the integrated loudness and true peak estimated from the
+    (integrated loudness, true peak) measures of several windows (None
+    when a window had no measure): the loudness is the energy average of
+    the windows (without the gating of a full measure), the peak their
+    maximum.
+    """
+    levels = [(loudness, peak) for loudness, peak in levels if loudness is not None and loudness > -70]
+    if not levels:
+        return -70.0, -70.0
+    loudness = 10 * math.log10(sum(10 ** (level / 10) for level, _ in levels) / len(levels))
+    return loudness, max(peak for _, peak in levels)
+
+
+def parse_quality(data):
+    """
+    Return the averages printed by the ssim and psnr filters in the ffmpeg
+    output data, by metric.
+
+    >>> parse_quality('[Parsed_ssim_2 @ 0x1] SSIM Y:0.99 (20.0) U:0.98 (17.0) V:0.98 (17.0) All:0.986 (18.5)')
+    {'ssim': 0.986}
+    """
+    result = {}
+    match = re.search(r'SSIM Y:.*All:([0-9.]+|inf)', data)
+    if match:
+        result['ssim'] = float(match.group(1))
+    match = re.search(r'PSNR y:.*average:([0-9.]+|inf)', data)
+    if match:
+        result['psnr'] = float(match.group(1))
+    return result
+
+
+def parse_loudnorm(data):
+    """
+    Return the input loudness values printed by the loudnorm filter with
+    print_format=json in the ffmpeg output data.
+
+    >>> parse_loudnorm('[Parsed_loudnorm_0 @ 0x1] \\n{"input_i" : "-27.61", "input_tp" : "-4.47", '
+    ...                '"input_lra" : "18.06", "input_thresh" : "-39.20"}')
+    {'I': -27.61, 'LRA': 18.06, 'TP': -4.47, 'thresh': -39.2}
+    """
+    start = data.rfind('{', 0, data.rfind('"input_i"') + 1)
+    end = data.find('}', start)
+    try:
+        values = json.loads(data[start:end + 1])
+        return dict((name, float(values[key])) for name, key in (
+            ('I', 'input_i'), ('LRA', 'input_lra'), ('TP', 'input_tp'), ('thresh', 'input_thresh')))
+    except (ValueError, KeyError):
+        raise FFMpegConvertError('No loudness data.', None, data)
+
+
+def parse_vstats(data):
+    """
+    Return the per frame PSNR (None if the encoder didn't compute it) and
+    size (in bytes) of the video encoding statistics written by ffmpeg
+    -vstats_file, as compact arrays. An infinite PSNR (identical frames) is
+    counted as 100 dB.
+
+    >>> psnr, sizes = parse_vstats('frame=     1 q= 26.0 PSNR= 38.55 f_size=  21480 s_size= 21kB')
+    >>> list(psnr), list(sizes)
+    ([38.54999923706055], [21480])
+    """
+    psnr = array.array('f')
+    sizes = array.array('l')
+    for match in re.finditer(r'frame=\s*\d+\s+q=\s*\S+\s+(?:PSNR=\s*(\S+)\s+)?f_size=\s*(\d+)', data):
+        if match.group(1) is not None:
+            value = float(match.group(1))
+            psnr.append(min(value, 100.0))
+        sizes.append(int(match.group(2)))
+    return (psnr if psnr else None), sizes
+
+
+def summarize(values):
+    """
+    Return the mean, minimum, maximum and 5th percentile (the level of the
+    worst frames) of a sequence of per frame values.
+
+    >>> summarize([40.0, 42.0, 44.0])
+    {'mean': 42.0, 'min': 40.0, 'max': 44.0, 'p5': 40.0}
+    """
+    if not values:
+        return {}
+    ordered = sorted(values)
+    return {
+        'mean': sum(ordered) / len(ordered),
+        'min': ordered[0],
+        'max': ordered[-1],
+        'p5': ordered[int(len(ordered) * 0.05)],
+    }
+
+
+_numpy_module = []
+
+
+def _numpy():
+    """
+    Return the numpy module, imported on the first call as it is slow to
+    import and only needed by parse_crop, or None if it is not installed.
+    """
+    if not _numpy_module:
+        try:
+            import numpy
+        except ImportError:
+            numpy = None
+        _numpy_module.append(numpy)
+    return _numpy_module[0]
+
+
+def _border_counts(values, limit):
+    """
+    Return the sorted border sizes of values not above limit, and the
+    number of occurrences of each.
+
+    >>> _border_counts([0, 140, 140, 138, 600], 270)
+    ([0, 138, 140], [1, 1, 2])
+    """
+    numpy = _numpy()
+    if numpy is not None:
+        values = numpy.asarray(values, dtype=numpy.int64)
+        values = values[values <= limit]
+        if not len(values):
+            return [], []
+        low = int(values.min())
+        counts = numpy.bincount(values - low)
+        dims = numpy.flatnonzero(counts)
+        return (dims + low).tolist(), counts[dims].tolist()
+
+    counted = {}
+    for value in values:
+        if value <= limit:
+            counted[value] = counted.get(value, 0) + 1
+    dims = sorted(counted)
+    return dims, [counted[dim] for dim in dims]
+
+
 def parse_crop(data, size, fps):
+    """
+    Return the crop (width:height:x:y) removing the black borders of a
+    video of size (width, height), from the cropdetect output data, from
+    a list of the (width, height, x, y) crops detected or from a tuple of
+    their width, height, x and y arrays (like AnalysisParser.crops).
+
+    The borders are counted with NumPy histograms when it is installed.
+    """
+    numpy = _numpy()
     width, height = size
     # Maximum width and height of a black border.
     x_limit = width / 4
     y_limit = height / 4
-    # Get all the only positive crop values.
-    matches = re.findall('crop=(\d{1,4}):(\d{1,4}):(\d{1,3}):(\d{1,3})', data)
-    if not matches:
-        raise FFMpegConvertError('No crop data.', data)
-
-    # For each crop values, get or calculate the left, right, top and bottom
-    # values.
-    values = (
-        (
-            int(x), width - int(x) - int(crop_width),
-            int(y), height - int(y) - int(crop_height)
-        )
-        for crop_width, crop_height, x, y in matches
-    )
-    # Regroup values by side.
-    values = list(zip(*values))
+    # Get all the only positive crop values, by column.
+    if isinstance(data, basestring):
+        matches = re.findall(r'crop=(\d{1,4}):(\d{1,4}):(\d{1,3}):(\d{1,3})', data)
+        if numpy is not None and matches:
+            columns = tuple(numpy.array(matches, dtype=numpy.int64).T)
+        else:
+            columns = [[int(v) for v in column] for column in zip(*matches)]
+    elif isinstance(data, tuple):
+        columns = data
+    else:
+        columns = list(zip(*data))
+    if not columns or not len(columns[0]):
+        raise FFMpegConvertError('No crop data.', None, data)
+
+    # Get or calculate the left, right, top and bottom values of each crop.
+    crop_widths, crop_heights, xs, ys = columns
+    if numpy is not None:
+        crop_widths, crop_heights, xs, ys = [numpy.asarray(c, dtype=numpy.int64) for c in columns]
+        sides = (xs, width - xs - crop_widths, ys, height - ys - crop_heights)
+    else:
+        sides = (xs, [width - x - w for x, w in zip(xs, crop_widths)],
+                 ys, [height - y - h for y, h in zip(ys, crop_heights)])
 
     # Count the number of occurences of each width/height.
-    def counter(collection, limit):
-        counted = {}
-        for item in set(collection):
-            if item > limit:
-                continue
-            counted[item] = collection.count(item)
-        return counted
-
     results = {
-        'left': counter(values[0], x_limit),
-        'right': counter(values[1], x_limit),
-        'top': counter(values[2], y_limit),
-        'bottom': counter(values[3], y_limit),
+        'left': _border_counts(sides[0], x_limit),
+        'right': _border_counts(sides[1], x_limit),
+        'top': _border_counts(sides[2], y_limit),
+        'bottom': _border_counts(sides[3], y_limit),
     }
 
     # For each side find the larger gap between the number of frames of each
     # dimension and keep the dimension before the gap.
-
-    try:
-        iteritems = results.iteritems()
-    except AttributeError:
-        iteritems = results.items()
-
-    for pos, result in iteritems:
-        if result:
-            dims = list(result.keys())
-            try:
-                dims.sort()
-            except AttributeError:
-                sorted(dims)
-
+    for pos, (dims, counts) in list(results.items()):
+        if dims:
             length = width if pos in ('left', 'right') else height
             threshold = int(round(length * 0.03))
             gap_coord = 0
@@ -1166,14 +2196,14 @@ def parse_crop(data, size, fps):
                 # far away.
                 if gap_coord and dims[idx] - gap_coord > threshold:
                     break
-                gap = result[dims[idx]] - result[dims[idx + 1]]
+                gap = counts[idx] - counts[idx + 1]
                 if gap >= largest_gap:
                     largest_gap = gap
                     dim = dims[idx]
                     gap_coord = dim
             else:
                 # Check last value.
-                if result[dims[-1]] >= largest_gap:
+                if counts[-1] >= largest_gap:
                     dim = dims[-1]
             # Add a bit of padding to crop blurry transition.
             if dim:
@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+
+import re
+
+
+class FilterGraph(object):
+    """
+    Audio ('a') or video ('v') filter chain, built by the codecs from
+    their options and emitted as -af/-vf or as a -filter_complex graph.
+
+    Crop and scale are merged while the chain is built: consecutive crops
+    become a single crop, consecutive scales a single scale, and a crop or
+    scale which doesn't change the frame size (when it is known) is
+    dropped, so each frame goes through as few filters as possible. The
+    'auto' scaler flags use the area scaler for large downscales and the
+    default scaler otherwise.
+
+    >>> graph = FilterGraph('v', 1920, 1080)
+    >>> graph.crop(1920, 800, 0, 140)
+    >>> graph.scale(1920, 800)
+    >>> graph.scale(1280, 534)
+    >>> graph.options()
+    ['-vf', 'crop=1920:800:0:140,scale=1280:534']
+    """
+
+    SIZE_FILTER = re.compile(r'^(crop|scale)=(\d+):(\d+)(?::(\d+)(?:\.0)?:(\d+)(?:\.0)?)?$')
+    # filters which don't change the frame size
+    SAME_SIZE = ('null', 'anull', 'setdar', 'setsar', 'format', 'fps', 'hflip', 'vflip',
+                 'yadif', 'hqdn3d', 'volume')
+
+    def __init__(self, kind='v', width=None, height=None):
+        self.kind = kind
+        self.width = width
+        self.height = height
+        # (name, args, size before the filter) of each node
+        self._nodes = []
+
+    def __len__(self):
+        return len(self._nodes)
+
+    def _push(self, name, args=None):
+        self._nodes.append((name, args, (self.width, self.height)))
+
+    def _last(self, name):
+        return self._nodes and self._nodes[-1][0] == name
+
+    def _same_size(self, width, height):
+        return self.width is not None and (int(self.width), int(self.height)) == (width, height)
+
+    def add(self, value):
+        """
+        Append a filter, or several given as a filter chain string. The
+        frame size is unknown after them, except for a plain crop or scale
+        and the filters known to keep the size.
+        """
+        if not value:
+            return
+        m = self.SIZE_FILTER.match(value)
+        if m and m.group(1) == 'crop':
+            self.crop(*[int(g or 0) for g in m.groups()[1:]])
+        elif m and m.group(4) is None:
+            self.scale(int(m.group(2)), int(m.group(3)))
+        else:
+            self._push(value)
+            if value.split('=')[0] not in self.SAME_SIZE or ',' in value:
+                self.width = self.height = None
+
+    def crop(self, width, height, x=0, y=0):
+        if self._same_size(width, height) and not x and not y:
+            return
+        if self._last('crop'):
+            _, (_, _, x0, y0), (self.width, self.height) = self._nodes.pop()
+            x, y = x + x0, y + y0
+        self._push('crop', (width, height, x, y))
+        self.width, self.height = width, height
+
+    def scale(self, width, height, flags=None):
+        if self._last('scale'):
+            _, _, (self.width, self.height) = self._nodes.pop()
+        if self._same_size(width, height):
+            return
+        if flags == 'auto':
+            downscale = self.width and self.height and width * 2 <= self.width and height * 2 <= self.height
+            flags = 'area' if downscale else None
+        self._push('scale', (width, height, flags))
+        self.width, self.height = width, height
+
+    def rotate(self, degrees):
+        """
+        Rotate the frames clockwise by 90, 180 or 270 degrees.
+        """
+        if degrees == 90:
+            self._push('transpose=1')
+        elif degrees == 270:
+            self._push('transpose=2')
+        elif degrees == 180:
+            self._push('hflip,vflip')
+            return
+        else:
+            return
+        self.width, self.height = self.height, self.width
+
+    @staticmethod
+    def _format(name, args):
+        if args is None:
+            return name
+        if name == 'scale':
+            width, height, flags = args
+            value = 'scale={0}:{1}'.format(width, height)
+            return value + ':flags=' + flags if flags else value
+        return '{0}={1}'.format(name, ':'.join(str(a) for a in args))
+
+    def chain(self):
+        """
+        Return the filter chain string, empty if there is no filter.
+        """
+        return ','.join(self._format(name, args) for name, args, _ in self._nodes)
+
+    def options(self):
+        """
+        Return the -vf/-af options of the chain.
+        """
+        if not self._nodes:
+            return []
+        return ['-{0}f'.format(self.kind), self.chain()]
+
+    def complex(self, source='0', output=None):
+        """
+        Return the chain as a -filter_complex graph reading the first
+        stream of its kind of the input source, with the output label
+        output (default: the kind), or None if there is no filter.
+        """
+        if not self._nodes:
+            return None
+        return '[{0}:{1}]{2}[{3}]'.format(source, self.kind, self.chain(), output or self.kind)
+
+
+def split_chain(chain):
+    r"""
+    Split a filter chain string into its filters, on the commas which are
+    neither escaped with a backslash nor quoted.
+
+    >>> split_chain(r"yadif,select='eq(n,0)+gt(scene,0.4)',drawtext=text=a\,b")
+    ['yadif', "select='eq(n,0)+gt(scene,0.4)'", 'drawtext=text=a\\,b']
+    """
+    filters = []
+    current = []
+    quoted = escaped = False
+    for c in chain:
+        if escaped:
+            escaped = False
+        elif c == '\\' and not quoted:
+            escaped = True
+        elif c == "'":
+            quoted = not quoted
+        elif c == ',' and not quoted:
+            filters.append(''.join(current))
+            current = []
+            continue
+        current.append(c)
+    filters.append(''.join(current))
+    return filters
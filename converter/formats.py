@@ -1,5 +1,7 @@
 #!/usr/bin/env python
 
+import os
+
 
 class BaseFormat(object):
     """
@@ -10,6 +12,9 @@ class BaseFormat(object):
 
     format_name = None
     ffmpeg_format_name = None
+    # names of the codecs the container can hold, None for any codec
+    video_codecs = None
+    audio_codecs = None
 
     def parse_options(self, opt):
         if 'format' not in opt or opt.get('format') != self.format_name:
@@ -43,7 +48,8 @@ class AviFormat(BaseFormat):
 
 class MkvFormat(BaseFormat):
     """
-    Matroska format, often used with H.264 video.
+    Matroska format, often used with H.264 video, and holding any of the
+    WebM codecs (VP9 or AV1 with Opus) too.
     """
     format_name = 'mkv'
     ffmpeg_format_name = 'matroska'
@@ -52,10 +58,12 @@ class MkvFormat(BaseFormat):
 class WebmFormat(BaseFormat):
     """
     WebM is Google's variant of Matroska containing only
-    VP8 for video and Vorbis for audio content.
+    VP8, VP9 or AV1 for video and Vorbis or Opus for audio content.
     """
     format_name = 'webm'
     ffmpeg_format_name = 'webm'
+    video_codecs = (None, 'copy', 'vp8', 'vp9', 'av1')
+    audio_codecs = (None, 'copy', 'vorbis', 'opus')
 
 
 class FlvFormat(BaseFormat):
@@ -139,6 +147,10 @@ class HLSFormat(BaseFormat):
             optlist.extend(['-segment_list', str(opt.get('segment_list'))])
         if 'segment_time' in opt:
             optlist.extend(['-segment_time', str(opt.get('segment_time'))])
+        if 'segment_times' in opt:
+            optlist.extend(['-segment_times', ','.join(str(t) for t in opt.get('segment_times'))])
+        if opt.get('reset_timestamps'):
+            optlist.extend(['-reset_timestamps', '1'])
         if 'segment_format' in opt:
             optlist.extend(['-segment_format', str(opt.get('segment_format'))])
         if 'segment_list_type' in opt:
@@ -146,7 +158,74 @@ class HLSFormat(BaseFormat):
 
         return optlist
 
+class HlsAbrFormat(BaseFormat):
+    """
+    HLS adaptive bitrate package: several variant streams in fMP4 (CMAF)
+    segments plus a master playlist, written by the ffmpeg hls muxer.
+
+    Options are the number of video (video_streams) and audio
+    (audio_streams, 0 or 1) streams of the package, the output directory
+    (outdir), the segment duration in seconds (segment_time) and the name
+    of the master playlist (master_playlist).
+    """
+    format_name = 'hls_abr'
+    ffmpeg_format_name = 'hls'
+    playlist_name = 'stream_%v.m3u8'
+
+    def parse_options(self, opt):
+        if 'format' not in opt or opt.get('format') != self.format_name:
+            raise ValueError('invalid Format format')
+
+        outdir = opt.get('outdir', '.')
+        audio = int(opt.get('audio_streams', 0)) > 0
+        stream_map = []
+        for idx in range(int(opt.get('video_streams', 1))):
+            stream_map.append('v:{0},agroup:audio'.format(idx) if audio else 'v:{0}'.format(idx))
+        if audio:
+            stream_map.insert(0, 'a:0,agroup:audio')
+
+        optlist = ['-f', self.ffmpeg_format_name]
+        optlist.extend(['-hls_time', str(opt.get('segment_time', 6))])
+        optlist.extend(['-hls_playlist_type', 'vod'])
+        optlist.extend(['-hls_segment_type', 'fmp4'])
+        optlist.extend(['-hls_fmp4_init_filename', 'init_%v.mp4'])
+        optlist.extend(['-hls_segment_filename', os.path.join(outdir, 'stream_%v_%05d.m4s')])
+        optlist.extend(['-master_pl_name', str(opt.get('master_playlist', 'master.m3u8'))])
+        optlist.extend(['-var_stream_map', ' '.join(stream_map)])
+        return optlist
+
+
+class DashFormat(BaseFormat):
+    """
+    MPEG-DASH adaptive bitrate package: fMP4 (CMAF) segments described by
+    a MPD manifest, written by the ffmpeg dash muxer.
+
+    Options are the number of audio streams (audio_streams, 0 or 1) and
+    the segment duration in seconds (segment_time).
+    """
+    format_name = 'dash'
+    ffmpeg_format_name = 'dash'
+    playlist_name = 'manifest.mpd'
+
+    def parse_options(self, opt):
+        if 'format' not in opt or opt.get('format') != self.format_name:
+            raise ValueError('invalid Format format')
+
+        optlist = ['-f', self.ffmpeg_format_name]
+        optlist.extend(['-seg_duration', str(opt.get('segment_time', 6))])
+        optlist.extend(['-dash_segment_type', 'mp4'])
+        optlist.extend(['-use_template', '1', '-use_timeline', '1'])
+        optlist.extend(['-init_seg_name', 'init-$RepresentationID$.m4s'])
+        optlist.extend(['-media_seg_name', 'chunk-$RepresentationID$-$Number%05d$.m4s'])
+        if int(opt.get('audio_streams', 0)) > 0:
+            optlist.extend(['-adaptation_sets', 'id=0,streams=v id=1,streams=a'])
+        else:
+            optlist.extend(['-adaptation_sets', 'id=0,streams=v'])
+        return optlist
+
+
 format_list = [
     RawvideoFormat, OggFormat, AviFormat, MkvFormat, WebmFormat, FlvFormat,
-    MovFormat, Mp4Format, MpegFormat, Mp3Format, HLSFormat, HevcFormat
+    MovFormat, Mp4Format, MpegFormat, Mp3Format, HLSFormat, HevcFormat,
+    HlsAbrFormat, DashFormat
 ]
@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+
+import importlib
+import logging
+import threading
+try:
+    from collections.abc import Mapping
+except ImportError:
+    # Python 2
+    from collections import Mapping
+
+logger = logging.getLogger(__name__)
+
+
+# converter.* entry points of the installed packages, by group
+_entry_point_groups = None
+
+
+def _entry_points(group):
+    global _entry_point_groups
+    if _entry_point_groups is None:
+        # Scanning the installed packages is slow, it is done only once.
+        names = [r.group for r in (video_codecs, audio_codecs, subtitle_codecs, decoder_codecs, formats)]
+        try:
+            from importlib.metadata import entry_points
+        except ImportError:
+            try:
+                from pkg_resources import iter_entry_points
+            except ImportError:
+                iter_entry_points = lambda name: []
+            groups = dict((name, list(iter_entry_points(name))) for name in names)
+        else:
+            eps = entry_points()
+            if hasattr(eps, 'select'):
+                groups = dict((name, list(eps.select(group=name))) for name in names)
+            else:
+                # Python < 3.10: dict of the entry points by group
+                groups = dict((name, list(eps.get(name, []))) for name in names)
+        _entry_point_groups = groups
+    return _entry_point_groups.get(group, [])
+
+
+class ClassRegistry(Mapping):
+    """
+    Read-only mapping of names to the codec or format classes of one kind,
+    shared by all the Converter objects.
+
+    The mapping is filled on its first lookup, from the class list of the
+    module where the built-in classes are defined (which is only imported
+    then) and from the classes published by other packages in the entry
+    point group. An entry point may refer to a class or to a list of
+    classes, for instance in the setup.py of a plugin package:
+
+        entry_points={
+            'converter.video_codecs': ['av1 = mypackage.codecs:Av1Codec'],
+        }
+
+    Classes can also be added at run time with register().
+    """
+
+    def __init__(self, module, attr, name_attr, group):
+        self.module = module
+        self.attr = attr
+        self.name_attr = name_attr
+        self.group = group
+        self._classes = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        classes = {}
+        for cls in getattr(importlib.import_module(self.module), self.attr):
+            classes[getattr(cls, self.name_attr)] = cls
+
+        for ep in _entry_points(self.group):
+            try:
+                loaded = ep.load()
+            except Exception:
+                logger.warning('Failed to load %s entry point %s', self.group, ep.name, exc_info=True)
+                continue
+            for cls in loaded if isinstance(loaded, (list, tuple)) else [loaded]:
+                classes[getattr(cls, self.name_attr)] = cls
+        return classes
+
+    @property
+    def classes(self):
+        if self._classes is None:
+            with self._lock:
+                if self._classes is None:
+                    self._classes = self._load()
+        return self._classes
+
+    def register(self, cls):
+        """
+        Add a codec or format class, replacing the class of the same name.
+        """
+        with self._lock:
+            classes = dict(self._classes if self._classes is not None else self._load())
+            classes[getattr(cls, self.name_attr)] = cls
+            self._classes = classes
+
+    def __getitem__(self, name):
+        return self.classes[name]
+
+    def __contains__(self, name):
+        return name in self.classes
+
+    def __iter__(self):
+        return iter(self.classes)
+
+    def __len__(self):
+        return len(self.classes)
+
+
+video_codecs = ClassRegistry('converter.avcodecs', 'video_codec_list', 'codec_name', 'converter.video_codecs')
+audio_codecs = ClassRegistry('converter.avcodecs', 'audio_codec_list', 'codec_name', 'converter.audio_codecs')
+subtitle_codecs = ClassRegistry('converter.avcodecs', 'subtitle_codec_list', 'codec_name',
+                                'converter.subtitle_codecs')
+decoder_codecs = ClassRegistry('converter.avcodecs', 'decoder_codec_list', 'codec_name', 'converter.decoder_codecs')
+formats = ClassRegistry('converter.formats', 'format_list', 'format_name', 'converter.formats')
@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class Option(object):
+    """
+    Declarative description of an encoder option: its type, its valid
+    values (choices, or a min/max range), the ffmpeg flag it sets (default:
+    '-' and the option name) and the value used instead of an invalid one
+    (default; None drops the option).
+
+    Options with param set are not ffmpeg flags but items of the encoder
+    parameter list (like -x265-params): 'name=value', or 'name' and
+    'no-name' for booleans and for the off value. Booleans which are not
+    negatable are dropped when false.
+    """
+
+    def __init__(self, type=str, flag=None, choices=None, min=None, max=None, default=None,
+                 param=False, off=None, negatable=True):
+        self.type = type
+        self.flag = flag
+        self.choices = frozenset(choices) if choices is not None else None
+        self.min = min
+        self.max = max
+        self.default = default
+        self.param = param
+        self.off = off
+        self.negatable = negatable
+
+    def validator(self):
+        """
+        Return a function checking a value of the option.
+        """
+        choices, low, high, off = self.choices, self.min, self.max, self.off
+        if choices is not None:
+            valid = choices.__contains__
+        elif low is not None and high is not None:
+            valid = lambda value: low <= value <= high
+        elif low is not None:
+            valid = lambda value: low <= value
+        elif high is not None:
+            valid = lambda value: value <= high
+        else:
+            return None
+        if off is not None:
+            return lambda value: value == off or valid(value)
+        return valid
+
+    def renderer(self, name):
+        """
+        Return a function giving the option list items of a value.
+        """
+        if self.param:
+            if self.type is bool:
+                negatable = self.negatable
+                return lambda value: [name] if value else (['no-' + name] if negatable else [])
+            off = self.off
+            return lambda value: ['no-' + name] if value == off else ['{0}={1}'.format(name, value)]
+
+        flag = self.flag or '-' + name
+        if self.type is bool:
+            return lambda value: [flag, str(int(value))]
+        return lambda value: [flag, str(value)]
+
+
+class Schema(object):
+    """
+    Ordered encoder options of a codec class, compiled once in a list of
+    (name, validator, renderer, default) steps, so producing the option
+    list of an encoder only goes through the steps of the given options.
+
+    >>> schema = Schema('libx264', [
+    ...     ('preset', Option(choices=['fast', 'medium', 'slow'], default='medium')),
+    ...     ('quality', Option(int, flag='-crf', min=0, max=51)),
+    ... ])
+    >>> schema.emit({'preset': 'slow', 'quality': 20})
+    ['-preset', 'slow', '-crf', '20']
+    """
+
+    def __init__(self, encoder, options, params_flag=None):
+        self.encoder = encoder
+        self.options = list(options)
+        self.params_flag = params_flag
+        self._steps = [(name, opt.validator(), opt.renderer(name), opt.default, opt.param)
+                       for name, opt in self.options]
+        self._positions = dict((name, pos) for pos, (name, _) in enumerate(self.options))
+
+    def types(self):
+        """
+        Return the option types, for the encoder_options of the codec class.
+        """
+        return dict((name, opt.type) for name, opt in self.options)
+
+    def extend(self, options, params_flag=None):
+        """
+        Return a new schema with more options, for codec subclasses.
+        """
+        return Schema(self.encoder, self.options + list(options), params_flag or self.params_flag)
+
+    def emit(self, safe):
+        """
+        Return the ffmpeg option list of the options in safe (the output
+        of safe_options()), logging and replacing the invalid values.
+        """
+        optlist = []
+        params = []
+        steps = self._steps
+        positions = self._positions
+        for pos in sorted(positions[name] for name in safe if name in positions):
+            name, valid, render, default, param = steps[pos]
+            value = safe[name]
+            if valid is not None and not valid(value):
+                logger.error('%s is not a valid %s for %s encoder ...', value, name, self.encoder)
+                if default is None:
+                    continue
+                value = default
+            if param:
+                params.extend(render(value))
+            else:
+                optlist.extend(render(value))
+
+        if params:
+            optlist.extend([self.params_flag, ':'.join(params)])
+        return optlist
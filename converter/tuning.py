@@ -0,0 +1,322 @@
+#!/usr/bin/env python
+
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+from converter.cache import fingerprint
+
+logger = logging.getLogger(__name__)
+
+
+def cpu_count():
+    try:
+        return multiprocessing.cpu_count()
+    except NotImplementedError:
+        return 1
+
+
+def sample_windows(duration, count, length):
+    """
+    Return the start times of count windows of length seconds spread
+    evenly over duration seconds, away from the very beginning and end
+    (intros and credits are rarely representative).
+
+    >>> sample_windows(100, 3, 4)
+    [23.0, 48.0, 73.0]
+    """
+    if duration <= length:
+        return [0.0]
+    count = max(1, min(count, int(duration // length)))
+    step = float(duration) / (count + 1)
+    return [round(step * (idx + 1) - length / 2.0, 3) for idx in range(count)]
+
+
+def run_parallel(fn, items, workers):
+    """
+    Return [fn(item) for item in items], computed by up to workers threads.
+    The first exception raised by fn is raised again once all the threads
+    are done.
+    """
+    items = list(items)
+    results = [None] * len(items)
+    errors = []
+    lock = threading.Lock()
+    pending = list(range(len(items)))
+
+    def work():
+        while True:
+            with lock:
+                if not pending or errors:
+                    return
+                idx = pending.pop(0)
+            try:
+                results[idx] = fn(items[idx])
+            except Exception as e:
+                with lock:
+                    errors.append(e)
+
+    threads = [threading.Thread(target=work) for _ in range(max(1, min(workers, len(items))))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0]
+    return results
+
+
+class SampleTuner(object):
+    """
+    Base class of the tuners choosing encoder options by encoding short
+    windows of the source, several of them at once. The decisions are kept
+    in memory (up to MAX_DECISIONS) under a key given by the subclass.
+    """
+
+    MAX_DECISIONS = 256
+
+    def __init__(self, converter, samples=3, sample_time=4, workers=None):
+        self.converter = converter
+        self.samples = samples
+        self.sample_time = sample_time
+        self.workers = workers or cpu_count()
+        self._decisions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _cached(self, key):
+        with self._lock:
+            decision = self._decisions.pop(key, None)
+            if decision is not None:
+                self._decisions[key] = decision
+            return decision
+
+    def _store(self, key, decision):
+        with self._lock:
+            self._decisions[key] = decision
+            while len(self._decisions) > self.MAX_DECISIONS:
+                self._decisions.popitem(last=False)
+
+    def _probe(self, infile):
+        from converter import ConverterError
+        info = self.converter.probe(infile)
+        if info is None or 'video' not in info:
+            raise ConverterError("Can't get video information about source file")
+        return info
+
+    def _encode_sample(self, infile, info, video, start, outfile):
+        """
+        Encode the window of the source video starting at start with the
+        video options, and return the elapsed time.
+        """
+        from converter import Converter
+        options = Converter._source_options({
+            'format': 'mkv',
+            'video': video,
+            'start': start,
+            'duration': self.sample_time,
+        }, info)
+        optlist = self.converter.parse_options(options)
+        begin = time.time()
+        # no timeout: the signal based timeout only works in the main thread
+        for _ in self.converter.ffmpeg.convert(infile, outfile, optlist, timeout=None):
+            pass
+        return time.time() - begin
+
+    def _encode_samples(self, infile, info, videos):
+        """
+        Encode the sample windows of the source with each of the video
+        options, running up to workers encoders at once, each with an
+        equal share of the CPUs. Return, for each video options, the list
+        of (start, elapsed time, output file) of the windows; the files are
+        in a temporary directory which the caller removes.
+        """
+        duration = info['format']['duration']
+        starts = sample_windows(duration, self.samples, self.sample_time)
+        workers = min(self.workers, len(videos) * len(starts))
+        threads = max(1, cpu_count() // workers)
+        tmpdir = tempfile.mkdtemp(prefix='tuning-')
+        jobs = []
+        for vidx, video in enumerate(videos):
+            video = dict(video, threads=threads)
+            for sidx, start in enumerate(starts):
+                jobs.append((video, start, os.path.join(tmpdir, 'sample{0}-{1}.mkv'.format(vidx, sidx))))
+        try:
+            elapsed = run_parallel(lambda job: self._encode_sample(infile, info, *job), jobs, workers)
+        except Exception:
+            shutil.rmtree(tmpdir, ignore_errors=True)
+            raise
+        samples = [(start, t, outfile) for (_, start, outfile), t in zip(jobs, elapsed)]
+        results = [samples[idx:idx + len(starts)] for idx in range(0, len(samples), len(starts))]
+        return tmpdir, workers, results
+
+
+class PresetTuner(SampleTuner):
+    """
+    Choose the x264/x265 preset of a video for a speed target, given as a
+    realtime factor (2.0: encode at least twice as fast as the playback).
+
+    A few windows of the source are encoded at each candidate preset. The
+    encodes run in parallel, so the speed of a preset on the whole machine
+    is estimated from the speed of a sample encode with an equal share of
+    the CPUs, assuming the encoder scales linearly with them: use a target
+    with some margin. The slowest preset meeting the target is chosen,
+    or the fastest one if none does.
+
+    The decision is cached by content class: encoder, source codec,
+    resolution and frame rate.
+
+    >>> tuner = PresetTuner(Converter(), target_speed=2.0)
+    >>> video = {'codec': 'h264', 'quality': 21}
+    >>> video['preset'] = tuner.tune('master.mov', video)
+    """
+
+    PRESETS = ['ultrafast', 'superfast', 'veryfast', 'faster', 'fast', 'medium', 'slow', 'slower', 'veryslow']
+
+    def __init__(self, converter, target_speed=2.0, presets=None, **kwargs):
+        super(PresetTuner, self).__init__(converter, **kwargs)
+        self.target_speed = target_speed
+        # from the fastest to the slowest
+        self.presets = list(presets or self.PRESETS)
+
+    def content_class(self, info, video):
+        v = info['video']
+        return (video.get('codec'), v.get('codec'), v.get('width'), v.get('height'), round(v.get('fps') or 0))
+
+    def tune(self, infile, video, info=None):
+        """
+        Return the preset for the video options (as in the 'video' options
+        of Converter.convert()) of infile.
+        """
+        info = info or self._probe(infile)
+        key = self.content_class(info, video) + (self.target_speed, tuple(self.presets))
+        preset = self._cached(key)
+        if preset is None:
+            measures = self.measure(infile, video, info)
+            preset = self.choose(measures)
+            logger.info('Preset %s for %s (%s)', preset, infile, key)
+            self._store(key, preset)
+        return preset
+
+    def measure(self, infile, video, info=None):
+        """
+        Encode the samples at each preset and return a list of (preset,
+        estimated realtime factor, bytes per second of video) tuples.
+        """
+        info = info or self._probe(infile)
+        tmpdir, workers, results = self._encode_samples(
+            infile, info, [dict(video, preset=preset) for preset in self.presets])
+        try:
+            measures = []
+            for preset, samples in zip(self.presets, results):
+                seconds = min(self.sample_time, info['format']['duration']) * len(samples)
+                elapsed = sum(t for _, t, _ in samples)
+                size = sum(os.path.getsize(f) for _, _, f in samples)
+                measures.append((preset, seconds * workers / elapsed if elapsed else 0.0, float(size) / seconds))
+            return measures
+        finally:
+            shutil.rmtree(tmpdir, ignore_errors=True)
+
+    def choose(self, measures):
+        """
+        Return the slowest preset of measures meeting the speed target.
+        """
+        chosen = measures[0][0]
+        for preset, speed, _ in measures:
+            if speed >= self.target_speed:
+                chosen = preset
+        return chosen
+
+
+class CrfTuner(SampleTuner):
+    """
+    Choose the constant rate factor (quality) of a video for a quality
+    target, per title: easy content gets a higher CRF (fewer bits) than
+    hard content for the same visual quality.
+
+    A few windows of the source are encoded at each candidate CRF, in
+    parallel, and compared to the source with the ffmpeg ssim or psnr
+    filter. The highest CRF whose worst window still reaches the target is
+    chosen, or the lowest CRF if none does.
+
+    The decision is cached by the fingerprint of the source file and the
+    video options, only for local files.
+
+    >>> tuner = CrfTuner(Converter(), metric='ssim', target=0.985)
+    >>> video = {'codec': 'h264', 'preset': 'medium', 'max_width': 1280, 'max_height': 720}
+    >>> video['quality'] = tuner.tune('master.mov', video)
+    """
+
+    CRFS = (18, 21, 24, 27, 30)
+    TARGETS = {'ssim': 0.98, 'psnr': 42.0}
+    # video option of the CRF, by codec (default: quality)
+    CRF_OPTIONS = {'hevc': 'crf'}
+
+    def __init__(self, converter, metric='ssim', target=None, crfs=None, **kwargs):
+        super(CrfTuner, self).__init__(converter, **kwargs)
+        if metric not in self.TARGETS:
+            raise ValueError('Unknown quality metric: ' + str(metric))
+        self.metric = metric
+        self.target = self.TARGETS[metric] if target is None else target
+        self.crfs = sorted(crfs or self.CRFS)
+
+    def tune(self, infile, video, info=None):
+        """
+        Return the CRF for the video options (as in the 'video' options of
+        Converter.convert()) of infile.
+        """
+        option = self.CRF_OPTIONS.get(video.get('codec'), 'quality')
+        video = dict((k, v) for k, v in video.items() if k != option)
+        # only the local files can be fingerprinted, not the URLs
+        key = None
+        if os.path.isfile(infile):
+            key = (fingerprint(infile), json.dumps(video, sort_keys=True, default=repr),
+                   self.metric, self.target, tuple(self.crfs))
+        crf = self._cached(key) if key else None
+        if crf is None:
+            crf = self.choose(self.measure(infile, video, info))
+            logger.info('CRF %s for %s', crf, infile)
+            if key:
+                self._store(key, crf)
+        return crf
+
+    def measure(self, infile, video, info=None):
+        """
+        Encode and score the samples at each CRF and return a list of (CRF,
+        worst score of the samples, bytes per second of video) tuples.
+        """
+        info = info or self._probe(infile)
+        option = self.CRF_OPTIONS.get(video.get('codec'), 'quality')
+        tmpdir, workers, results = self._encode_samples(
+            infile, info, [dict(video, **{option: crf}) for crf in self.crfs])
+        try:
+            seconds = min(self.sample_time, info['format']['duration'])
+            samples = [sample for crf_samples in results for sample in crf_samples]
+            scores = run_parallel(
+                lambda sample: self.converter.ffmpeg.compare(sample[2], infile, [self.metric], sample[0],
+                                                             seconds, timeout=None).get(self.metric, 0.0),
+                samples, workers)
+            measures = []
+            for idx, crf in enumerate(self.crfs):
+                n = len(results[idx])
+                size = sum(os.path.getsize(f) for _, _, f in results[idx])
+                measures.append((crf, min(scores[idx * n:(idx + 1) * n]), float(size) / (seconds * n)))
+            return measures
+        finally:
+            shutil.rmtree(tmpdir, ignore_errors=True)
+
+    def choose(self, measures):
+        """
+        Return the highest CRF of measures whose own score reaches the
+        quality target, or the lowest CRF if none does. The scores don't
+        have to decrease with the CRF.
+        """
+        passing = [crf for crf, score, _ in measures if score >= self.target]
+        if passing:
+            return max(passing)
+        return min(crf for crf, _, _ in measures)
@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+
+"""
+Micro benchmarks, run from the test directory:
+
+    python benchmark.py [benchmark ...]
+
+Without arguments, all the benchmarks are run.
+"""
+
+# modify the path so that parent directory is in it
+import sys
+
+sys.path.append('../')
+
+import os
+import subprocess
+import time
+import timeit
+
+
+def best_of(stmt, setup='pass', number=1, repeat=5):
+    return min(timeit.repeat(stmt, setup, number=number, repeat=repeat)) / number
+
+
+def report(name, seconds):
+    if seconds < 0.001:
+        print('{0:<40} {1:10.3f} us'.format(name, seconds * 1000000))
+    else:
+        print('{0:<40} {1:10.3f} ms'.format(name, seconds * 1000))
+
+
+def bench_import():
+    """
+    Import time of the converter package and cost of the codec and format
+    lookups, in fresh interpreters.
+    """
+    code = ('import time; t = time.time(); import converter; t1 = time.time(); '
+            'from converter import registry; "h264" in registry.video_codecs; '
+            'print("%f %f" % (t1 - t, time.time() - t1))')
+    runs = []
+    for _ in range(5):
+        out = subprocess.check_output([sys.executable, '-c', code], cwd='..')
+        runs.append([float(x) for x in out.split()])
+    report('import converter', min(r[0] for r in runs))
+    report('first codec lookup', min(r[1] for r in runs))
+    report('codec lookup', best_of("'h264' in registry.video_codecs and registry.formats['mp4']",
+                                   'from converter import registry', number=10000))
+
+
+def bench_options():
+    """
+    Cost of producing the ffmpeg options of the encoders with many options.
+    """
+    setup = ('from converter import avcodecs; '
+             'x265 = {"codec": "hevc", "preset": "slow", "crf": 22, "ref": 4, "bframes": 8, "aq-mode": 2, '
+             '"psy-rd": 1.5, "sao": False, "profile": "main10", "keyint": 120}; '
+             'nvenc = {"codec": "h264_nvenc", "preset": "hq", "profile": "high", "level": "4.1", "rc": "vbr", '
+             '"spatial-aq": True, "cq": 19, "qmax": 40}')
+    report('libx265 options', best_of('avcodecs.HEVCCodec().parse_options(x265)', setup, number=2000))
+    report('h264_nvenc options', best_of('avcodecs.H264NvencCodec().parse_options(nvenc)', setup, number=2000))
+
+
+def bench_threads():
+    """
+    Encoding speed of a synthetic 720p source by encoder thread count, with
+    the threading options produced by the codecs.
+    """
+    from converter import avcodecs
+    from converter.ffmpeg import FFMpeg
+
+    ffmpeg = FFMpeg.which('ffmpeg')
+    if not ffmpeg:
+        print('ffmpeg not found, skipped')
+        return
+    frames = 150
+    source = ['-f', 'lavfi', '-i', 'testsrc2=size=1280x720:rate=30', '-frames:v', str(frames)]
+    for cls in (avcodecs.H264Codec, avcodecs.HEVCCodec, avcodecs.Vp8Codec, avcodecs.Ffv1Codec,
+                avcodecs.Mpeg2Codec):
+        for threads in (1, 2, 4, 8):
+            opts = cls().parse_options({'codec': cls.codec_name, 'threads': threads})
+            cmd = [ffmpeg, '-v', 'error', '-y'] + source + opts + ['-f', 'null', '-']
+            t = time.time()
+            if subprocess.call(cmd) != 0:
+                print('{0} not supported, skipped'.format(cls.ffmpeg_codec_name))
+                break
+            print('{0:<40} {1:10.1f} fps'.format('{0} threads={1}'.format(cls.ffmpeg_codec_name, threads),
+                                                 frames / (time.time() - t)))
+
+
+def bench_analyze():
+    """
+    Speed and results of the analysis options on synthetic 60 s MPEG-2
+    clips: a letterboxed progressive one (140 px borders, expected crop
+    1920:792:0:144 with the 4 px padding of parse_crop, not interlaced)
+    and an interlaced one (no crop).
+    """
+    import shutil
+    import tempfile
+    from converter.ffmpeg import FFMpeg
+
+    ffmpeg = FFMpeg.which('ffmpeg')
+    if not ffmpeg:
+        print('ffmpeg not found, skipped')
+        return
+    tmpdir = tempfile.mkdtemp(prefix='bench-')
+    clips = [
+        ('letterboxed', 'testsrc2=size=1920x800:rate=25,pad=1920:1080:0:140', []),
+        ('interlaced', 'testsrc2=size=1920x1080:rate=50,interlace', ['-flags', '+ildct+ilme']),
+    ]
+    variants = [
+        ('full pass', {}),
+        ('split passes', {'split': True}),
+        ('6 samples', {'samples': 6}),
+        ('crop on keyframes', {'skip_frame': 'nokey'}),
+        ('crop at lowres 1', {'lowres': 1}),
+        ('crop scaled 1/4', {'crop_scale': 4}),
+        ('6 samples, cheap crop', {'samples': 6, 'lowres': 1, 'crop_scale': 2}),
+    ]
+    try:
+        f = FFMpeg()
+        for name, source, flags in clips:
+            clip = os.path.join(tmpdir, name + '.mkv')
+            subprocess.check_call([ffmpeg, '-v', 'error', '-f', 'lavfi', '-i', source, '-f', 'lavfi',
+                                   '-i', 'sine=frequency=440', '-t', '60', '-c:v', 'mpeg2video', '-q:v', '4']
+                                  + flags + ['-c:a', 'mp2', clip])
+            for variant, kwargs in variants:
+                t = time.time()
+                result = list(f.analyze(clip, crop=True, timeout=None, **kwargs))[-1]
+                print('{0:<40} {1:10.3f} s   {2}'.format('{0}, {1}'.format(name, variant), time.time() - t, result))
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+def bench_crop():
+    """
+    Cost of parse_crop() on the cropdetect output of a long source (100000
+    frames, with dark scenes giving many border sizes), against the
+    implementation counting each border size with collection.count(), from
+    the output text and from the arrays of the AnalysisParser.
+    """
+    import random
+    from converter import ffmpeg
+    from crop_reference import reference_parse_crop
+
+    rng = random.Random(1)
+    parser = ffmpeg.AnalysisParser()
+    lines = []
+    for _ in range(100000):
+        x, y = 4 * rng.randint(0, 3), 140 + 2 * rng.randint(-2, 2)
+        if rng.random() < 0.1:
+            # dark scene
+            x, y = rng.randint(0, 480), rng.randint(0, 270)
+        line = 'crop={0}:{1}:{2}:{3}'.format(1920 - 2 * x, 1080 - 2 * y, x, y)
+        lines.append(line)
+        parser.feed(line)
+    data = '\n'.join(lines)
+    size = (1920, 1080)
+    numpy = ffmpeg._numpy
+    report('reference parse_crop, text', best_of(lambda: reference_parse_crop(data, size, 25), repeat=3))
+    try:
+        for name, module in [('numpy', numpy()), ('python', None)]:
+            if name == 'numpy' and module is None:
+                print('numpy not installed, skipped')
+                continue
+            ffmpeg._numpy = lambda: module
+            report('parse_crop ({0}), text'.format(name), best_of(lambda: ffmpeg.parse_crop(data, size, 25)))
+            report('parse_crop ({0}), arrays'.format(name),
+                   best_of(lambda: ffmpeg.parse_crop(parser.crops, size, 25)))
+    finally:
+        ffmpeg._numpy = numpy
+
+
+BENCHMARKS = [
+    ('import', bench_import),
+    ('options', bench_options),
+    ('threads', bench_threads),
+    ('analyze', bench_analyze),
+    ('crop', bench_crop),
+]
+
+
+if __name__ == '__main__':
+    names = sys.argv[1:] or [name for name, _ in BENCHMARKS]
+    for name, fn in BENCHMARKS:
+        if name in names:
+            fn()
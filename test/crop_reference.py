@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+
+"""
+parse_crop() as it was before the border histograms (collection.count()
+for each border size), the reference of the differential test and of the
+benchmark.
+"""
+
+import re
+
+from converter.ffmpeg import FFMpegConvertError
+
+
+def reference_parse_crop(data, size, fps):
+    width, height = size
+    # Maximum width and height of a black border.
+    x_limit = width / 4
+    y_limit = height / 4
+    # Get all the only positive crop values.
+    matches = re.findall('crop=(\d{1,4}):(\d{1,4}):(\d{1,3}):(\d{1,3})', data)
+    if not matches:
+        raise FFMpegConvertError('No crop data.', None, data)
+
+    # For each crop values, get or calculate the left, right, top and bottom
+    # values.
+    values = (
+        (
+            int(x), width - int(x) - int(crop_width),
+            int(y), height - int(y) - int(crop_height)
+        )
+        for crop_width, crop_height, x, y in matches
+    )
+    # Regroup values by side.
+    values = list(zip(*values))
+
+    # Count the number of occurences of each width/height.
+    def counter(collection, limit):
+        counted = {}
+        for item in set(collection):
+            if item > limit:
+                continue
+            counted[item] = collection.count(item)
+        return counted
+
+    results = {
+        'left': counter(values[0], x_limit),
+        'right': counter(values[1], x_limit),
+        'top': counter(values[2], y_limit),
+        'bottom': counter(values[3], y_limit),
+    }
+
+    # For each side find the larger gap between the number of frames of each
+    # dimension and keep the dimension before the gap.
+
+    try:
+        iteritems = results.iteritems()
+    except AttributeError:
+        iteritems = results.items()
+
+    for pos, result in iteritems:
+        if result:
+            dims = list(result.keys())
+            try:
+                dims.sort()
+            except AttributeError:
+                sorted(dims)
+
+            length = width if pos in ('left', 'right') else height
+            threshold = int(round(length * 0.03))
+            gap_coord = 0
+
+            largest_gap = 0
+            dim = dims[0]
+            for idx in range(len(dims) - 1):
+                # If we already found a gap, stop looking for another one too
+                # far away.
+                if gap_coord and dims[idx] - gap_coord > threshold:
+                    break
+                gap = result[dims[idx]] - result[dims[idx + 1]]
+                if gap >= largest_gap:
+                    largest_gap = gap
+                    dim = dims[idx]
+                    gap_coord = dim
+            else:
+                # Check last value.
+                if result[dims[-1]] >= largest_gap:
+                    dim = dims[-1]
+            # Add a bit of padding to crop blurry transition.
+            if dim:
+                dim += 4  # add some padding
+        else:
+            dim = 0
+
+        results[pos] = dim
+
+    x_sub = float(results['left'] + results['right'])
+    y_sub = float(results['top'] + results['bottom'])
+
+    if width <= 720 and height <= 576 and x_sub / width < 0.06 and y_sub / height < 0.05:
+        # Here we are dealing with NTSC/PAL artifacts, not with pillars, etc.
+        # Recalculate the smaller crop to keep the ratio intact.
+        if x_sub / width > y_sub / height:
+            final_y_sub = int(round(x_sub * height / width))
+            delta_y_sub = final_y_sub - y_sub
+            delta_top_sub = int(round(delta_y_sub / 2))
+            results['top'] += delta_top_sub
+            results['bottom'] += int(delta_y_sub) - delta_top_sub
+        else:
+            final_x_sub = int(round(y_sub * width / height))
+            delta_x_sub = final_x_sub - x_sub
+            delta_left_sub = int(round(delta_x_sub / 2))
+            results['left'] += delta_left_sub
+            results['right'] += int(delta_x_sub) - delta_left_sub
+
+        x_sub = results['left'] + results['right']
+        y_sub = results['top'] + results['bottom']
+        crop_width = int(width - x_sub)
+        crop_height = int(height - y_sub)
+
+    else:
+        # Round to multiple of 2 for pillars because there will be no scaling.
+        base_width = int(width - x_sub)
+        base_height = int(height - y_sub)
+        crop_width = base_width / 2 * 2
+        crop_height = base_height / 2 * 2
+        if x_sub:
+            results['left'] = int(round(results['left'] * (width - crop_width) / x_sub))
+        if y_sub:
+            results['top'] = int(round(results['top'] * (height - crop_height) / y_sub))
+
+    return '{0}:{1}:{2}:{3}'.format(int(crop_width), int(crop_height), results['left'], results['top'])
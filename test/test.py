@@ -8,11 +8,14 @@ sys.path.append('../')
 import random
 import string
 import shutil
+import subprocess
 import unittest
 import os
 from os.path import join as pjoin
 
-from converter import ffmpeg, formats, avcodecs, Converter, ConverterError
+from converter import ffmpeg, formats, avcodecs, filters, registry, schema, tuning, Converter, ConverterError, \
+    LoudnessCache, PassLogCache, ResultCache
+from crop_reference import reference_parse_crop
 
 
 def verify_progress(p):
@@ -165,6 +168,46 @@ class TestFFMpeg(unittest.TestCase):
         p.terminate()
         self.assertRaisesSpecific(ffmpeg.FFMpegConvertError, list, conv)
 
+    def test_ffmpeg_stream_options(self):
+        with open('test.aac', 'rb') as f:
+            self.assertTrue(ffmpeg.FFMpeg.is_stream(f))
+        self.assertTrue(ffmpeg.FFMpeg.is_stream(iter([b'data'])))
+        self.assertFalse(ffmpeg.FFMpeg.is_stream('test.aac'))
+
+        self.assertEqual(['-movflags', 'frag_keyframe+empty_moov+default_base_moof', '-c', 'copy', '-f', 'mp4'],
+                         ffmpeg.FFMpeg._pipe_output_options(['-c', 'copy', '-f', 'mp4']))
+        self.assertEqual(['-c', 'copy', '-f', 'matroska'],
+                         ffmpeg.FFMpeg._pipe_output_options(['-c', 'copy', '-f', 'matroska']))
+        self.assertRaisesSpecific(ffmpeg.FFMpegError, ffmpeg.FFMpeg._pipe_output_options, ['-c', 'copy'])
+
+    def test_ffmpeg_shared(self):
+        paths = []
+        for name in ('ffmpeg', 'ffprobe'):
+            paths.append(pjoin(self.temp_dir, name))
+            with open(paths[-1], 'w') as f:
+                f.write('#!/bin/sh\n')
+            os.chmod(paths[-1], 0o755)
+
+        f = ffmpeg.FFMpeg.shared(*paths)
+        self.assertTrue(f is ffmpeg.FFMpeg.shared(*paths))
+        self.assertTrue(f is Converter.shared(*paths).ffmpeg)
+        self.assertTrue(Converter.shared(*paths) is Converter.shared(*paths))
+
+        # A changed binary gives a new object.
+        c = Converter.shared(*paths)
+        os.utime(paths[0], (0, 0))
+        self.assertFalse(f is ffmpeg.FFMpeg.shared(*paths))
+        self.assertFalse(c is Converter.shared(*paths))
+        self.assertTrue(c.ffmpeg is f)
+
+        old_path = os.environ.get('PATH', '')
+        os.environ['PATH'] = self.temp_dir + ':' + old_path
+        try:
+            self.assertEqual(paths[1], ffmpeg.FFMpeg.which('ffprobe'))
+            self.assertEqual(paths[1], ffmpeg.FFMpeg.which('ffprobe'))
+        finally:
+            os.environ['PATH'] = old_path
+
     def test_ffmpeg_thumbnail(self):
         f = ffmpeg.FFMpeg()
         thumb = self.shot_file_path
@@ -248,6 +291,139 @@ class TestFFMpeg(unittest.TestCase):
         self.assertEqual(['-vcodec', 'doctest', '-s', '320x240'],
                          c.parse_options({'codec': 'doctest', 'src_width': 640, 'src_height': 480, 'height': 240}))
 
+    def test_registry(self):
+        self.assertTrue(registry.video_codecs['h264'] is avcodecs.H264Codec)
+        self.assertTrue(None in registry.audio_codecs)
+        self.assertEqual(len(formats.format_list), len(registry.formats))
+
+        class DummyFormat(formats.BaseFormat):
+            format_name = 'mp4'
+            ffmpeg_format_name = 'dummy'
+
+        formats_registry = registry.ClassRegistry('converter.formats', 'format_list', 'format_name',
+                                                  'converter.formats')
+        formats_registry.register(DummyFormat)
+        self.assertTrue(formats_registry['mp4'] is DummyFormat)
+        self.assertTrue(registry.formats['mp4'] is formats.Mp4Format)
+
+    def test_filter_graph(self):
+        graph = filters.FilterGraph('v', 1920, 1080)
+        graph.add('crop=1920:1080:0:0')
+        graph.crop(1920, 816, 0, 132)
+        graph.crop(1900, 800, 10, 8)
+        graph.scale(1280, 540)
+        graph.scale(640, 270, 'auto')
+        graph.rotate(90)
+        self.assertEqual(['-vf', 'crop=1900:800:10:140,scale=640:270:flags=area,transpose=1'], graph.options())
+        self.assertEqual((270, 640), (graph.width, graph.height))
+        self.assertEqual('[0:v]crop=1900:800:10:140,scale=640:270:flags=area,transpose=1[out]',
+                         graph.complex(output='out'))
+
+        graph = filters.FilterGraph('v', 1280, 720)
+        graph.scale(1280, 720)
+        self.assertEqual([], graph.options())
+        self.assertEqual(None, graph.complex())
+
+        c = avcodecs.H264Codec()
+        self.assertEqual(['-c:v', 'libx264', '-pix_fmt', 'yuv420p', '-aspect', '1280:720', '-vf', 'crop=1280:720:0:0'],
+                         c.parse_options({'codec': 'h264', 'src_width': 1280, 'src_height': 800,
+                                          'crop': '1280:720:0:0'}))
+
+    def test_sizing_policy(self):
+        c = avcodecs.H264Codec()
+        opts = {'codec': 'h264', 'src_width': 1920, 'src_height': 1080, 'max_width': 640, 'max_height': 640}
+        opts['sizing_policy'] = 'Fill'
+        self.assertEqual(['-c:v', 'libx264', '-pix_fmt', 'yuv420p', '-aspect', '640:640',
+                          '-vf', 'scale=1138:640,crop=640:640:249:0'], c.parse_options(opts))
+        opts.update(max_width=640, max_height=480)
+        self.assertEqual(['-aspect', '640:480', '-vf', 'scale=854:480,crop=640:480:106:0'],
+                         c.parse_options(opts)[4:])
+        self.assertEqual(['-aspect', '640:480', '-vf', 'scale=854:480:flags=area,crop=640:480:106:0'],
+                         c.parse_options(dict(opts, scaler='auto'))[4:])
+        opts.update(src_width=1080, src_height=1920)
+        self.assertEqual(['-aspect', '640:480', '-vf', 'scale=640:1138,crop=640:480:0:329'],
+                         c.parse_options(opts)[4:])
+        opts['sizing_policy'] = 'ShrinkToFill'
+        self.assertEqual(['-aspect', '640:480', '-vf', 'scale=640:1138,crop=640:480:0:329'],
+                         c.parse_options(opts)[4:])
+        opts.update(max_width=3840, max_height=2160)
+        self.assertEqual(['-aspect', '1080:1920'], c.parse_options(opts)[4:])
+        opts['sizing_policy'] = 'Fit'
+        self.assertEqual(['-aspect', '1216:2160', '-vf', 'scale=1216:2160'], c.parse_options(opts)[4:])
+
+    def test_codec_schema(self):
+        s = schema.Schema('test', [
+            ('preset', schema.Option(choices=['fast', 'slow'], default='fast')),
+            ('gop', schema.Option(int, flag='-g', min=1)),
+            ('cabac', schema.Option(bool)),
+            ('rdoq', schema.Option(int, min=0, max=2, off=-1, param=True)),
+            ('sao', schema.Option(bool, param=True)),
+        ], params_flag='-test-params')
+        self.assertEqual({'preset': str, 'gop': int, 'cabac': bool, 'rdoq': int, 'sao': bool}, s.types())
+        self.assertEqual(['-preset', 'fast', '-cabac', '0', '-test-params', 'rdoq=2:no-sao'],
+                         s.emit({'sao': False, 'rdoq': 2, 'gop': 0, 'cabac': False, 'preset': 'medium'}))
+        self.assertEqual(['-g', '25', '-test-params', 'no-rdoq'], s.emit({'gop': 25, 'rdoq': -1}))
+
+        self.assertEqual(['-c:v', 'libx265', '-pix_fmt', 'yuv420p', '-preset', 'slow',
+                          '-x265-params', 'profile=main10:level-idc=0:crf=22.0:no-sao'],
+                         avcodecs.HEVCCodec().parse_options({'codec': 'hevc', 'sao': False, 'crf': 22,
+                                                             'level-idc': '9', 'profile': 'main10',
+                                                             'preset': 'slow'}))
+
+    def test_codec_threads(self):
+        self.assertEqual(['-c:v', 'libx264', '-pix_fmt', 'yuv420p', '-threads', '8', '-x264-params', 'sliced-threads=1'],
+                         avcodecs.H264Codec().parse_options({'codec': 'h264', 'threads': 8, 'thread_type': 'slice'}))
+        self.assertEqual(['-c:v', 'libx265', '-pix_fmt', 'yuv420p', '-x265-params', 'pools=4'],
+                         avcodecs.HEVCCodec().parse_options({'codec': 'hevc', 'threads': 4}))
+        self.assertEqual(['-c:v', 'ffv1', '-pix_fmt', 'yuv420p', '-threads', '8', '-slices', '9'],
+                         avcodecs.Ffv1Codec().parse_options({'codec': 'ffv1', 'threads': 8}))
+        self.assertEqual(['-c:v', 'h264_nvenc', '-pix_fmt', 'yuv420p'],
+                         avcodecs.H264NvencCodec().parse_options({'codec': 'h264_nvenc', 'threads': 8}))
+
+        opts = avcodecs.DecoderNullCodec().parse_options({'codec': None, 'threads': 2}) + ['-c:v', 'libx264']
+        self.assertEqual(['-threads', '2'], ffmpeg.FFMpeg._input_options(opts))
+        self.assertEqual(['-c:v', 'libx264'], opts)
+
+    def test_webm_codecs(self):
+        self.assertEqual(['-c:v', 'libvpx-vp9', '-pix_fmt', 'yuv420p', '-threads', '8', '-crf', '31',
+                          '-cpu-used', '4', '-row-mt', '1', '-tile-columns', '2', '-b:v', '0'],
+                         avcodecs.Vp9Codec().parse_options({'codec': 'vp9', 'quality': 31, 'cpu-used': 4,
+                                                            'threads': 8, 'src_width': 1280}))
+        self.assertEqual(['-c:v', 'libsvtav1', '-pix_fmt', 'yuv420p', '-preset', '10', '-crf', '35',
+                          '-svtav1-params', 'lp=16:film-grain=8'],
+                         avcodecs.Av1SvtCodec().parse_options({'codec': 'av1', 'preset': 10, 'quality': 35,
+                                                               'threads': 16, 'film-grain': 8}))
+        self.assertEqual(['-c:a', 'libopus', '-ab', '96k', '-ar', '48000'],
+                         avcodecs.OpusCodec().parse_options({'codec': 'opus', 'bitrate': 96, 'samplerate': 44100}))
+
+        c = Converter()
+        self.assertEqual(['-c:a', 'libopus', '-c:v', 'libvpx-vp9', '-pix_fmt', 'yuv420p', '-sn', '-f', 'webm'],
+                         c.parse_options({'format': 'webm', 'audio': {'codec': 'opus'}, 'video': {'codec': 'vp9'}}))
+        self.assertRaisesSpecific(ConverterError, c.parse_options,
+                                  {'format': 'webm', 'audio': {'codec': 'aac'}, 'video': {'codec': 'vp9'}})
+        self.assertRaisesSpecific(ConverterError, c.parse_options,
+                                  {'format': 'webm', 'audio': {'codec': 'opus'}, 'video': {'codec': 'h264'}})
+
+    def test_avcodecs_compatible(self):
+        video = {'codec': 'h264', 'width': 1280, 'height': 720, 'pix_fmt': 'yuv420p', 'fps': 25.0,
+                 'bitrate': 3.2, 'profile': 'high', 'level': 4.0}
+        opt = {'codec': 'h264', 'src_width': 1280, 'src_height': 720, 'bitrate': 4, 'profile': 'high'}
+        c = avcodecs.H264Codec()
+        self.assertTrue(c.is_compatible(opt, video))
+        self.assertFalse(c.is_compatible(dict(opt, bitrate=2), video))
+        self.assertFalse(c.is_compatible(dict(opt, max_width=640, max_height=360, sizing_policy='Fit'), video))
+        self.assertFalse(c.is_compatible(dict(opt, profile='main'), video))
+        self.assertFalse(avcodecs.HEVCNvencCodec().is_compatible({'codec': 'hevc_nvenc'}, video))
+        self.assertTrue(avcodecs.H264NvencCodec().is_compatible(
+            {'codec': 'h264_nvenc', 'src_width': 1280, 'src_height': 720}, video))
+
+        audio = {'codec': 'aac', 'channels': 2, 'samplerate': 48000, 'bitrate': 128}
+        c = avcodecs.AacCodec()
+        self.assertTrue(c.is_compatible({'codec': 'aac', 'channels': 2, 'bitrate': 160}, audio))
+        self.assertFalse(c.is_compatible({'codec': 'aac', 'channels': 1}, audio))
+        self.assertFalse(c.is_compatible({'codec': 'aac', 'samplerate': 44100}, audio))
+        self.assertFalse(avcodecs.AudioCopyCodec().is_compatible({'codec': 'copy'}, audio))
+
     def test_converter(self):
         c = Converter()
 
@@ -296,6 +472,82 @@ class TestFFMpeg(unittest.TestCase):
 
         self.assertTrue(verify_progress(conv))
 
+    def test_converter_multi_filters(self):
+        optlists = [
+            ['-c:v', 'libx264', '-s', '1280x720', '-vf', 'crop=704:400:8:0,yadif', '-an', '-sn'],
+            ['-c:v', 'libx264', '-s', '640x360', '-vf', 'crop=704:400:8:0,yadif', '-an', '-sn'],
+            ['-c:a', 'copy', '-vn', '-sn'],
+        ]
+        graph = Converter._split_video_filters(optlists)
+        self.assertEqual('[0:v]crop=704:400:8:0,yadif,split=2[s0][s1];'
+                         '[s0]scale=1280:720[v0];[s1]scale=640:360[v1]', graph)
+        self.assertEqual(['-map', '[v0]', '-c:v', 'libx264', '-an', '-sn'], optlists[0])
+        self.assertEqual(['-map', '[v1]', '-c:v', 'libx264', '-an', '-sn'], optlists[1])
+        self.assertEqual(['-map', '0:a:0?', '-c:a', 'copy', '-vn', '-sn'], optlists[2])
+
+        optlists = [['-c:v', 'libx264', '-vf', r"select='eq(n,0)',drawtext=text=a\,b,scale=640:360"],
+                    ['-c:v', 'libx264', '-vf', r"select='eq(n,0)',drawtext=text=a\,b"]]
+        self.assertEqual(r"[0:v]select='eq(n,0)',drawtext=text=a\,b,split=2[s0][s1];"
+                         "[s0]scale=640:360[v0];[s1]null[v1]", Converter._split_video_filters(optlists))
+
+        paths = []
+        for name in ('ffmpeg', 'ffprobe'):
+            paths.append(pjoin(self.temp_dir, name))
+            with open(paths[-1], 'w') as f:
+                f.write('#!/bin/sh\n')
+            os.chmod(paths[-1], 0o755)
+        f = ffmpeg.FFMpeg(*paths)
+        f._run_ffmpeg = lambda infile, cmds, **kwargs: cmds
+        cmds = f.convert_multi('test.aac', [('a.mp3', ['-ss', '10', '-to', '20', '-c:a', 'libmp3lame']),
+                                            ('b.mp3', ['-ss', '10', '-to', '20', '-c:a', 'libmp3lame'])])
+        self.assertEqual([paths[0], '-hide_banner', '-y', '-ss', '10', '-to', '20', '-i', 'test.aac',
+                          '-c:a', 'libmp3lame', 'a.mp3', '-c:a', 'libmp3lame', 'b.mp3'], cmds)
+
+        c = Converter(*paths)
+        audio = {'codec': 'mp3'}
+        self.assertRaisesSpecific(ConverterError, list, c.convert_multi('test.aac', [
+            ('a.mp3', {'format': 'mp3', 'audio': audio, 'start': 10}),
+            ('b.mp3', {'format': 'mp3', 'audio': audio, 'start': 20})]))
+        self.assertEqual(Converter._input_side_options({'start': 10, 'decoder': {'codec': 'h264'}}),
+                         Converter._input_side_options({'start': '10', 'decoder': {'codec': 'h264'}}))
+
+    def test_converter_package_options(self):
+        self.assertEqual(['-map', '[v0]', '-c:v:1', 'libx264', '-b:v:1', '2.5M', '-profile:v:1', 'main'],
+                         Converter._stream_options(
+                             ['-map', '[v0]', '-c:v', 'libx264', '-vb', '2.5M', '-profile:v', 'main'], 'v', 1))
+
+        ladder = [{'max_width': 1920, 'max_height': 1080}, {'max_width': 1280, 'max_height': 720},
+                  {'max_width': 640, 'max_height': 360}]
+        self.assertEqual(ladder[1:], Converter._ladder_rungs(ladder, {'video': {'width': 1280, 'height': 720}}))
+        self.assertEqual(ladder[2:], Converter._ladder_rungs(ladder, {'video': {'width': 320, 'height': 240}}))
+
+        optlist = formats.HlsAbrFormat().parse_options(
+            {'format': 'hls_abr', 'outdir': '/tmp', 'video_streams': 2, 'audio_streams': 1})
+        self.assertEqual('a:0,agroup:audio v:0,agroup:audio v:1,agroup:audio',
+                         optlist[optlist.index('-var_stream_map') + 1])
+
+    def test_converter_compile(self):
+        c = Converter()
+        options = {
+            'format': 'mp4',
+            'audio': {'codec': 'aac', 'bitrate': 128},
+            'video': {'codec': 'h264', 'max_width': 640, 'max_height': 480, 'sizing_policy': 'Fit'}}
+        plan = c.compile(options)
+        self.assertTrue(plan is c.compile(dict(options)))
+        self.assertTrue(plan is c.compile(plan))
+        self.assertRaisesSpecific(ConverterError, c.compile, {'format': 'foo', 'audio': {'codec': 'aac'}})
+
+        info = {'video': {'width': 1920, 'height': 1080}}
+        expected = c.parse_options(c._source_options(options, info))
+        self.assertEqual(expected, plan.optlist(info))
+        self.assertEqual(expected, plan.optlist(info))
+        self.assertEqual(c.parse_options(options, 1), plan.optlist(None, 1))
+        self.assertEqual(c.parse_options(options, 2, 'log'), plan.optlist(None, 2, 'log'))
+
+        # the plan keeps its own copy of the options
+        options['video']['codec'] = 'vp8'
+        self.assertEqual('h264', plan.options()['video']['codec'])
+
     def test_converter_2pass(self):
         c = Converter()
         self.video_file_path = 'xx.ogg'
@@ -314,6 +566,337 @@ class TestFFMpeg(unittest.TestCase):
 
         self._assert_converted_video_file()
 
+    def test_converter_segment_bounds(self):
+        keyframes = [0.0, 2.0, 4.0, 300.0, 302.0, 600.5, 601.0]
+        self.assertEqual([[0, 300.0], [300.0, 600.5], [600.5, 700]],
+                         Converter._segment_bounds(keyframes, 0, 700, 300))
+        self.assertEqual([[3, 300.0], [300.0, 600.5], [600.5, 601.0]],
+                         Converter._segment_bounds(keyframes, 3, 601.0, 250))
+        self.assertEqual([[0, 5]], Converter._segment_bounds([0.0, 2.0, 4.0], 0, 5, 300))
+
+    def test_converter_resumable(self):
+        paths = []
+        for name in ('ffmpeg', 'ffprobe', 'source.mkv'):
+            paths.append(pjoin(self.temp_dir, name))
+            with open(paths[-1], 'w') as f:
+                f.write('#!/bin/sh\n')
+            os.chmod(paths[-1], 0o755)
+        c = Converter(paths[0], paths[1])
+        c.ffmpeg = ffmpeg.FFMpeg(paths[0], paths[1])
+        c.ffmpeg.probe = lambda infile, title=None: {
+            'format': {'duration': 10.0}, 'video': {'width': 320, 'height': 240},
+            'audio': {'index': 1, 'samplerate': 48000}}
+        c.ffmpeg.keyframes = lambda infile: [0.0, 4.0, 8.0]
+        measures = []
+        segments = []
+        final = []
+
+        def loudness(infile, stream=None, timeout=10, nice=None):
+            measures.append(infile)
+            yield {'I': -27.61, 'LRA': 18.06, 'TP': -4.47, 'thresh': -39.2}
+        c.ffmpeg.loudness = loudness
+        c.ffmpeg.convert = lambda infile, outfile, opts, timeout=10, nice=None: iter(segments.append(opts) or [])
+        c.ffmpeg.concat = lambda parts, outfile, opts, inputs=None, timeout=10, nice=None: \
+            iter(final.append(opts) or [])
+
+        options = {'format': 'mkv', 'decoder': {'codec': 'h264_cuvid'}, 'audio': {'codec': 'aac', 'loudnorm': True},
+                   'video': {'codec': 'h264'}}
+        list(c.convert_resumable(paths[2], pjoin(self.temp_dir, 'out.mkv'), options,
+                                 pjoin(self.temp_dir, 'job'), segment_time=4))
+        self.assertEqual([paths[2]], measures)
+        self.assertEqual(3, len(segments))
+        self.assertTrue(all('h264_cuvid' in opts for opts in segments))
+        self.assertTrue([a for a in final[0] if a.startswith('loudnorm=') and 'measured_I=-27.61' in a])
+
+    def test_smart_cut(self):
+        c = Converter()
+        source = pjoin(self.temp_dir, 'source.mkv')
+        subprocess.check_call([c.ffmpeg.ffmpeg_path, '-v', 'quiet', '-f', 'lavfi', '-i',
+                               'testsrc=duration=10:size=320x240:rate=25', '-c:v', 'libx264', '-g', '50',
+                               '-y', source])
+        clip = pjoin(self.temp_dir, 'clip.mkv')
+        # 1.3 s and 7.7 s are not keyframes: encoded head and tail, and the
+        # GOPs from 2 s to 6 s copied
+        list(c.smart_cut(source, clip, {'format': 'mkv', 'video': {'codec': 'h264'}, 'start': 1.3, 'end': 7.7}))
+        # within one frame
+        self.assertAlmostEqual(6.4, c.probe(clip)['format']['duration'], delta=0.041)
+
+    def test_preset_tuner(self):
+        self.assertEqual([23.0, 48.0, 73.0], tuning.sample_windows(100, 3, 4))
+        self.assertEqual([0.0], tuning.sample_windows(3, 3, 4))
+        self.assertEqual([1, 4, 9], tuning.run_parallel(lambda x: x * x, [1, 2, 3], 2))
+
+        class Tuner(tuning.PresetTuner):
+            runs = 0
+
+            def measure(self, infile, video, info=None):
+                self.runs += 1
+                return [('veryfast', 6.0, 1000), ('fast', 2.5, 900), ('medium', 1.9, 850), ('slow', 2.1, 800)]
+
+        tuner = Tuner(None, target_speed=2.0)
+        info = {'format': {'duration': 60}, 'video': {'codec': 'h264', 'width': 1920, 'height': 1080, 'fps': 25}}
+        self.assertEqual('slow', tuner.tune('test1.ogg', {'codec': 'hevc'}, info))
+        self.assertEqual('slow', tuner.tune('test.mp3', {'codec': 'hevc', 'quality': 20}, info))
+        self.assertEqual(1, tuner.runs)
+        self.assertEqual('veryfast', tuning.PresetTuner(None, target_speed=8).choose(tuner.measure(None, None)))
+
+    def test_crf_tuner(self):
+        self.assertEqual({'ssim': 0.986, 'psnr': 41.5}, ffmpeg.parse_quality(
+            '[Parsed_ssim_4 @ 0x1] SSIM Y:0.990 (20.0) U:0.980 (17.0) V:0.980 (17.0) All:0.986 (18.5)\n'
+            '[Parsed_psnr_5 @ 0x2] PSNR y:42.1 u:44.0 v:44.2 average:41.5 min:38.2 max:50.1\n'))
+        self.assertEqual({}, ffmpeg.parse_quality('video:10kB audio:0kB'))
+
+        measures = [(18, 0.991, 3000), (21, 0.986, 2400), (24, 0.979, 1900), (27, 0.981, 1500)]
+        self.assertEqual(27, tuning.CrfTuner(None, target=0.98).choose(measures))
+        self.assertEqual(27, tuning.CrfTuner(None, target=0.98).choose(measures[::-1]))
+        self.assertEqual(21, tuning.CrfTuner(None, target=0.985).choose(measures[::-1]))
+        self.assertEqual(18, tuning.CrfTuner(None, target=0.995).choose(measures[::-1]))
+        self.assertEqual(18, tuning.CrfTuner(None, metric='psnr').choose([(18, 40.0, 3000), (21, 38.0, 2400)]))
+        self.assertRaises(ValueError, tuning.CrfTuner, None, metric='vmaf')
+
+        tuner = tuning.CrfTuner(None, target=0.98)
+        runs = []
+        tuner.measure = lambda infile, video, info=None: runs.append(infile) or measures
+        for infile in ['http://example.com/master.mov', 'http://example.com/master.mov', 'test.mp3', 'test.mp3']:
+            self.assertEqual(27, tuner.tune(infile, {'codec': 'h264'}))
+        self.assertEqual(['http://example.com/master.mov', 'http://example.com/master.mov', 'test.mp3'], runs)
+
+    def test_encode_metrics(self):
+        psnr, sizes = ffmpeg.parse_vstats(
+            'out= 0 st= 0 frame=     1 q= 26.0 PSNR= 38.50 f_size=  21480 s_size=      21kB type= I\n'
+            'out= 0 st= 0 frame=     2 q= 28.0 PSNR= inf f_size=    960 s_size=      22kB type= P\n')
+        self.assertEqual([38.5, 100.0], list(psnr))
+        self.assertEqual([21480, 960], list(sizes))
+        self.assertEqual(None, ffmpeg.parse_vstats('frame=     1 q= 26.0 f_size=  21480 s_size= 21kB')[0])
+        self.assertEqual({'mean': 2.5, 'min': 1, 'max': 4, 'p5': 1}, ffmpeg.summarize([4, 1, 3, 2]))
+
+        c = Converter()
+        plan = c.compile({'format': 'mkv', 'video': {'codec': 'h264'}})
+        self.assertTrue(plan is c._metrics_plan(plan, ['psnr']))
+        self.assertTrue('ssim=1' in c._metrics_plan(plan, ['psnr', 'ssim']).optlist())
+        optlist = c._metrics_plan(c.compile({'format': 'mkv', 'video': {'codec': 'hevc'}}), ['ssim']).optlist()
+        self.assertEqual('ssim=1', optlist[optlist.index('-x265-params') + 1])
+        self.assertEqual(['-f', 'segment', '-flags', '-global_header+psnr'],
+                         Converter._with_flags(['-f', 'segment', '-flags', '-global_header'], '+psnr'))
+        self.assertEqual(['-f', 'mp4', '-flags', '+psnr'], Converter._with_flags(['-f', 'mp4'], '+psnr'))
+        self.assertRaisesSpecific(ConverterError, c._metrics_plan, plan, ['vmaf'])
+        self.assertRaisesSpecific(ConverterError, c._metrics_plan,
+                                  c.compile({'format': 'mkv', 'video': {'codec': 'vp9'}}), ['ssim'])
+
+    def test_analyze_merge(self):
+        parser = ffmpeg.AnalysisParser()
+        for line in ['[Parsed_ebur128_0 @ 0x1] t: 0.1 TARGET:-23 LUFS    M: -25.1 S:-120.7     I: -25.1 LUFS',
+                     '[Parsed_cropdetect_1 @ 0x1] x1:0 x2:1919 y1:140 y2:939 w:1920 h:800 x:0 y:140 '
+                     'crop=1920:800:0:140',
+                     '[Parsed_idet_2 @ 0x1] Multi frame detection: TFF:  12 BFF:   0 Progressive:  80 '
+                     'Undetermined:   8',
+                     '  Integrated loudness:', '    I:         -20.0 LUFS', '    Threshold: -30.0 LUFS',
+                     '  True peak:', '    Peak:       -3.0 dBFS']:
+            parser.feed(line)
+        self.assertEqual(([-25.1], [-120.7]), ([round(v, 1) for v in parser.momentary],
+                                                 [round(v, 1) for v in parser.short_term]))
+        self.assertEqual([(1920, 800, 0, 140)], parser.crop_values())
+        self.assertEqual((-20.0, -3.0), (parser.loudness, parser.peak))
+        self.assertEqual([12, 0, 80, 8], parser.interlace_counts())
+        self.assertRaisesSpecific(ffmpeg.FFMpegConvertError, ffmpeg.AnalysisParser().interlace_counts)
+        self.assertTrue(ffmpeg.FFMpeg._interlaced([12, 0, 80, 8]))
+        self.assertFalse(ffmpeg.FFMpeg._interlaced([5, 4, 90, 1]))
+
+        loudness, peak = ffmpeg.merge_loudness([(-20.0, -3.0), (-30.0, -1.5), (-70.0, -60.0), (None, None)])
+        self.assertEqual((-22.6, -1.5), (round(loudness, 1), peak))
+        self.assertEqual((-70.0, -70.0), ffmpeg.merge_loudness([]))
+
+        self.assertEqual([(1920, 800, 0, 140)], ffmpeg.rescale_crop([(480, 200, 0, 35)], 4))
+        opts = ['-skip_frame', 'nokey', '-lowres', '1', '-f', 'null', '-an', '-vf', 'cropdetect']
+        self.assertEqual(['-skip_frame', 'nokey', '-lowres', '1'], ffmpeg.FFMpeg._input_options(opts))
+        self.assertEqual(['-f', 'null', '-an', '-vf', 'cropdetect'], opts)
+
+    def test_analyze_streams(self):
+        opts = ffmpeg.FFMpeg._analyze_options(True, True, False, audio_streams=[1, 3])
+        self.assertEqual(['-f', 'null', '-filter_complex',
+                          '[0:1]ebur128=peak=true:framelog=verbose[a0];[0:3]ebur128=peak=true:framelog=verbose[a1];'
+                          '[0:v:0]idet[v]', '-map', '[a0]', '-map', '[a1]', '-map', '[v]'], opts)
+        self.assertEqual('-vn', ffmpeg.FFMpeg._analyze_options(True, False, False, audio_streams=[1])[-1])
+
+        parser = ffmpeg.StreamsParser([1, 3])
+        for line in ['[Parsed_ebur128_0 @ 0x1] t: 0.1 TARGET:-23 LUFS    M: -25.1 S:-120.7     I: -25.1 LUFS',
+                     '[Parsed_ebur128_1 @ 0x1] t: 0.1 TARGET:-23 LUFS    M: -30.2 S:-120.7     I: -30.2 LUFS',
+                     '[Parsed_idet_2 @ 0x1] Multi frame detection: TFF:   0 BFF:   0 Progressive:  90 '
+                     'Undetermined:  10',
+                     '[Parsed_ebur128_0 @ 0x1] Summary:', '  Integrated loudness:', '    I:         -20.0 LUFS',
+                     '  True peak:', '    Peak:       -3.0 dBFS',
+                     '[Parsed_ebur128_1 @ 0x1] Summary:', '  Integrated loudness:', '    I:         -30.0 LUFS',
+                     '  True peak:', '    Peak:       -6.0 dBFS',
+                     '[out#0/null @ 0x1] video:0kB audio:0kB']:
+            parser.feed(line)
+        self.assertEqual((-20.0, -3.0), (parser.streams[1].loudness, parser.streams[1].peak))
+        self.assertEqual((-30.0, -6.0), (parser.streams[3].loudness, parser.streams[3].peak))
+        self.assertEqual([-30.2], [round(v, 1) for v in parser.streams[3].momentary])
+        self.assertEqual([0, 0, 90, 10], parser.interlace_counts())
+        self.assertEqual(None, parser.loudness)
+
+    def test_analyze_range(self):
+        paths = []
+        for name in ('ffmpeg', 'ffprobe'):
+            paths.append(pjoin(self.temp_dir, name))
+            with open(paths[-1], 'w') as f:
+                f.write('#!/bin/sh\n')
+            os.chmod(paths[-1], 0o755)
+        f = ffmpeg.FFMpeg(*paths)
+        f.probe = lambda infile, title=None: {'format': {'duration': 100.0}, 'video': {'codec': 'h264'}}
+        runs = []
+
+        def convert(infile, outfile, opts, timeout=10, nice=None, parser=None):
+            runs.append(opts[opts.index('-ss'):opts.index('-ss') + 4] if '-ss' in opts else [])
+            parser.feed('[Parsed_idet_0 @ 0x1] Multi frame detection: TFF: 0 BFF: 0 Progressive: 90 Undetermined: 0')
+            return iter([])
+        f.convert = convert
+
+        list(f.analyze('test.aac', start=20, end=60, split=True))
+        self.assertEqual([['-ss', '20.0', '-t', '40.0']] * 2, runs)
+        del runs[:]
+        list(f.analyze('test.aac', audio_level=False, start=20, duration=40, samples=3, sample_time=4))
+        self.assertEqual([['-ss', '28.0', '-t', '4'], ['-ss', '38.0', '-t', '4'], ['-ss', '48.0', '-t', '4']],
+                         sorted(runs))
+        self.assertRaisesSpecific(ffmpeg.FFMpegError, list, f.analyze('test.aac', start=120, split=True))
+
+    def test_inspect_parser(self):
+        parser = ffmpeg.InspectionParser()
+        for line in ['[Parsed_blackdetect_4 @ 0x1] black_start:0 black_end:2.04 black_duration:2.04',
+                     '[Parsed_silencedetect_6 @ 0x1] silence_start: 10.5',
+                     '[h264 @ 0x2] error while decoding MB 12 34, bytestream -5',
+                     '[h264 @ 0x2] concealing 1620 DC, 1620 AC, 1620 MV errors in P frame',
+                     '[Parsed_silencedetect_6 @ 0x1] silence_end: 14 | silence_duration: 3.5',
+                     '[Parsed_silencedetect_6 @ 0x1] silence_start: 58',
+                     '[Parsed_cropdetect_3 @ 0x1] x1:0 x2:1919 y1:140 y2:939 w:1920 h:800 x:0 y:140 '
+                     'crop=1920:800:0:140']:
+            parser.feed(line)
+        self.assertEqual([(0.0, 2.04)], parser.black)
+        self.assertEqual([(10.5, 14.0), (58.0, None)], parser.silence)
+        self.assertEqual(2, parser.decode_errors)
+        self.assertEqual('[h264 @ 0x2] error while decoding MB 12 34, bytestream -5', parser.errors[0])
+        self.assertEqual([(1920, 800, 0, 140)], parser.crop_values())
+
+    def test_parse_crop(self):
+        rng = random.Random(42)
+        numpy = ffmpeg._numpy
+        for size in [(1920, 1080), (720, 576), (720, 480), (640, 480)]:
+            width, height = size
+            for _ in range(20):
+                left, right = rng.randint(0, width // 8), rng.randint(0, width // 8)
+                top, bottom = rng.randint(0, height // 8), rng.randint(0, height // 8)
+                lines = []
+                for _ in range(rng.randint(1, 200)):
+                    # jittering borders, and a few dark scenes cropped much more
+                    l, r = left + rng.randint(-4, 4), right + rng.randint(-4, 4)
+                    t, b = top + rng.randint(-4, 4), bottom + rng.randint(-4, 4)
+                    if rng.random() < 0.1:
+                        l, t = l + rng.randint(0, width // 3), t + rng.randint(0, height // 3)
+                    l, r, t, b = [max(v, 0) for v in (l, r, t, b)]
+                    lines.append('crop={0}:{1}:{2}:{3}'.format(max(width - l - r, 2), max(height - t - b, 2),
+                                                               l, t))
+                data = '\n'.join(lines)
+                expected = reference_parse_crop(data, size, 25)
+                crops = [tuple(int(v) for v in line[5:].split(':')) for line in lines]
+                try:
+                    # with and without NumPy
+                    for module in set([numpy(), None]):
+                        ffmpeg._numpy = lambda: module
+                        self.assertEqual(expected, ffmpeg.parse_crop(data, size, 25))
+                        self.assertEqual(expected, ffmpeg.parse_crop(crops, size, 25))
+                        self.assertEqual(expected, ffmpeg.parse_crop(tuple(zip(*crops)), size, 25))
+                finally:
+                    ffmpeg._numpy = numpy
+        self.assertRaisesSpecific(ffmpeg.FFMpegConvertError, ffmpeg.parse_crop, 'no crop', (1920, 1080), 25)
+
+    def test_loudnorm(self):
+        data = ('[Parsed_loudnorm_0 @ 0x1] \n{\n\t"input_i" : "-27.61",\n\t"input_tp" : "-4.47",\n'
+                '\t"input_lra" : "18.06",\n\t"input_thresh" : "-39.20",\n\t"target_offset" : "0.10"\n}\n')
+        measured = ffmpeg.parse_loudnorm(data)
+        self.assertEqual({'I': -27.61, 'LRA': 18.06, 'TP': -4.47, 'thresh': -39.2}, measured)
+        self.assertRaisesSpecific(ffmpeg.FFMpegConvertError, ffmpeg.parse_loudnorm, 'no audio')
+
+        options = {'format': 'mkv', 'audio': {'codec': 'aac', 'loudnorm': True}}
+        info = {'audio': {'index': 1, 'samplerate': 44100}}
+        audio = Converter._loudnorm_options(options, measured, info)['audio']
+        self.assertEqual(True, options['audio']['loudnorm'])
+        self.assertEqual(['-c:a', 'aac', '-ar', '44100', '-af',
+                          'loudnorm=I=-23.0:LRA=7.0:TP=-2.0:measured_I=-27.61:measured_LRA=18.06:'
+                          'measured_TP=-4.47:measured_thresh=-39.2:linear=true'],
+                         avcodecs.AacCodec().parse_options(audio)[:6])
+        # silence: no linear normalization
+        self.assertEqual('loudnorm=I=-16.0:LRA=7.0:TP=-2.0', avcodecs.AudioCodec.loudnorm_filter(
+            {'I': -16, 'measured_I': float('-inf'), 'measured_LRA': 0.0, 'measured_TP': float('-inf'),
+             'measured_thresh': -70.0}))
+        self.assertEqual(['-c:a', 'aac', '-af', 'volume=-3.5dB'],
+                         avcodecs.AacCodec().parse_options({'codec': 'aac', 'volume': -3.5})[:4])
+        self.assertFalse(avcodecs.AacCodec().is_compatible({'codec': 'aac', 'loudnorm': {}}, {'codec': 'aac'}))
+
+        cache = LoudnessCache(max_entries=1)
+        key = cache.key('test.aac', 1)
+        self.assertEqual(None, cache.get(key))
+        cache.add(key, measured)
+        self.assertEqual(measured, cache.get(key))
+        cache.add(('other', 1), measured)
+        self.assertEqual(None, cache.get(key))
+        self.assertEqual(None, cache.key('http://example.com/master.mov', 1))
+
+    def test_passlog_cache(self):
+        cache = PassLogCache(directory=self.temp_dir, max_entries=1)
+        opts = ['-vcodec', 'libtheora', '-vb', '1.0M', '-f', 'null', '-pass', '1']
+        key = cache.key('test.aac', opts)
+        self.assertEqual(key, cache.key('test.aac', opts[:3] + ['2.5M'] + opts[4:]))
+        self.assertNotEqual(key, cache.key('test.mp3', opts))
+        self.assertEqual(None, cache.key('nonexistent', opts))
+
+        prefix = cache.new_prefix()
+        self.assertEqual(None, cache.get(key))
+        open(prefix + '-0.log', 'w').close()
+        cache.add(key, prefix)
+        self.assertEqual(prefix, cache.get(key))
+
+        # Evicted entries have their files removed, once no longer in use.
+        cache.release(prefix)
+        other = cache.new_prefix()
+        cache.add(cache.key('test.mp3', opts), other)
+        self.assertEqual(None, cache.get(key))
+        self.assertTrue(os.path.exists(prefix + '-0.log'))
+        cache.release(prefix)
+        self.assertFalse(os.path.exists(prefix + '-0.log'))
+        cache.release(other)
+        self.assertTrue(os.path.exists(other))
+
+    def test_result_cache(self):
+        cache = ResultCache(directory=pjoin(self.temp_dir, 'cache'), max_bytes=os.path.getsize('test.mp3'))
+        key = cache.key('test.mp3', ['-c:a', 'copy', '-f', 'mp3'], '.mp3')
+        self.assertEqual(key, cache.key('test.mp3', ['-c:a', 'copy', '-f', 'mp3'], '.mp3'))
+        self.assertNotEqual(key, cache.key('test.mp3', ['-c:a', 'copy', '-f', 'mp3', '-ss', '1'], '.mp3'))
+
+        out = pjoin(self.temp_dir, 'out.mp3')
+        self.assertFalse(cache.get(key, out))
+        shutil.copyfile('test.mp3', out)
+        cache.add(key, out)
+        os.unlink(out)
+        self.assertTrue(cache.get(key, out))
+        self.assertEqual(os.path.getsize('test.mp3'), os.path.getsize(out))
+
+        # Rewriting the output in place (like ffmpeg -y) leaves the cache entry alone.
+        with open(out, 'wb') as f:
+            f.write(b'reencoded')
+        self.assertTrue(cache.get(key, out))
+        with open(out, 'rb') as f, open('test.mp3', 'rb') as g:
+            self.assertTrue(f.read() == g.read())
+
+        stats = cache.stats()
+        self.assertEqual((2, 1, 2.0 / 3), (stats['hits'], stats['misses'], stats['hit_rate']))
+        self.assertEqual(2 * os.path.getsize('test.mp3'), stats['bytes_saved'])
+
+        # Over max_bytes, the least recently used entry is evicted.
+        other = cache.key('test.aac', ['-c:a', 'copy', '-f', 'adts'], '.aac')
+        cache.add(other, 'test.aac')
+        self.assertFalse(cache.get(key, out))
+        self.assertEqual(1, ResultCache(directory=cache.directory).stats()['entries'])
+
     def test_converter_vp8_codec(self):
         c = Converter()
         conv = c.convert('test1.ogg', self.video_file_path, {